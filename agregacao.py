@@ -0,0 +1,175 @@
+import contextvars
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Iterable, List, Sequence
+
+from sqlalchemy import func, select
+from sqlalchemy.pool import StaticPool
+
+from conexoes import MAX_OVERFLOW, POOL_SIZE
+from models import db, Operacoes
+
+# Agregação particionada: a mesma consulta agrupada roda sobre partições
+# disjuntas de Operacoes (faixas de id, de conta ou de meses) ao mesmo tempo,
+# cada uma numa conexão do pool, e os resultados parciais são somados aqui.
+# Ler e agrupar as linhas, a parte pesada, fica com o banco, que atende cada
+# conexão num núcleo; de cada partição volta só o resultado já agrupado, que
+# é combinado no próprio processo.
+#
+# O ganho sobre a execução em série ainda não foi medido: a máquina em que
+# isto foi escrito tem um núcleo só. Meça com benchmarks/bench_agregacao.py
+# no servidor de produção antes de contar com ele.
+
+# Consultas simultâneas por agregação (AGREGACAO_THREADS=1 desliga). O padrão
+# é o número de núcleos, limitado ao tamanho do pool de conexões.
+THREADS_AGREGACAO = int(
+    os.getenv("AGREGACAO_THREADS", str(min(os.cpu_count() or 1, POOL_SIZE)))
+)
+
+
+# Conexões extras do pool que as agregações em paralelo podem usar ao mesmo
+# tempo, somadas as de todas as requisições do processo. Sem esse limite,
+# algumas agregações simultâneas esgotariam o pool, e as demais requisições
+# esperariam até POOL_TIMEOUT por uma conexão. O padrão é metade do pool;
+# para medir mais threads no benchmark, aumente AGREGACAO_CONEXOES.
+CONEXOES_AGREGACAO = int(
+    os.getenv("AGREGACAO_CONEXOES", str(max((POOL_SIZE + MAX_OVERFLOW) // 2, 1)))
+)
+_conexoes_livres = threading.BoundedSemaphore(CONEXOES_AGREGACAO)
+
+
+# Em paralelo só com mais de uma thread e um pool de verdade (o SQLite em
+# memória tem uma única conexão)
+def paralelo_disponivel() -> bool:
+    return THREADS_AGREGACAO > 1 and not isinstance(db.engine.pool, StaticPool)
+
+
+# --- Partições ---
+# Cada partição é uma lista de condições sobre Operacoes. As faixas têm as
+# pontas abertas, então cobrem também valores fora dos limites. Cada partição
+# devolve os seus próprios grupos: dividir por uma coluna do agrupamento
+# (conta, período) evita que o mesmo grupo volte de todas as partições.
+
+
+# Faixas de 'quantidade' valores, com as pontas abertas
+def _faixas(coluna, limites) -> List[list]:
+    particoes = []
+    for i, limite in enumerate(limites):
+        condicoes = []
+        if i > 0:
+            condicoes.append(coluna >= limite)
+        if i + 1 < len(limites):
+            condicoes.append(coluna < limites[i + 1])
+        particoes.append(condicoes)
+    return particoes
+
+
+# Faixas de id: trechos contíguos da tabela (a chave primária é a ordem física
+# no SQLite e no InnoDB), para consultas sem filtro seletivo. Os grupos se
+# repetem entre as faixas, então uma por thread basta.
+def particoes_por_id(quantidade: int) -> List[list]:
+    coluna = Operacoes.operacoes_id
+    menor, maior = db.session.execute(select(func.min(coluna), func.max(coluna))).one()
+    if menor is None:
+        return []
+    total = maior - menor + 1
+    quantidade = max(1, min(quantidade, total))
+    return _faixas(coluna, [menor + total * i // quantidade for i in range(quantidade)])
+
+
+# Faixas de conta, uma a partir de cada conta informada (lidas pelo índice
+# conta + data). Operações sem conta ficam de fora.
+def particoes_por_conta(contas: Iterable[int]) -> List[list]:
+    coluna = Operacoes.operacoes_conta
+    faixas = _faixas(coluna, sorted(contas)) or [[]]
+    return [[coluna.isnot(None), *condicoes] for condicoes in faixas]
+
+
+def _inicio_do_mes(indice: int) -> date:
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+# Até 'quantidade' faixas de meses inteiros entre 'inicio' e 'fim', para
+# consultas já restritas a uma conta (o índice conta + data lê só a faixa; sem
+# ele, cada faixa leria a tabela inteira). Operações sem data ficam de fora.
+def particoes_por_periodo(inicio: date, fim: date, quantidade: int) -> List[list]:
+    coluna = Operacoes.operacoes_data_lancamento
+    primeiro = inicio.year * 12 + inicio.month - 1
+    meses = fim.year * 12 + fim.month - primeiro
+    quantidade = max(1, min(quantidade, meses))
+    limites = [
+        _inicio_do_mes(primeiro + meses * i // quantidade) for i in range(quantidade)
+    ]
+    return [[coluna.isnot(None), *condicoes] for condicoes in _faixas(coluna, limites)]
+
+
+# --- Execução ---
+
+
+# Reserva, sem esperar, até 'quantidade' conexões extras para uma agregação.
+# Devolve quantas conseguiu, ou 0 se forem menos de duas (não compensa).
+def _reservar_conexoes(quantidade: int) -> int:
+    reservadas = 0
+    while reservadas < quantidade and _conexoes_livres.acquire(blocking=False):
+        reservadas += 1
+    if reservadas < 2:
+        for _ in range(reservadas):
+            _conexoes_livres.release()
+        return 0
+    return reservadas
+
+
+# Roda as consultas e devolve as linhas de cada uma, na ordem. Em paralelo,
+# cada consulta usa uma conexão própria do pool (e vê o seu instantâneo do
+# banco, o que basta para relatórios); as threads herdam o contexto da
+# requisição, então o perfil (perfil.py) conta essas consultas. Sem conexões
+# extras livres (CONEXOES_AGREGACAO), roda em série, na conexão da sessão.
+def executar_consultas(consultas: Sequence) -> List[list]:
+    reservadas = 0
+    if len(consultas) > 1 and paralelo_disponivel():
+        reservadas = _reservar_conexoes(min(THREADS_AGREGACAO, len(consultas)))
+    if not reservadas:
+        return [db.session.execute(consulta).all() for consulta in consultas]
+    engine = db.engine
+
+    def executar(consulta):
+        with engine.connect() as conexao:
+            return conexao.execute(consulta).all()
+
+    try:
+        with ThreadPoolExecutor(reservadas) as executor:
+            futuros = [
+                executor.submit(contextvars.copy_context().run, executar, consulta)
+                for consulta in consultas
+            ]
+            return [futuro.result() for futuro in futuros]
+    finally:
+        for _ in range(reservadas):
+            _conexoes_livres.release()
+
+
+# Combina as linhas agrupadas das partições: linhas com os mesmos valores nas
+# demais colunas viram uma só, com as colunas de 'somas' somadas. Vale para
+# SUM e COUNT, que são aditivos (médias e mínimos não se combinam assim).
+def combinar(parciais: Iterable[list], somas: Sequence[str]) -> list:
+    linhas = [linha for parcial in parciais for linha in parcial]
+    if not linhas:
+        return []
+    campos = linhas[0]._fields
+    somadas = [campos.index(nome) for nome in somas]
+    grupo = [i for i in range(len(campos)) if i not in somadas]
+    combinadas = {}
+    for linha in linhas:
+        chave = tuple(linha[i] for i in grupo)
+        atual = combinadas.get(chave)
+        if atual is None:
+            combinadas[chave] = list(linha)
+            continue
+        for i in somadas:
+            if linha[i] is not None:
+                atual[i] = linha[i] if atual[i] is None else atual[i] + linha[i]
+    Linha = namedtuple("Linha", campos, rename=True)
+    return [Linha(*valores) for valores in combinadas.values()]
@@ -1,5 +1,5 @@
 # from flask_sqlalchemy import SQLAlchemy
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, stream_with_context
 from models import (
     db,
     TiposContas,
@@ -11,25 +11,217 @@ from models import (
     FaturasCartoes,
     OperacoesRecorrente,
     Recorrencias,
+    Tarefas,
 )
+from saldos import (
+    apagar_saldos_conta,
+    aplicar_movimento,
+    consultar_saldos,
+    movimento_operacao,
+    reconstruir_saldos_diarios,
+    saldo_consolidado,
+    substituir_movimento,
+    verificar_saldos_diarios,
+)
+from duplicados import fingerprint_operacao, preencher_fingerprints
+from faturas import (
+    FaturaFechada,
+    fechar_faturas,
+    lancamento_na_fatura,
+    registrar_compra_cartao,
+    remover_compra_cartao,
+)
+from projecao import MESES_MAXIMO, MESES_PADRAO, projetar_saldos
+import referencias
+from referencias import fatura_para_dict, invalidar_referencias
+from relatorios import AGRUPAMENTOS, relatorio_categorias
+from colunar import AGRUPAMENTOS_RESUMO, estatisticas_colunar, resumir
+from sincronizacao import (
+    LIMITE_SINCRONIZACAO_MAXIMO,
+    LIMITE_SINCRONIZACAO_PADRAO,
+    alteracoes_desde,
+    iniciar_sincronizacao,
+    registrar_alteracoes,
+    registrar_alteracoes_onde,
+)
+from recorrencias import materializar_recorrencias
+from lotes import LoteInvalido, executar_lote
+from conexoes import estatisticas_pool, opcoes_engine
+from perfil import estatisticas_rotas, iniciar_perfil
+from serializacao import Campo, Objeto, ProvedorJSON, Serializador
+from tarefas import (
+    STATUS_CONCLUIDA,
+    STATUS_ERRO,
+    TIPOS_TAREFAS,
+    apagar_arquivo,
+    enviar_tarefa,
+    iniciar_tarefas,
+    salvar_arquivo,
+    subir_workers,
+    tarefa_por_chave,
+)
+from importacao import (
+    DUPLICADOS_IMPORTAR,
+    DUPLICADOS_PULAR,
+    importar_lancamentos,
+    ler_csv,
+    ler_ofx,
+)
+import click
+import codecs
+import csv
+import hashlib
+import io
 import os
 from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateColumn
+from bisect import bisect_right
 from datetime import date
+from decimal import Decimal, InvalidOperation
 from typing import Union, Tuple
 
-
 load_dotenv()
 
 # Cria a instância da aplicação Flask
 app = Flask(__name__)
+# jsonify e request.json com orjson, quando instalado (ver serializacao.py)
+app.json = ProvedorJSON(app)
 
 # Configurações do Banco de Dados
 # A string de conexão é lida da variável de ambiente
 app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URI")
+# Pool de conexões configurado pelas variáveis DB_POOL_* (ver conexoes.py)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = opcoes_engine(os.getenv("DATABASE_URI"))
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 # Inicializa o SQLAlchemy com a aplicação Flask
 db.init_app(app)
+# Consultas, tempos e Server-Timing por requisição (ver perfil.py)
+iniciar_perfil(app)
+# Threads que executam as tarefas em segundo plano (ver tarefas.py)
+iniciar_tarefas(app)
+
+# Paginação por cursor (keyset) das listagens
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 1000
+
+# Linhas lidas do banco por vez na exportação em streaming
+LOTE_EXPORTACAO = 2000
+
+
+# Erro de validação de parâmetros da query string, respondido com 400
+class ParametroInvalido(ValueError):
+    pass
+
+
+@app.errorhandler(ParametroInvalido)
+def handle_parametro_invalido(e):
+    return jsonify({"erro": str(e)}), 400
+
+
+# Alteração de uma compra que mudaria o valor de uma fatura fechada: desfaz o
+# que a requisição já tinha gravado
+@app.errorhandler(FaturaFechada)
+def handle_fatura_fechada(e):
+    db.session.rollback()
+    return jsonify({"erro": str(e)}), 409
+
+
+# Leitura tipada de parâmetros opcionais da query string (da requisição
+# atual, ou de 'args' no modo ASGI)
+def _param_int(nome: str, args=None) -> Union[int, None]:
+    valor = (request.args if args is None else args).get(nome)
+    if not valor:
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        raise ParametroInvalido(f"O parâmetro '{nome}' deve ser inteiro")
+
+
+def _param_data(nome: str, args=None) -> Union[date, None]:
+    valor = (request.args if args is None else args).get(nome)
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise ParametroInvalido(f"Formato de data inválido em '{nome}'. Use AAAA-MM-DD")
+
+
+def _param_bool(nome: str, args=None) -> Union[bool, None]:
+    valor = (request.args if args is None else args).get(nome)
+    if not valor:
+        return None
+    if valor.lower() in ("1", "true", "sim"):
+        return True
+    if valor.lower() in ("0", "false", "nao", "não"):
+        return False
+    raise ParametroInvalido(f"O parâmetro '{nome}' deve ser true ou false")
+
+
+# Lê os parâmetros 'limit' e 'after' da requisição
+def _parametros_paginacao() -> Tuple[int, Union[int, None]]:
+    limite = _param_int("limit")
+    limite = LIMITE_PADRAO if limite is None else limite
+    apos = _param_int("after")
+    if limite < 1:
+        raise ParametroInvalido("O parâmetro 'limit' deve ser maior que zero")
+    return min(limite, LIMITE_MAXIMO), apos
+
+
+# Pagina a consulta pela chave primária: busca só as linhas com id maior que
+# o cursor, então o custo de cada página não depende do tamanho da tabela
+# (ao contrário do OFFSET, que precisa percorrer as linhas puladas).
+def _paginar(consulta, coluna_id):
+    limite, apos = _parametros_paginacao()
+    if apos is not None:
+        consulta = consulta.filter(coluna_id > apos)
+    # Busca uma linha a mais só para saber se existe próxima página
+    linhas = consulta.order_by(coluna_id).limit(limite + 1).all()
+    proximo_cursor = None
+    if len(linhas) > limite:
+        linhas = linhas[:limite]
+        proximo_cursor = getattr(linhas[-1], coluna_id.key)
+    return linhas, proximo_cursor
+
+
+# Mesma paginação de _paginar() sobre um mapa {id: item} do cache de
+# referências, que já vem ordenado por id
+def _paginar_referencias(mapa):
+    limite, apos = _parametros_paginacao()
+    ids = list(mapa)
+    inicio = bisect_right(ids, apos) if apos is not None else 0
+    pagina = ids[inicio : inicio + limite + 1]
+    proximo_cursor = None
+    if len(pagina) > limite:
+        pagina = pagina[:limite]
+        proximo_cursor = pagina[-1]
+    return [mapa[i] for i in pagina], proximo_cursor
+
+
+# Corpo padrão das listagens paginadas
+def _resposta_paginada(itens, proximo_cursor):
+    return jsonify({"itens": itens, "next_cursor": proximo_cursor})
+
+
+# GET condicional das listagens do cache de referências. A ETag combina a
+# assinatura dos conjuntos usados com a query string (página e limite); se o
+# cliente já tem essa versão (If-None-Match), responde 304 sem consultar o
+# banco nem gerar o JSON.
+def _resposta_condicional(conjuntos, gerar):
+    etag = hashlib.sha1(
+        f"{referencias.assinatura(*conjuntos)}?{request.query_string.decode()}".encode()
+    ).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        resposta = Response(status=304)
+    else:
+        resposta = gerar()
+    resposta.set_etag(etag)
+    # O cliente pode guardar a resposta, mas revalida a cada uso
+    resposta.headers["Cache-Control"] = "no-cache"
+    return resposta
 
 
 # --- Exemplo de uma rota de teste para garantir que tudo está funcionando ---
@@ -44,13 +236,10 @@ def handle_tipos_contas() -> Union[Response, Tuple[Response, int]]:
     try:
         # LISTAR todos os tipos de conta
         if request.method == "GET":
-            tipos_contas = TiposContas.query.all()
-            # Converte a lista de objetos para um dicionário para a resposta JSON
-            tipos_contas_list = [
-                {"id": tc.idtipos_contas, "nome": tc.tipos_contas}
-                for tc in tipos_contas
-            ]
-            return jsonify(tipos_contas_list), 200
+            tipos_contas_list, proximo_cursor = _paginar_referencias(
+                referencias.tipos_contas()
+            )
+            return _resposta_paginada(tipos_contas_list, proximo_cursor), 200
 
         # CRIAR um novo tipo de conta
         elif request.method == "POST":
@@ -66,6 +255,7 @@ def handle_tipos_contas() -> Union[Response, Tuple[Response, int]]:
                 novo_tipo = TiposContas(tipos_contas=nome_tipo)
                 db.session.add(novo_tipo)
                 db.session.commit()
+                invalidar_referencias(TiposContas)
                 return (
                     jsonify(
                         {
@@ -80,6 +270,8 @@ def handle_tipos_contas() -> Union[Response, Tuple[Response, int]]:
                     jsonify({"erro": "Erro ao processar JSON", "detalhes": str(e)}),
                     400,
                 )
+    except ParametroInvalido:
+        raise
     except Exception as e:
         # Tratamento de erro para garantir que sempre retorne algo
         return jsonify({"erro": "Erro interno do servidor", "detalhes": str(e)}), 500
@@ -92,17 +284,17 @@ def handle_tipos_contas() -> Union[Response, Tuple[Response, int]]:
 # Rota para OBTER, ATUALIZAR ou DELETAR um tipo de conta específico
 @app.route("/tipos-contas/<int:tipo_id>", methods=["GET", "PUT", "DELETE"])
 def handle_tipo_conta(tipo_id):
+    # OBTER detalhes de um tipo de conta específico (do cache)
+    if request.method == "GET":
+        tipo = referencias.buscar("tipos_contas", tipo_id)
+        if not tipo:
+            return jsonify({"erro": "Tipo de conta não encontrado"}), 404
+        return jsonify(tipo), 200
+
     tipo_conta = TiposContas.query.get(tipo_id)
     if not tipo_conta:
         return jsonify({"erro": "Tipo de conta não encontrado"}), 404
 
-    # OBTER detalhes de um tipo de conta específico
-    if request.method == "GET":
-        return (
-            jsonify({"id": tipo_conta.idtipos_contas, "nome": tipo_conta.tipos_contas}),
-            200,
-        )
-
     # ATUALIZAR um tipo de conta existente
     elif request.method == "PUT":
         data = request.json
@@ -112,14 +304,20 @@ def handle_tipo_conta(tipo_id):
 
         tipo_conta.tipos_contas = nome_atualizado
         db.session.commit()
+        invalidar_referencias(TiposContas)
         return jsonify({"mensagem": "Tipo de conta atualizado com sucesso!"}), 200
 
     # DELETAR um tipo de conta
     elif request.method == "DELETE":
         # Aqui você pode adicionar a lógica para checar se há registros associados, como mencionaste.
         # Por agora, vamos permitir a exclusão direta.
+        # As contas do tipo ficam sem tipo
+        registrar_alteracoes_onde(
+            ContasBancarias, ContasBancarias.tipo_conta == tipo_conta.idtipos_contas
+        )
         db.session.delete(tipo_conta)
         db.session.commit()
+        invalidar_referencias(TiposContas)
         return jsonify({"mensagem": "Tipo de conta deletado com sucesso!"}), 200
 
 
@@ -128,23 +326,12 @@ def handle_tipo_conta(tipo_id):
 @app.route("/categorias", methods=["GET", "POST"])
 def handle_categorias():
     if request.method == "GET":
-        categorias = Categorias.query.all()
-        lista_categorias = []
-        for cat in categorias:
-            # Inclui as subcategorias na resposta da categoria
-            subcategorias = [
-                {"id": sub.subcategorias_id, "nome": sub.subcategorias_nome}
-                for sub in cat.subcategorias
-            ]
-            lista_categorias.append(
-                {
-                    "id": cat.categorias_id,
-                    "nome": cat.categorias_nome,
-                    "classe": cat.categorias_classe,
-                    "subcategorias": subcategorias,
-                }
-            )
-        return jsonify(lista_categorias), 200
+
+        # Categorias já com as subcategorias, do cache de referências
+        def gerar():
+            return _resposta_paginada(*_paginar_referencias(referencias.categorias()))
+
+        return _resposta_condicional(["categorias"], gerar)
 
     elif request.method == "POST":
         data = request.json
@@ -158,7 +345,10 @@ def handle_categorias():
 
         nova_categoria = Categorias(categorias_nome=nome, categorias_classe=classe)
         db.session.add(nova_categoria)
+        db.session.flush()
+        registrar_alteracoes(Categorias, [nova_categoria.categorias_id])
         db.session.commit()
+        invalidar_referencias(Categorias)
         return (
             jsonify(
                 {
@@ -173,27 +363,16 @@ def handle_categorias():
 # Rota para OBTER, ATUALIZAR ou DELETAR uma categoria específica
 @app.route("/categorias/<int:categoria_id>", methods=["GET", "PUT", "DELETE"])
 def handle_categoria(categoria_id):
+    if request.method == "GET":
+        categoria = referencias.buscar("categorias", categoria_id)
+        if not categoria:
+            return jsonify({"erro": "Categoria não encontrada"}), 404
+        return jsonify(categoria), 200
+
     categoria = Categorias.query.get(categoria_id)
     if not categoria:
         return jsonify({"erro": "Categoria não encontrada"}), 404
 
-    if request.method == "GET":
-        subcategorias = [
-            {"id": sub.subcategorias_id, "nome": sub.subcategorias_nome}
-            for sub in categoria.subcategorias
-        ]
-        return (
-            jsonify(
-                {
-                    "id": categoria.categorias_id,
-                    "nome": categoria.categorias_nome,
-                    "classe": categoria.categorias_classe,
-                    "subcategorias": subcategorias,
-                }
-            ),
-            200,
-        )
-
     elif request.method == "PUT":
         data = request.json
         nome = data.get("categorias_nome", categoria.categorias_nome)
@@ -201,14 +380,18 @@ def handle_categoria(categoria_id):
 
         categoria.categorias_nome = nome
         categoria.categorias_classe = classe
+        registrar_alteracoes(Categorias, [categoria_id])
         db.session.commit()
+        invalidar_referencias(Categorias)
         return jsonify({"mensagem": "Categoria atualizada com sucesso!"}), 200
 
     elif request.method == "DELETE":
         # Se tentar deletar uma categoria com subcategorias, o banco de dados pode dar erro de chave estrangeira.
         # Por enquanto, deixamos assim. Poderíamos adicionar a lógica de deleção em cascata no modelo.
+        registrar_alteracoes(Categorias, [categoria_id])
         db.session.delete(categoria)
         db.session.commit()
+        invalidar_referencias(Categorias, Subcategorias)
         return jsonify({"mensagem": "Categoria deletada com sucesso!"}), 200
 
 
@@ -216,16 +399,12 @@ def handle_categoria(categoria_id):
 # Rota para LISTAR subcategorias de uma categoria específica ou CRIAR uma nova
 @app.route("/categorias/<int:categoria_id>/subcategorias", methods=["GET", "POST"])
 def handle_subcategorias_por_categoria(categoria_id):
-    categoria = Categorias.query.get(categoria_id)
+    categoria = referencias.buscar("categorias", categoria_id)
     if not categoria:
         return jsonify({"erro": "Categoria não encontrada"}), 404
 
     if request.method == "GET":
-        subcategorias = [
-            {"id": sub.subcategorias_id, "nome": sub.subcategorias_nome}
-            for sub in categoria.subcategorias
-        ]
-        return jsonify(subcategorias), 200
+        return jsonify(categoria["subcategorias"]), 200
 
     elif request.method == "POST":
         data = request.json
@@ -238,6 +417,7 @@ def handle_subcategorias_por_categoria(categoria_id):
         )
         db.session.add(nova_subcategoria)
         db.session.commit()
+        invalidar_referencias(Subcategorias)
         return (
             jsonify(
                 {
@@ -252,66 +432,151 @@ def handle_subcategorias_por_categoria(categoria_id):
 # Rota para OBTER, ATUALIZAR ou DELETAR uma subcategoria específica
 @app.route("/subcategorias/<int:subcategoria_id>", methods=["GET", "PUT", "DELETE"])
 def handle_subcategoria(subcategoria_id):
+    if request.method == "GET":
+        subcategoria = referencias.buscar("subcategorias", subcategoria_id)
+        if not subcategoria:
+            return jsonify({"erro": "Subcategoria não encontrada"}), 404
+        return jsonify(subcategoria), 200
+
     subcategoria = Subcategorias.query.get(subcategoria_id)
     if not subcategoria:
         return jsonify({"erro": "Subcategoria não encontrada"}), 404
 
-    if request.method == "GET":
-        return (
-            jsonify(
-                {
-                    "id": subcategoria.subcategorias_id,
-                    "nome": subcategoria.subcategorias_nome,
-                    "categoria_id": subcategoria.categorias_id,
-                }
-            ),
-            200,
-        )
-
     elif request.method == "PUT":
         data = request.json
         nome = data.get("subcategorias_nome", subcategoria.subcategorias_nome)
         subcategoria.subcategorias_nome = nome
         db.session.commit()
+        invalidar_referencias(Subcategorias)
         return jsonify({"mensagem": "Subcategoria atualizada com sucesso!"}), 200
 
     elif request.method == "DELETE":
+        # Os lançamentos da subcategoria ficam sem subcategoria
+        registrar_alteracoes_onde(
+            Operacoes, Operacoes.operacoes_categoria == subcategoria_id
+        )
         db.session.delete(subcategoria)
         db.session.commit()
+        invalidar_referencias(Subcategorias)
         return jsonify({"mensagem": "Subcategoria deletada com sucesso!"}), 200
 
 
 # --- NOVAS ROTAS PARA LANÇAMENTOS (OPERAÇÕES) ---
+
+
+# JSON de um lançamento, a partir das colunas de _consulta_lancamentos()
+LANCAMENTO_JSON = Serializador(
+    Campo("id", Operacoes.operacoes_id),
+    Campo("tipo", Operacoes.operacoes_tipo),
+    Campo("descricao", Operacoes.operacoes_descricao),
+    Campo("data", Operacoes.operacoes_data_lancamento),
+    Campo("valor", Operacoes.operacoes_valor),
+    Objeto(
+        "conta",
+        Campo("id", ContasBancarias.idcontas_bancarias),
+        Campo("nome", ContasBancarias.nome_conta),
+    ),
+    Objeto(
+        "subcategoria",
+        Campo("id", Subcategorias.subcategorias_id),
+        Campo("nome", Subcategorias.subcategorias_nome),
+        # Nome da categoria principal
+        Campo("categoria", Categorias.categorias_nome),
+    ),
+)
+
+
+# Monta uma única consulta que junta operações, contas, subcategorias e
+# categorias. Assim a listagem faz uma ida ao banco, e não três por lançamento.
+def _consulta_lancamentos():
+    return (
+        db.session.query(*LANCAMENTO_JSON.colunas)
+        .outerjoin(
+            ContasBancarias,
+            Operacoes.operacoes_conta == ContasBancarias.idcontas_bancarias,
+        )
+        .outerjoin(
+            Subcategorias,
+            Operacoes.operacoes_categoria == Subcategorias.subcategorias_id,
+        )
+        .outerjoin(Categorias, Subcategorias.categorias_id == Categorias.categorias_id)
+    )
+
+
+# Filtros aceitos na listagem de lançamentos: parâmetro -> coluna filtrada por
+# igualdade. O período usa 'de' e 'ate' sobre operacoes_data_lancamento.
+FILTROS_LANCAMENTOS = {
+    "operacoes_conta": (Operacoes.operacoes_conta, _param_int),
+    "operacoes_categoria": (Operacoes.operacoes_categoria, _param_int),
+    "operacoes_cartao_atrelado": (Operacoes.operacoes_cartao_atrelado, _param_int),
+    "operacoes_fatura": (Operacoes.operacoes_fatura, _param_int),
+    "operacoes_efetivado": (Operacoes.operacoes_efetivado, _param_bool),
+    "operacoes_projeto": (Operacoes.operacoes_projeto, _param_int),
+}
+
+# Filtros atendidos por um índice próprio (ver models.Operacoes): com eles o
+# relatório de categorias já lê poucas linhas e não é dividido em partições
+FILTROS_INDEXADOS = (
+    "operacoes_categoria",
+    "operacoes_cartao_atrelado",
+    "operacoes_fatura",
+    "operacoes_efetivado",
+)
+
+
+# Converte os filtros da query string em condições WHERE, para que o banco
+# devolva só as linhas pedidas em vez de o cliente filtrar a tabela inteira
+def _filtros_lancamentos(args=None):
+    condicoes = []
+    de = _param_data("de", args)
+    ate = _param_data("ate", args)
+    if de is not None:
+        condicoes.append(Operacoes.operacoes_data_lancamento >= de)
+    if ate is not None:
+        condicoes.append(Operacoes.operacoes_data_lancamento <= ate)
+    for nome, (coluna, conversor) in FILTROS_LANCAMENTOS.items():
+        valor = conversor(nome, args)
+        if valor is not None:
+            condicoes.append(coluna == valor)
+    return condicoes
+
+
+# Valor de um lançamento vindo do JSON, como Decimal; None se não for um
+# número finito (texto, lista, "NaN"...)
+def _valor_lancamento(valor) -> Union[Decimal, None]:
+    if isinstance(valor, bool):
+        return None
+    try:
+        numero = Decimal(str(valor))
+    except InvalidOperation:
+        return None
+    return numero if numero.is_finite() else None
+
+
+# Confere no cache de referências a conta, a subcategoria e o cartão de um
+# lançamento. Devolve a resposta de erro, ou None se estiver tudo certo.
+def _validar_referencias_lancamento(conta, subcategoria, cartao):
+    if conta is not None and not referencias.buscar("contas_bancarias", conta):
+        return jsonify({"erro": "Conta não encontrada"}), 404
+    if subcategoria is not None and not referencias.buscar(
+        "subcategorias", subcategoria
+    ):
+        return jsonify({"erro": "Subcategoria não encontrada"}), 404
+    if cartao is not None and not referencias.buscar("cartoes", cartao):
+        return jsonify({"erro": "Cartão não encontrado"}), 404
+    return None
+
+
 # Rota para LISTAR todos os lançamentos ou CRIAR um novo
 @app.route("/lancamentos", methods=["GET", "POST"])
 def handle_lancamentos():
     if request.method == "GET":
-        lancamentos = Operacoes.query.all()
-        lista_lancamentos = []
-        for lancamento in lancamentos:
-            # Acessamos os dados das tabelas relacionadas
-            subcategoria = Subcategorias.query.get(lancamento.subcategorias_id)
-            conta_bancaria = ContasBancarias.query.get(lancamento.contas_bancarias_id)
-
-            lista_lancamentos.append(
-                {
-                    "id": lancamento.operacoes_id,
-                    "tipo": lancamento.operacoes_tipo,
-                    "descricao": lancamento.operacoes_descricao,
-                    "data": str(lancamento.operacoes_data),
-                    "valor": str(lancamento.operacoes_valor),
-                    "conta": {
-                        "id": conta_bancaria.idcontas_bancarias,
-                        "nome": conta_bancaria.nome_conta,
-                    },
-                    "subcategoria": {
-                        "id": subcategoria.subcategorias_id,
-                        "nome": subcategoria.subcategorias_nome,
-                        "categoria": subcategoria.categoria.categorias_nome,  # Acessa a categoria principal
-                    },
-                }
-            )
-        return jsonify(lista_lancamentos), 200
+        lancamentos, proximo_cursor = _paginar(
+            _consulta_lancamentos().filter(*_filtros_lancamentos()),
+            Operacoes.operacoes_id,
+        )
+        lista_lancamentos = LANCAMENTO_JSON.lista(lancamentos)
+        return _resposta_paginada(lista_lancamentos, proximo_cursor), 200
 
     elif request.method == "POST":
         data = request.json
@@ -336,6 +601,18 @@ def handle_lancamentos():
         ):
             return jsonify({"erro": "Dados incompletos"}), 400
 
+        erro = _validar_referencias_lancamento(
+            contas_bancarias_id,
+            subcategorias_id,
+            data.get("operacoes_cartao_atrelado"),
+        )
+        if erro:
+            return erro
+
+        operacoes_valor = _valor_lancamento(operacoes_valor)
+        if operacoes_valor is None:
+            return jsonify({"erro": "Valor inválido"}), 400
+
         # Converte a string de data para um objeto date
         try:
             data_lancamento = date.fromisoformat(operacoes_data)
@@ -345,14 +622,27 @@ def handle_lancamentos():
         novo_lancamento = Operacoes(
             operacoes_tipo=operacoes_tipo,
             operacoes_descricao=operacoes_descricao,
-            operacoes_data=data_lancamento,
+            operacoes_data_lancamento=data_lancamento,
             operacoes_valor=operacoes_valor,
-            contas_bancarias_id=contas_bancarias_id,
-            subcategorias_id=subcategorias_id,
+            operacoes_conta=contas_bancarias_id,
+            operacoes_categoria=subcategorias_id,
+            operacoes_efetivado=data.get("operacoes_efetivado"),
+            operacoes_cartao_atrelado=data.get("operacoes_cartao_atrelado"),
         )
+        novo_lancamento.operacoes_fingerprint = fingerprint_operacao(novo_lancamento)
 
         db.session.add(novo_lancamento)
+        # Saldos diários atualizados na mesma transação do lançamento
+        aplicar_movimento(movimento_operacao(novo_lancamento))
+        # Compra no cartão: entra na fatura do período e soma só nela
+        compra_cartao = novo_lancamento.operacoes_cartao_atrelado is not None
+        if compra_cartao:
+            registrar_compra_cartao(novo_lancamento)
+        db.session.flush()
+        registrar_alteracoes(Operacoes, [novo_lancamento.operacoes_id])
         db.session.commit()
+        if compra_cartao:
+            invalidar_referencias(FaturasCartoes)
         return (
             jsonify(
                 {
@@ -364,6 +654,175 @@ def handle_lancamentos():
         )
 
 
+# Colunas do CSV exportado
+COLUNAS_EXPORTACAO = [
+    "id",
+    "data",
+    "descricao",
+    "valor",
+    "tipo",
+    "conta_id",
+    "conta",
+    "subcategoria_id",
+    "subcategoria",
+    "categoria",
+]
+
+
+def _gerar_ndjson(linhas):
+    for linha in linhas:
+        yield app.json.dumps(LANCAMENTO_JSON(linha)) + "\n"
+
+
+def _gerar_csv(linhas):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUNAS_EXPORTACAO)
+    for numero, linha in enumerate(linhas, start=1):
+        escritor.writerow(
+            [
+                linha.operacoes_id,
+                linha.operacoes_data_lancamento,
+                linha.operacoes_descricao,
+                linha.operacoes_valor,
+                linha.operacoes_tipo,
+                linha.idcontas_bancarias,
+                linha.nome_conta,
+                linha.subcategorias_id,
+                linha.subcategorias_nome,
+                linha.categorias_nome,
+            ]
+        )
+        # Envia o que já foi escrito a cada lote, sem acumular o arquivo
+        if numero % LOTE_EXPORTACAO == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Rota para criar, alterar e excluir vários lançamentos numa transação.
+# Corpo: {"operacoes": [{"acao": "criar" | "atualizar" | "excluir", "id": ...,
+# campos de POST/PUT /lancamentos}]}. Se algum item for inválido, nada é
+# gravado e a resposta traz o erro de cada item.
+@app.route("/lancamentos/batch", methods=["POST"])
+def handle_lote_lancamentos():
+    data = request.get_json(silent=True) or {}
+    try:
+        resultado = executar_lote(data.get("operacoes"))
+    except LoteInvalido as e:
+        return jsonify({"erro": str(e), "erros": e.erros}), 400
+    return jsonify(resultado), 200
+
+
+# Rota para EXPORTAR lançamentos em NDJSON ou CSV. A resposta é gerada em
+# streaming e o banco é lido em lotes (yield_per, cursor no servidor quando o
+# driver suporta), então a memória não cresce com o tamanho da exportação.
+# Aceita os mesmos filtros da listagem.
+@app.route("/lancamentos/export", methods=["GET"])
+def handle_exportar_lancamentos():
+    formato = request.args.get("format", "ndjson").lower()
+    if formato not in ("ndjson", "csv"):
+        return jsonify({"erro": "Formato inválido. Use ndjson ou csv"}), 400
+
+    # Filtros lidos antes de começar o streaming, para responder 400 se
+    # houver parâmetro inválido
+    linhas = (
+        _consulta_lancamentos()
+        .filter(*_filtros_lancamentos())
+        .order_by(Operacoes.operacoes_id)
+        .yield_per(LOTE_EXPORTACAO)
+    )
+    if formato == "csv":
+        gerador, mimetype = _gerar_csv(linhas), "text/csv"
+    else:
+        gerador, mimetype = _gerar_ndjson(linhas), "application/x-ndjson"
+    return Response(
+        stream_with_context(gerador),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=lancamentos.{formato}"},
+    )
+
+
+# Parâmetros da importação de extrato, da query string: formato (csv/ofx,
+# senão deduzido do nome do arquivo), conta e subcategoria padrão, tratamento
+# dos duplicados e encoding
+def _parametros_importacao(nome_arquivo: str) -> dict:
+    formato = request.args.get("formato", "").lower()
+    if not formato:
+        if nome_arquivo.lower().endswith((".ofx", ".qfx")) or "ofx" in (
+            request.mimetype or ""
+        ):
+            formato = "ofx"
+        else:
+            formato = "csv"
+    if formato not in ("csv", "ofx"):
+        raise ParametroInvalido("Formato inválido. Use csv ou ofx")
+
+    conta = _param_int("conta")
+    if formato == "ofx" and conta is None:
+        raise ParametroInvalido("Informe a conta do extrato OFX")
+    # Lançamentos já existentes: 'pular' (padrão) ou 'importar' mesmo assim;
+    # nos dois casos as linhas aparecem em 'duplicados'
+    modo_duplicados = request.args.get("duplicados", DUPLICADOS_PULAR)
+    if modo_duplicados not in (DUPLICADOS_PULAR, DUPLICADOS_IMPORTAR):
+        raise ParametroInvalido("Use duplicados=pular ou duplicados=importar")
+    encoding = request.args.get("encoding", "utf-8")
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        raise ParametroInvalido("Encoding inválido")
+    return {
+        "formato": formato,
+        "conta": conta,
+        "subcategoria": _param_int("subcategoria"),
+        "duplicados": modo_duplicados,
+        "encoding": encoding,
+    }
+
+
+# Rota para IMPORTAR um extrato (CSV ou OFX) de uma só vez, numa transação.
+# O arquivo vai no campo 'arquivo' (multipart) ou direto no corpo. Parâmetros
+# em _parametros_importacao. Para arquivos grandes, use a tarefa em segundo
+# plano (POST /tarefas/importar-lancamentos).
+@app.route("/lancamentos/importar", methods=["POST"])
+def handle_importar_lancamentos():
+    arquivo = request.files.get("arquivo")
+    parametros = _parametros_importacao((arquivo.filename or "") if arquivo else "")
+
+    # Lê o arquivo em streaming, linha a linha
+    binario = arquivo.stream if arquivo else request.stream
+    texto = io.TextIOWrapper(
+        binario,
+        encoding=parametros["encoding"],
+        errors="replace",
+        newline="",
+    )
+    formato = parametros["formato"]
+    try:
+        leitor = ler_ofx(texto) if formato == "ofx" else ler_csv(texto)
+        resultado = importar_lancamentos(
+            leitor,
+            formato,
+            parametros["conta"],
+            parametros["subcategoria"],
+            parametros["duplicados"],
+        )
+    finally:
+        texto.detach()
+
+    importados = resultado["importados"]
+    resultado["mensagem"] = f"{importados} lançamentos importados"
+    # Nada gravado: 400 se houve linhas com erro; 200 se todas já existiam
+    if importados:
+        status = 201
+    elif resultado["total_erros"]:
+        status = 400
+    else:
+        status = 200
+    return jsonify(resultado), status
+
+
 # Rota para OBTER, ATUALIZAR ou DELETAR um lançamento específico
 @app.route("/lancamentos/<int:lancamento_id>", methods=["GET", "PUT", "DELETE"])
 def handle_lancamento(lancamento_id):
@@ -372,64 +831,103 @@ def handle_lancamento(lancamento_id):
         return jsonify({"erro": "Lançamento não encontrado"}), 404
 
     if request.method == "GET":
-        subcategoria = Subcategorias.query.get(lancamento.subcategorias_id)
-        conta_bancaria = ContasBancarias.query.get(lancamento.contas_bancarias_id)
-
-        return (
-            jsonify(
-                {
-                    "id": lancamento.operacoes_id,
-                    "tipo": lancamento.operacoes_tipo,
-                    "descricao": lancamento.operacoes_descricao,
-                    "data": str(lancamento.operacoes_data),
-                    "valor": str(lancamento.operacoes_valor),
-                    "conta": {
-                        "id": conta_bancaria.idcontas_bancarias,
-                        "nome": conta_bancaria.nome_conta,
-                    },
-                    "subcategoria": {
-                        "id": subcategoria.subcategorias_id,
-                        "nome": subcategoria.subcategorias_nome,
-                        "categoria": subcategoria.categoria.categorias_nome,
-                    },
-                }
-            ),
-            200,
+        linha = (
+            _consulta_lancamentos()
+            .filter(Operacoes.operacoes_id == lancamento_id)
+            .first()
         )
+        return jsonify(LANCAMENTO_JSON(linha)), 200
 
     elif request.method == "PUT":
         data = request.json
+        erro = _validar_referencias_lancamento(
+            data.get("contas_bancarias_id"),
+            data.get("subcategorias_id"),
+            data.get("operacoes_cartao_atrelado"),
+        )
+        if erro:
+            return erro
+        if "operacoes_valor" in data:
+            valor = _valor_lancamento(data["operacoes_valor"])
+            if valor is None:
+                return jsonify({"erro": "Valor inválido"}), 400
+            data["operacoes_valor"] = valor
+
+        # Movimento antes da alteração, para corrigir os saldos diários
+        movimento_anterior = movimento_operacao(lancamento)
+        fatura_anterior = lancamento_na_fatura(lancamento)
+        chave_fatura = (
+            lancamento.operacoes_cartao_atrelado,
+            lancamento.operacoes_data_lancamento,
+        )
+
+        # Converte a string de data para um objeto date
+        operacoes_data = data.get("operacoes_data")
+        if operacoes_data:
+            try:
+                lancamento.operacoes_data_lancamento = date.fromisoformat(
+                    operacoes_data
+                )
+            except ValueError:
+                return (
+                    jsonify({"erro": "Formato de data inválido. Use AAAA-MM-DD"}),
+                    400,
+                )
+
         lancamento.operacoes_tipo = data.get(
             "operacoes_tipo", lancamento.operacoes_tipo
         )
         lancamento.operacoes_descricao = data.get(
             "operacoes_descricao", lancamento.operacoes_descricao
         )
-        lancamento.operacoes_data = data.get(
-            "operacoes_data", str(lancamento.operacoes_data)
-        )
         lancamento.operacoes_valor = data.get(
-            "operacoes_valor", str(lancamento.operacoes_valor)
+            "operacoes_valor", lancamento.operacoes_valor
         )
-        lancamento.contas_bancarias_id = data.get(
-            "contas_bancarias_id", lancamento.contas_bancarias_id
+        lancamento.operacoes_conta = data.get(
+            "contas_bancarias_id", lancamento.operacoes_conta
         )
-        lancamento.subcategorias_id = data.get(
-            "subcategorias_id", lancamento.subcategorias_id
+        lancamento.operacoes_categoria = data.get(
+            "subcategorias_id", lancamento.operacoes_categoria
+        )
+        lancamento.operacoes_efetivado = data.get(
+            "operacoes_efetivado", lancamento.operacoes_efetivado
+        )
+        lancamento.operacoes_cartao_atrelado = data.get(
+            "operacoes_cartao_atrelado", lancamento.operacoes_cartao_atrelado
         )
 
-        # Converte a string de data para um objeto date
-        try:
-            lancamento.operacoes_data = date.fromisoformat(lancamento.operacoes_data)
-        except ValueError:
-            return jsonify({"erro": "Formato de data inválido. Use AAAA-MM-DD"}), 400
-
+        lancamento.operacoes_fingerprint = fingerprint_operacao(lancamento)
+        substituir_movimento(movimento_anterior, movimento_operacao(lancamento))
+        # Fatura: só troca se o cartão ou a data mudaram; o valor é corrigido
+        # na fatura antiga e na nova, sem recalcular as demais
+        nova_chave_fatura = (
+            lancamento.operacoes_cartao_atrelado,
+            lancamento.operacoes_data_lancamento,
+        )
+        compra_cartao = (
+            nova_chave_fatura[0] is not None or fatura_anterior[0] is not None
+        )
+        if compra_cartao:
+            registrar_compra_cartao(
+                lancamento,
+                fatura_anterior,
+                reatribuir=nova_chave_fatura != chave_fatura,
+            )
+        registrar_alteracoes(Operacoes, [lancamento_id])
         db.session.commit()
+        if compra_cartao:
+            invalidar_referencias(FaturasCartoes)
         return jsonify({"mensagem": "Lançamento atualizado com sucesso!"}), 200
 
     elif request.method == "DELETE":
+        aplicar_movimento(movimento_operacao(lancamento), fator=-1)
+        remover_compra_cartao(lancamento)
+        na_fatura = lancamento.operacoes_fatura is not None
+        registrar_alteracoes(Operacoes, [lancamento_id])
         db.session.delete(lancamento)
         db.session.commit()
+        if na_fatura:
+            invalidar_referencias(FaturasCartoes)
         return jsonify({"mensagem": "Lançamento deletado com sucesso!"}), 200
 
 
@@ -440,33 +938,14 @@ def handle_lancamento(lancamento_id):
 @app.route("/contas-bancarias", methods=["GET", "POST"])
 def handle_contas_bancarias():
     if request.method == "GET":
-        contas = ContasBancarias.query.all()
-        lista_contas = []
-        for conta in contas:
-            # Acessamos o objeto de relacionamento para obter o nome do tipo de conta
-            tipo_conta_obj = conta.tipo_conta_rel
 
-            lista_contas.append(
-                {
-                    "id": conta.idcontas_bancarias,
-                    "nome": conta.nome_conta,
-                    "tipo_conta": {
-                        "id": tipo_conta_obj.idtipos_contas,
-                        "nome": tipo_conta_obj.tipos_contas,
-                    },
-                    "saldo_inicial": (
-                        str(conta.conta_saldo_inicial)
-                        if conta.conta_saldo_inicial is not None
-                        else None
-                    ),
-                    "data_saldo_inicial": (
-                        str(conta.data_conta_saldo_incial)
-                        if conta.data_conta_saldo_incial is not None
-                        else None
-                    ),
-                }
+        # Contas com o tipo de conta já resolvido, do cache de referências
+        def gerar():
+            return _resposta_paginada(
+                *_paginar_referencias(referencias.contas_bancarias())
             )
-        return jsonify(lista_contas), 200
+
+        return _resposta_condicional(["contas_bancarias"], gerar)
 
     elif request.method == "POST":
         data = request.json
@@ -484,8 +963,7 @@ def handle_contas_bancarias():
             )
 
         # Verifica se o tipo de conta existe
-        tipo_conta_relacionado = TiposContas.query.get(tipo_conta_id)
-        if not tipo_conta_relacionado:
+        if not referencias.buscar("tipos_contas", tipo_conta_id):
             return jsonify({"erro": "ID do tipo de conta não encontrado."}), 404
 
         data_saldo_inicial = None
@@ -503,9 +981,14 @@ def handle_contas_bancarias():
             tipo_conta=tipo_conta_id,
             conta_saldo_inicial=saldo_inicial,
             data_conta_saldo_incial=data_saldo_inicial,
+            contas_cartao_fechamento=data.get("contas_cartao_fechamento"),
+            contas_prev_debito=data.get("contas_prev_debito"),
         )
         db.session.add(nova_conta)
+        db.session.flush()
+        registrar_alteracoes(ContasBancarias, [nova_conta.idcontas_bancarias])
         db.session.commit()
+        invalidar_referencias(ContasBancarias)
         return (
             jsonify(
                 {
@@ -520,43 +1003,29 @@ def handle_contas_bancarias():
 # Rota para OBTER, ATUALIZAR ou DELETAR uma conta específica
 @app.route("/contas-bancarias/<int:conta_id>", methods=["GET", "PUT", "DELETE"])
 def handle_conta_bancaria(conta_id):
+    if request.method == "GET":
+        conta = referencias.buscar("contas_bancarias", conta_id)
+        if not conta:
+            return jsonify({"erro": "Conta não encontrada"}), 404
+        return jsonify(conta), 200
+
     conta = ContasBancarias.query.get(conta_id)
     if not conta:
         return jsonify({"erro": "Conta não encontrada"}), 404
 
-    if request.method == "GET":
-        tipo_conta_obj = conta.tipo_conta_rel
-        return (
-            jsonify(
-                {
-                    "id": conta.idcontas_bancarias,
-                    "nome": conta.nome_conta,
-                    "tipo_conta": {
-                        "id": tipo_conta_obj.idtipos_contas,
-                        "nome": tipo_conta_obj.tipos_contas,
-                    },
-                    "saldo_inicial": (
-                        str(conta.conta_saldo_inicial)
-                        if conta.conta_saldo_inicial is not None
-                        else None
-                    ),
-                    "data_saldo_inicial": (
-                        str(conta.data_conta_saldo_incial)
-                        if conta.data_conta_saldo_incial is not None
-                        else None
-                    ),
-                }
-            ),
-            200,
-        )
-
-    elif request.method == "PUT":
+    if request.method == "PUT":
         data = request.json
         conta.nome_conta = data.get("nome_conta", conta.nome_conta)
         conta.tipo_conta = data.get("tipo_conta", conta.tipo_conta)
         conta.conta_saldo_inicial = data.get(
             "conta_saldo_inicial", conta.conta_saldo_inicial
         )
+        conta.contas_cartao_fechamento = data.get(
+            "contas_cartao_fechamento", conta.contas_cartao_fechamento
+        )
+        conta.contas_prev_debito = data.get(
+            "contas_prev_debito", conta.contas_prev_debito
+        )
         data_str = data.get("data_conta_saldo_incial")
 
         if data_str:
@@ -568,15 +1037,148 @@ def handle_conta_bancaria(conta_id):
                     400,
                 )
 
+        registrar_alteracoes(ContasBancarias, [conta_id])
         db.session.commit()
+        invalidar_referencias(ContasBancarias)
         return jsonify({"mensagem": "Conta atualizada com sucesso!"}), 200
 
     elif request.method == "DELETE":
+        # Os lançamentos da conta ficam sem conta
+        registrar_alteracoes(ContasBancarias, [conta_id])
+        registrar_alteracoes_onde(Operacoes, Operacoes.operacoes_conta == conta_id)
+        apagar_saldos_conta(conta_id)
         db.session.delete(conta)
         db.session.commit()
+        invalidar_referencias(ContasBancarias)
         return jsonify({"mensagem": "Conta deletada com sucesso!"}), 200
 
 
+# Converte o saldo calculado em saldos.py no JSON de resposta
+def _saldo_para_dict(saldo):
+    return {
+        "id": saldo["conta"],
+        "nome": saldo["nome"],
+        "saldo_inicial": str(saldo["saldo_inicial"]),
+        "saldo": str(saldo["saldo"]),
+        "desconsiderar_saldo": saldo["desconsiderar_saldo"],
+    }
+
+
+# Rota para OBTER o saldo de uma conta até uma data (padrão: tudo).
+# Com ?efetivados=true considera só os lançamentos efetivados.
+@app.route("/contas-bancarias/<int:conta_id>/saldo", methods=["GET"])
+def handle_saldo_conta(conta_id):
+    ate = _param_data("ate")
+    saldos = consultar_saldos(
+        ate=ate,
+        somente_efetivados=bool(_param_bool("efetivados")),
+        contas=[conta_id],
+    )
+    if not saldos:
+        return jsonify({"erro": "Conta não encontrada"}), 404
+
+    resposta = _saldo_para_dict(saldos[0])
+    resposta["ate"] = str(ate) if ate else None
+    return jsonify(resposta), 200
+
+
+# Rota para OBTER o saldo de todas as contas numa única consulta agregada.
+# O saldo total ignora as contas marcadas com contas_desconsiderar_saldo.
+@app.route("/contas-bancarias/saldos", methods=["GET"])
+def handle_saldos_contas():
+    ate = _param_data("ate")
+    saldos = consultar_saldos(
+        ate=ate, somente_efetivados=bool(_param_bool("efetivados"))
+    )
+    return (
+        jsonify(
+            {
+                "ate": str(ate) if ate else None,
+                "contas": [_saldo_para_dict(saldo) for saldo in saldos],
+                "saldo_total": str(saldo_consolidado(saldos)),
+            }
+        ),
+        200,
+    )
+
+
+def _param_meses(args=None) -> int:
+    meses = _param_int("meses", args)
+    meses = MESES_PADRAO if meses is None else meses
+    if not 1 <= meses <= MESES_MAXIMO:
+        raise ParametroInvalido(
+            f"O parâmetro 'meses' deve estar entre 1 e {MESES_MAXIMO}"
+        )
+    return meses
+
+
+def _param_agrupamento(args=None) -> str:
+    agrupamento = (request.args if args is None else args).get("agrupamento", "mes")
+    if agrupamento not in AGRUPAMENTOS:
+        raise ParametroInvalido(f"Agrupamento inválido. Use {', '.join(AGRUPAMENTOS)}")
+    return agrupamento
+
+
+# Saldo previsto de cada conta ao fim de cada mês, do mês atual em diante:
+# lançamentos efetivados e pendentes, recorrências ainda não geradas e
+# compras nas faturas abertas (no mês do vencimento)
+@app.route("/projecao", methods=["GET"])
+def handle_projecao():
+    return jsonify(projetar_saldos(date.today(), _param_meses())), 200
+
+
+# Relatório de receitas e despesas por subcategoria, com subtotais por
+# categoria, classe e período (agrupamento=mes|ano|total). Aceita os mesmos
+# filtros da listagem de lançamentos (de, ate, operacoes_conta, ...). Os
+# lançamentos sem data vão num período null, o último da lista.
+@app.route("/relatorios/categorias", methods=["GET"])
+def handle_relatorio_categorias():
+    agrupamento = _param_agrupamento()
+    periodos = relatorio_categorias(
+        _filtros_lancamentos(),
+        agrupamento,
+        _param_int("operacoes_conta"),
+        seletivo=any(request.args.get(nome) for nome in FILTROS_INDEXADOS),
+    )
+    return jsonify({"agrupamento": agrupamento, "periodos": periodos}), 200
+
+
+def _param_agrupar() -> list:
+    agrupar = [nome for nome in request.args.get("agrupar", "mes").split(",") if nome]
+    invalidos = [nome for nome in agrupar if nome not in AGRUPAMENTOS_RESUMO]
+    if invalidos or len(set(agrupar)) != len(agrupar):
+        raise ParametroInvalido(
+            f"Agrupamento inválido. Use {', '.join(AGRUPAMENTOS_RESUMO)}, "
+            "separados por vírgula"
+        )
+    return agrupar
+
+
+# Resumo para os painéis: receitas, despesas e quantidade de lançamentos
+# agrupados por uma ou mais chaves (agrupar=mes,conta), calculados sobre a
+# cópia colunar em memória (ver colunar.py), sem consultar operacoes. Filtros:
+# de, ate, operacoes_conta, operacoes_categoria (subcategoria), categoria,
+# operacoes_tipo, operacoes_efetivado e cartao (lançamentos em cartão).
+@app.route("/relatorios/resumo", methods=["GET"])
+def handle_relatorio_resumo():
+    agrupar = _param_agrupar()
+    conta = _param_int("operacoes_conta")
+    subcategoria = _param_int("operacoes_categoria")
+    categoria = _param_int("categoria")
+    grupos = resumir(
+        agrupar,
+        de=_param_data("de"),
+        ate=_param_data("ate"),
+        contas=None if conta is None else [conta],
+        subcategorias=None if subcategoria is None else [subcategoria],
+        categorias=None if categoria is None else [categoria],
+        tipo=_param_int("operacoes_tipo"),
+        efetivado=_param_bool("operacoes_efetivado"),
+        cartao=_param_bool("cartao"),
+    )
+    return jsonify({"agrupar": agrupar, "grupos": grupos}), 200
+
+
 # --- NOVAS ROTAS PARA CARTÕES E FATURAS ---
 
 
@@ -584,27 +1186,18 @@ def handle_conta_bancaria(conta_id):
 @app.route("/cartoes", methods=["GET", "POST"])
 def handle_cartoes():
     if request.method == "GET":
-        cartoes = Cartoes.query.all()
-        lista_cartoes = []
-        for cartao in cartoes:
+
+        def gerar():
+            cartoes, proximo_cursor = _paginar_referencias(referencias.cartoes())
+            faturas = referencias.faturas_por_cartao()
             # Inclui as faturas na resposta do cartão
-            faturas = [
-                {
-                    "id": fat.faturasCartoesId,
-                    "vencimento": str(fat.faturasCartoesDtVencimento),
-                }
-                for fat in cartao.faturas
+            lista_cartoes = [
+                {**cartao, "faturas": faturas.get(cartao["id"], [])}
+                for cartao in cartoes
             ]
-            lista_cartoes.append(
-                {
-                    "id": cartao.cartoes_id,
-                    "nome": cartao.cartoes_nome,
-                    "final": cartao.cartoes_final,
-                    "tipo": cartao.cartoes_tipo,
-                    "faturas": faturas,
-                }
-            )
-        return jsonify(lista_cartoes), 200
+            return _resposta_paginada(lista_cartoes, proximo_cursor)
+
+        return _resposta_condicional(["cartoes", "faturas_por_cartao"], gerar)
 
     elif request.method == "POST":
         data = request.json
@@ -622,9 +1215,14 @@ def handle_cartoes():
             cartoes_nome=cartoes_nome,
             cartoes_final=cartoes_final,
             cartoes_tipo=cartoes_tipo,
+            # Conta do cartão, com os dias de fechamento e de débito da fatura
+            cartoes_atrelado=data.get("cartoes_atrelado"),
         )
         db.session.add(novo_cartao)
+        db.session.flush()
+        registrar_alteracoes(Cartoes, [novo_cartao.cartoes_id])
         db.session.commit()
+        invalidar_referencias(Cartoes)
         return (
             jsonify(
                 {"mensagem": "Cartão criado com sucesso!", "id": novo_cartao.cartoes_id}
@@ -641,13 +1239,7 @@ def handle_cartao(cartao_id):
         return jsonify({"erro": "Cartão não encontrado"}), 404
 
     if request.method == "GET":
-        faturas = [
-            {
-                "id": fat.faturasCartoesId,
-                "vencimento": str(fat.faturasCartoesDtVencimento),
-            }
-            for fat in cartao.faturas
-        ]
+        faturas = [fatura_para_dict(fat) for fat in cartao.faturas]
         return (
             jsonify(
                 {
@@ -666,13 +1258,22 @@ def handle_cartao(cartao_id):
         cartao.cartoes_nome = data.get("cartoes_nome", cartao.cartoes_nome)
         cartao.cartoes_final = data.get("cartoes_final", cartao.cartoes_final)
         cartao.cartoes_tipo = data.get("cartoes_tipo", cartao.cartoes_tipo)
+        cartao.cartoes_atrelado = data.get("cartoes_atrelado", cartao.cartoes_atrelado)
 
+        registrar_alteracoes(Cartoes, [cartao_id])
         db.session.commit()
+        invalidar_referencias(Cartoes)
         return jsonify({"mensagem": "Cartão atualizado com sucesso!"}), 200
 
     elif request.method == "DELETE":
+        # As faturas do cartão ficam sem cartão
+        registrar_alteracoes(Cartoes, [cartao_id])
+        registrar_alteracoes_onde(
+            FaturasCartoes, FaturasCartoes.faturasCartoesVinculado == cartao_id
+        )
         db.session.delete(cartao)
         db.session.commit()
+        invalidar_referencias(Cartoes, FaturasCartoes)
         return jsonify({"mensagem": "Cartão deletado com sucesso!"}), 200
 
 
@@ -684,22 +1285,18 @@ def handle_faturas_por_cartao(cartao_id):
         return jsonify({"erro": "Cartão não encontrado"}), 404
 
     if request.method == "GET":
-        faturas = [
-            {
-                "id": fat.faturasCartoesId,
-                "vencimento": str(fat.faturasCartoesDtVencimento),
-            }
-            for fat in cartao.faturas
-        ]
+        faturas = [fatura_para_dict(fat) for fat in cartao.faturas]
         return jsonify(faturas), 200
 
     elif request.method == "POST":
         data = request.json
         dt_vencimento_str = data.get("faturasCartoesDtVencimento")
         dt_fechamento_str = data.get("faturasCartoesFechamento")
-        valor = data.get("faturasCartoesValor")
+        # Sem valor, a fatura começa zerada e o motor de fechamento soma os
+        # lançamentos dela
+        valor = data.get("faturasCartoesValor", 0)
 
-        if not all([dt_vencimento_str, dt_fechamento_str, valor]):
+        if not all([dt_vencimento_str, dt_fechamento_str]):
             return jsonify({"erro": "Dados de fatura incompletos"}), 400
 
         try:
@@ -713,10 +1310,21 @@ def handle_faturas_por_cartao(cartao_id):
             faturasCartoesDtVencimento=dt_vencimento,
             faturasCartoesFechamento=dt_fechamento,
             faturasCartoesValor=valor,
+            faturasCartoesFechado=False,
         )
 
         db.session.add(nova_fatura)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return (
+                jsonify({"erro": "O cartão já tem uma fatura com esse fechamento"}),
+                409,
+            )
+        registrar_alteracoes(FaturasCartoes, [nova_fatura.faturasCartoesId])
         db.session.commit()
+        invalidar_referencias(FaturasCartoes)
         return (
             jsonify(
                 {
@@ -728,27 +1336,38 @@ def handle_faturas_por_cartao(cartao_id):
         )
 
 
+# Rota para FECHAR as faturas até uma data (padrão: hoje): atribui as compras
+# de cartão sem fatura, recalcula as faturas abertas e fecha as vencidas
+@app.route("/cartoes/faturas/fechar", methods=["POST"])
+def handle_fechar_faturas():
+    ate = _param_data("ate") or date.today()
+    resultado = fechar_faturas(ate)
+    resultado["mensagem"] = f"{resultado['faturas_fechadas']} faturas fechadas"
+    return jsonify(resultado), 200
+
+
 # --- NOVAS ROTAS PARA TEMPLATES DE LANÇAMENTOS RECORRENTES ---
 
 
+TEMPLATE_JSON = Serializador(
+    Campo("id", OperacoesRecorrente.recorrencia_id),
+    Campo("descricao", OperacoesRecorrente.recorrencia_descricao),
+    Campo("valor", OperacoesRecorrente.recorrencia_valor),
+    Campo("tipo", OperacoesRecorrente.recorrencia_tipo),
+    Campo("categoria", OperacoesRecorrente.recorrencia_categoria),
+    Campo("fatura", OperacoesRecorrente.recorrencia_fatura),
+)
+
+
 # Rota para LISTAR todos os templates ou CRIAR um novo
 @app.route("/lancamentos-recorrentes", methods=["GET", "POST"])
 def handle_templates_recorrentes():
     if request.method == "GET":
-        templates = OperacoesRecorrente.query.all()
-        lista_templates = []
-        for template in templates:
-            lista_templates.append(
-                {
-                    "id": template.recorrencia_id,
-                    "descricao": template.recorrencia_descricao,
-                    "valor": str(template.recorrencia_valor),
-                    "tipo": template.recorrencia_tipo,
-                    "categoria": template.recorrencia_categoria,
-                    "fatura": template.recorrencia_fatura,
-                }
-            )
-        return jsonify(lista_templates), 200
+        templates, proximo_cursor = _paginar(
+            db.session.query(*TEMPLATE_JSON.colunas),
+            OperacoesRecorrente.recorrencia_id,
+        )
+        return _resposta_paginada(TEMPLATE_JSON.lista(templates), proximo_cursor), 200
 
     elif request.method == "POST":
         data = request.json
@@ -782,25 +1401,25 @@ def handle_templates_recorrentes():
 # --- NOVAS ROTAS PARA REGRAS DE RECORRÊNCIA ---
 
 
+REGRA_JSON = Serializador(
+    Campo("id", Recorrencias.recorrencia_id),
+    Campo("operacao_id", Recorrencias.operacao_id),
+    Campo("descricao", Recorrencias.recorrencia_descricao),
+    Campo("frequencia", Recorrencias.frequencia),
+    Campo("data_inicio", Recorrencias.data_inicio),
+    Campo("data_fim", Recorrencias.data_fim),
+    Campo("status", Recorrencias.status),
+)
+
+
 # Rota para LISTAR todas as regras ou CRIAR uma nova
 @app.route("/regras-recorrencia", methods=["GET", "POST"])
 def handle_regras_recorrencia():
     if request.method == "GET":
-        regras = Recorrencias.query.all()
-        lista_regras = []
-        for regra in regras:
-            lista_regras.append(
-                {
-                    "id": regra.recorrencia_id,
-                    "operacao_id": regra.operacao_id,
-                    "descricao": regra.recorrencia_descricao,
-                    "frequencia": regra.frequencia,
-                    "data_inicio": str(regra.data_inicio),
-                    "data_fim": str(regra.data_fim) if regra.data_fim else None,
-                    "status": regra.status,
-                }
-            )
-        return jsonify(lista_regras), 200
+        regras, proximo_cursor = _paginar(
+            db.session.query(*REGRA_JSON.colunas), Recorrencias.recorrencia_id
+        )
+        return _resposta_paginada(REGRA_JSON.lista(regras), proximo_cursor), 200
 
     elif request.method == "POST":
         data = request.json
@@ -828,6 +1447,7 @@ def handle_regras_recorrencia():
                 else None
             ),
             status=status,
+            dias_uteis=data.get("dias_uteis"),
         )
 
         db.session.add(nova_regra)
@@ -843,6 +1463,248 @@ def handle_regras_recorrencia():
         )
 
 
+# Rota para GERAR os lançamentos das regras de recorrência ativas até uma data
+# (padrão: hoje). Pode ser chamada várias vezes: só gera o que falta.
+@app.route("/regras-recorrencia/gerar", methods=["POST"])
+def handle_gerar_recorrencias():
+    ate = _param_data("ate") or date.today()
+    resultado = materializar_recorrencias(ate)
+    resultado["mensagem"] = f"{resultado['lancamentos']} lançamentos gerados"
+    return jsonify(resultado), 200
+
+
+# --- TAREFAS EM SEGUNDO PLANO ---
+
+
+TAREFA_JSON = Serializador(
+    Campo("id", Tarefas.tarefas_id),
+    Campo("tipo", Tarefas.tarefas_tipo),
+    Campo("status", Tarefas.tarefas_status),
+    Campo("progresso", Tarefas.tarefas_progresso),
+    Campo("mensagem", Tarefas.tarefas_mensagem),
+    Campo("tentativas", Tarefas.tarefas_tentativas),
+    Campo("erro", Tarefas.tarefas_erro),
+    Campo("criada", Tarefas.tarefas_criada),
+    Campo("iniciada", Tarefas.tarefas_iniciada),
+    Campo("concluida", Tarefas.tarefas_concluida),
+)
+
+
+def _resposta_tarefa(tarefa_id: int, status: int):
+    tarefa = (
+        db.session.query(*TAREFA_JSON.colunas)
+        .filter(Tarefas.tarefas_id == tarefa_id)
+        .first()
+    )
+    if not tarefa:
+        return jsonify({"erro": "Tarefa não encontrada"}), 404
+    return jsonify(TAREFA_JSON(tarefa)), status, {"Location": f"/tarefas/{tarefa_id}"}
+
+
+# Rota para LISTAR as tarefas (filtro opcional por status)
+@app.route("/tarefas", methods=["GET"])
+def handle_tarefas():
+    consulta = db.session.query(*TAREFA_JSON.colunas)
+    if request.args.get("status"):
+        consulta = consulta.filter(Tarefas.tarefas_status == request.args["status"])
+    tarefas, proximo_cursor = _paginar(consulta, Tarefas.tarefas_id)
+    return _resposta_paginada(TAREFA_JSON.lista(tarefas), proximo_cursor), 200
+
+
+# Rota para ENVIAR uma tarefa em segundo plano: importar-lancamentos (mesmo
+# arquivo e parâmetros de POST /lancamentos/importar), gerar-recorrencias ou
+# fechar-faturas (parâmetro 'ate', padrão hoje). Responde 202 com a tarefa;
+# acompanhe por GET /tarefas/<id>. Com o cabeçalho Idempotency-Key, reenviar
+# devolve a tarefa do primeiro envio em vez de criar outra.
+@app.route("/tarefas/<tipo>", methods=["POST"])
+def handle_enviar_tarefa(tipo):
+    if tipo not in TIPOS_TAREFAS:
+        return jsonify({"erro": "Tipo de tarefa desconhecido"}), 404
+    chave = request.headers.get("Idempotency-Key")
+    if chave:
+        existente = tarefa_por_chave(chave)
+        if existente is not None:
+            return _resposta_tarefa(existente.tarefas_id, 200)
+
+    if tipo == "importar-lancamentos":
+        arquivo = request.files.get("arquivo")
+        parametros = _parametros_importacao((arquivo.filename or "") if arquivo else "")
+        parametros["arquivo"] = salvar_arquivo(
+            arquivo.stream if arquivo else request.stream
+        )
+    else:
+        parametros = {"ate": _param_data("ate") or date.today()}
+
+    tarefa, criada = enviar_tarefa(tipo, parametros, chave)
+    if not criada:
+        apagar_arquivo(parametros)
+    return _resposta_tarefa(tarefa.tarefas_id, 202 if criada else 200)
+
+
+# Rota para ACOMPANHAR uma tarefa: status, progresso (0 a 100) e mensagem
+@app.route("/tarefas/<int:tarefa_id>", methods=["GET"])
+def handle_tarefa(tarefa_id):
+    return _resposta_tarefa(tarefa_id, 200)
+
+
+# Rota para obter o RESULTADO de uma tarefa concluída (409 enquanto ela não
+# termina)
+@app.route("/tarefas/<int:tarefa_id>/resultado", methods=["GET"])
+def handle_resultado_tarefa(tarefa_id):
+    tarefa = db.session.get(Tarefas, tarefa_id)
+    if not tarefa:
+        return jsonify({"erro": "Tarefa não encontrada"}), 404
+    if tarefa.tarefas_status == STATUS_CONCLUIDA:
+        return app.response_class(tarefa.tarefas_resultado, mimetype=app.json.mimetype)
+    if tarefa.tarefas_status == STATUS_ERRO:
+        return jsonify({"erro": tarefa.tarefas_erro, "status": STATUS_ERRO}), 500
+    return (
+        jsonify(
+            {"erro": "Tarefa ainda não concluída", "status": tarefa.tarefas_status}
+        ),
+        409,
+    )
+
+
+# Sincronização incremental: registros criados, alterados ou excluídos depois
+# do token 'since' (0 ou ausente na primeira vez). O cliente guarda o 'token'
+# devolvido e chama de novo enquanto 'mais' for verdadeiro.
+@app.route("/sync", methods=["GET"])
+def handle_sync():
+    desde = _param_int("since") or 0
+    limite = _param_int("limit")
+    limite = LIMITE_SINCRONIZACAO_PADRAO if limite is None else limite
+    if limite < 1:
+        raise ParametroInvalido("O parâmetro 'limit' deve ser maior que zero")
+    return (
+        jsonify(alteracoes_desde(desde, min(limite, LIMITE_SINCRONIZACAO_MAXIMO))),
+        200,
+    )
+
+
+# Contadores do cache de dados de referência deste processo
+@app.route("/cache/referencias", methods=["GET"])
+def handle_cache_referencias():
+    return jsonify(referencias.estatisticas_referencias()), 200
+
+
+# Tamanho e atualizações da cópia colunar dos lançamentos, neste processo
+@app.route("/metricas/colunar", methods=["GET"])
+def handle_metricas_colunar():
+    return jsonify(estatisticas_colunar()), 200
+
+
+# Estado do pool de conexões deste processo e tempo de espera por conexão
+@app.route("/metricas/pool", methods=["GET"])
+def handle_metricas_pool():
+    return jsonify(estatisticas_pool(db.engine)), 200
+
+
+# Consultas SQL, tempo no banco e na serialização por rota, neste processo
+@app.route("/metricas/rotas", methods=["GET"])
+def handle_metricas_rotas():
+    return jsonify(estatisticas_rotas()), 200
+
+
+# Mesmo que POST /regras-recorrencia/gerar, para rodar agendado (cron)
+@app.cli.command("gerar-recorrencias")
+@click.option("--ate", help="Data alvo AAAA-MM-DD (padrão: hoje)")
+def gerar_recorrencias(ate):
+    resultado = materializar_recorrencias(
+        date.fromisoformat(ate) if ate else date.today()
+    )
+    print(
+        f"{resultado['lancamentos']} lançamentos gerados "
+        f"para {resultado['regras']} regras"
+    )
+    if resultado["ignoradas"]:
+        print(f"Regras com frequência desconhecida: {resultado['ignoradas']}")
+
+
+# Mesmo que POST /cartoes/faturas/fechar, para rodar agendado (cron)
+@app.cli.command("fechar-faturas")
+@click.option("--ate", help="Data alvo AAAA-MM-DD (padrão: hoje)")
+def fechar_faturas_cli(ate):
+    resultado = fechar_faturas(date.fromisoformat(ate) if ate else date.today())
+    print(
+        f"{resultado['compras_atribuidas']} compras atribuídas, "
+        f"{resultado['faturas_recalculadas']} faturas recalculadas, "
+        f"{resultado['faturas_fechadas']} faturas fechadas"
+    )
+
+
+# Executa as tarefas da fila neste processo: worker dedicado, com
+# TAREFAS_THREADS=0 nos processos web, ou agendado (cron) com --esvaziar
+@app.cli.command("executar-tarefas")
+@click.option("--threads", default=1, show_default=True)
+@click.option("--esvaziar", is_flag=True, help="Sai quando a fila ficar vazia")
+def executar_tarefas_cli(threads, esvaziar):
+    for worker in subir_workers(app, threads, esvaziar):
+        worker.join()
+
+
+# Aplica nas tabelas já existentes as colunas e os índices novos declarados
+# nos modelos. O db.create_all() só cria tabelas que ainda não existem.
+# As colunas novas precisam aceitar NULL.
+@app.cli.command("migrar-esquema")
+def migrar_esquema():
+    db.create_all()
+    inspetor = db.inspect(db.engine)
+    preparador = db.engine.dialect.identifier_preparer
+    for tabela in db.metadata.sorted_tables:
+        existentes = {c["name"] for c in inspetor.get_columns(tabela.name)}
+        for coluna in tabela.columns:
+            if coluna.name not in existentes:
+                ddl = CreateColumn(coluna).compile(dialect=db.engine.dialect)
+                with db.engine.begin() as conexao:
+                    conexao.exec_driver_sql(
+                        f"ALTER TABLE {preparador.format_table(tabela)} ADD COLUMN {ddl}"
+                    )
+                print(f"{tabela.name}: coluna {coluna.name}")
+        for indice in tabela.indexes:
+            indice.create(db.engine, checkfirst=True)
+            print(f"{tabela.name}: {indice.name}")
+
+
+# Preenche operacoes_fingerprint dos lançamentos gravados antes da coluna
+@app.cli.command("preencher-fingerprints")
+def preencher_fingerprints_cli():
+    total = preencher_fingerprints()
+    print(f"{total} lançamentos atualizados")
+
+
+# Registra no log de alterações os dados que já existiam, para que a primeira
+# chamada a GET /sync (since=0) entregue tudo. Rodar uma vez após criar a
+# tabela alteracoes num banco com dados.
+@app.cli.command("iniciar-sincronizacao")
+def iniciar_sincronizacao_cli():
+    db.create_all()
+    for nome, total in iniciar_sincronizacao().items():
+        print(f"{nome}: {total} registros")
+
+
+# Recalcula toda a tabela saldos_diarios a partir das operações.
+# Necessário uma vez ao criar a tabela num banco que já tem lançamentos.
+@app.cli.command("reconstruir-saldos")
+def reconstruir_saldos():
+    db.create_all()
+    total = reconstruir_saldos_diarios()
+    print(f"{total} saldos diários gravados")
+
+
+# Confere saldos_diarios contra o recálculo completo (sai com código 1 se
+# houver divergências)
+@app.cli.command("verificar-saldos")
+def verificar_saldos():
+    divergencias = verificar_saldos_diarios()
+    for conta, dia, gravado, esperado in divergencias[:50]:
+        print(f"conta {conta} em {dia}: gravado {gravado}, esperado {esperado}")
+    if divergencias:
+        print(f"{len(divergencias)} divergências encontradas")
+        raise SystemExit(1)
+    print("Saldos diários consistentes")
+
+
 # Bloco para executar a aplicação
 if __name__ == "__main__":
     with app.app_context():
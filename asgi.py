@@ -0,0 +1,196 @@
+# Modo ASGI: serve as mesmas rotas de app.py num servidor assíncrono.
+#
+#   uvicorn asgi:aplicacao --port 8000
+#
+# As rotas de leitura mais pesadas (projeção, relatório de categorias e
+# saldos) rodam aqui, assíncronas, na engine asyncio do SQLAlchemy: enquanto
+# uma requisição espera o banco o processo atende outras, e as consultas
+# independentes de uma mesma requisição vão juntas (asyncio.gather), cada uma
+# na sua conexão. As demais rotas seguem para o app Flask, num pool de
+# threads (a2wsgi).
+#
+# Dependências deste modo: uvicorn, a2wsgi, sqlalchemy[asyncio] e o driver
+# assíncrono do banco (aiosqlite, aiomysql ou asyncpg). A URI assíncrona sai
+# de DATABASE_URI trocando o driver, ou de DATABASE_URI_ASYNC.
+import asyncio
+import os
+import re
+from datetime import date
+from itertools import chain
+from urllib.parse import parse_qsl
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MultiDict
+
+from app import (
+    ParametroInvalido,
+    _filtros_lancamentos,
+    _param_agrupamento,
+    _param_bool,
+    _param_data,
+    _param_meses,
+    _saldo_para_dict,
+    app,
+)
+from conexoes import MAX_OVERFLOW, POOL_PRE_PING, POOL_RECYCLE, POOL_SIZE, POOL_TIMEOUT
+from models import db
+from projecao import projetar_saldos_async
+from relatorios import consultas_relatorio, montar_relatorio
+from saldos import consulta_saldos, saldo_consolidado, saldos_das_linhas
+
+# Driver assíncrono de cada banco
+DRIVERS_ASYNC = {
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+    "postgresql": "postgresql+asyncpg",
+}
+
+# Threads que atendem as rotas do app Flask (síncronas)
+THREADS_WSGI = int(os.getenv("ASGI_THREADS_WSGI", "10"))
+
+
+# URI da engine assíncrona: a mesma do app (já com o caminho do SQLite e o
+# charset do MySQL ajustados pelo Flask-SQLAlchemy), com o driver assíncrono
+def _uri_async():
+    if os.getenv("DATABASE_URI_ASYNC"):
+        return os.getenv("DATABASE_URI_ASYNC")
+    with app.app_context():
+        url = db.engine.url
+    banco = url.get_backend_name()
+    if banco not in DRIVERS_ASYNC:
+        raise RuntimeError(
+            f"Sem driver assíncrono para {banco}: use DATABASE_URI_ASYNC"
+        )
+    if banco == "sqlite" and url.database in (None, "", ":memory:"):
+        raise RuntimeError("O modo ASGI precisa de um banco SQLite em arquivo")
+    return url.set(drivername=DRIVERS_ASYNC[banco])
+
+
+engine = create_async_engine(
+    _uri_async(),
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT,
+    pool_recycle=POOL_RECYCLE,
+    pool_pre_ping=POOL_PRE_PING,
+)
+
+
+# Roda uma consulta numa conexão própria e devolve as linhas. Consultas
+# disparadas juntas veem cada uma o seu instantâneo do banco, o que basta
+# para as rotas de leitura daqui.
+async def executar(consulta):
+    async with engine.connect() as conexao:
+        return (await conexao.execute(consulta)).all()
+
+
+# --- Rotas assíncronas (mesmas respostas das rotas de app.py) ---
+
+
+async def handle_projecao(args):
+    return await projetar_saldos_async(executar, date.today(), _param_meses(args)), 200
+
+
+# As consultas por nível do relatório (sem ROLLUP) rodam em paralelo em vez
+# de unidas num UNION ALL
+async def handle_relatorio_categorias(args):
+    agrupamento = _param_agrupamento(args)
+    consultas = consultas_relatorio(
+        _filtros_lancamentos(args), agrupamento, engine.dialect.name
+    )
+    partes = await asyncio.gather(*map(executar, consultas))
+    periodos = montar_relatorio(chain.from_iterable(partes), agrupamento)
+    return {"agrupamento": agrupamento, "periodos": periodos}, 200
+
+
+async def handle_saldos_contas(args):
+    ate = _param_data("ate", args)
+    saldos = saldos_das_linhas(
+        await executar(consulta_saldos(ate, bool(_param_bool("efetivados", args))))
+    )
+    return {
+        "ate": str(ate) if ate else None,
+        "contas": [_saldo_para_dict(saldo) for saldo in saldos],
+        "saldo_total": str(saldo_consolidado(saldos)),
+    }, 200
+
+
+async def handle_saldo_conta(args, conta_id):
+    ate = _param_data("ate", args)
+    saldos = saldos_das_linhas(
+        await executar(
+            consulta_saldos(
+                ate, bool(_param_bool("efetivados", args)), contas=[int(conta_id)]
+            )
+        )
+    )
+    if not saldos:
+        return {"erro": "Conta não encontrada"}, 404
+    resposta = _saldo_para_dict(saldos[0])
+    resposta["ate"] = str(ate) if ate else None
+    return resposta, 200
+
+
+# Rotas GET atendidas aqui: padrão do caminho -> handler (os grupos do padrão
+# viram argumentos)
+ROTAS_ASYNC = [
+    (re.compile(r"/projecao"), handle_projecao),
+    (re.compile(r"/relatorios/categorias"), handle_relatorio_categorias),
+    (re.compile(r"/contas-bancarias/saldos"), handle_saldos_contas),
+    (re.compile(r"/contas-bancarias/(\d+)/saldo"), handle_saldo_conta),
+]
+
+
+async def _responder(send, corpo, status: int) -> None:
+    dados = app.json.dumps(corpo).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", app.json.mimetype.encode()),
+                (b"content-length", str(len(dados)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": dados})
+
+
+class AplicacaoAsgi:
+    def __init__(self):
+        self.flask = WSGIMiddleware(app, workers=THREADS_WSGI)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._ciclo_de_vida(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] == "GET":
+            for padrao, handler in ROTAS_ASYNC:
+                encontrada = padrao.fullmatch(scope["path"])
+                if encontrada:
+                    args = MultiDict(
+                        parse_qsl(
+                            scope["query_string"].decode(), keep_blank_values=True
+                        )
+                    )
+                    try:
+                        corpo, status = await handler(args, *encontrada.groups())
+                    except ParametroInvalido as e:
+                        corpo, status = {"erro": str(e)}, 400
+                    await _responder(send, corpo, status)
+                    return
+        await self.flask(scope, receive, send)
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensagem = await receive()
+            if mensagem["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif mensagem["type"] == "lifespan.shutdown":
+                await engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+aplicacao = AplicacaoAsgi()
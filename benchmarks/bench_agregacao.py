@@ -0,0 +1,126 @@
+# Benchmark da agregação particionada (agregacao.py).
+#
+# Sobre o banco gerado por benchmarks/dados.py, mede o relatório de
+# categorias (por mês, por ano e total, de todas as contas e de uma conta só)
+# e a série de saldos diários (saldos.calcular_serie_diaria) com 1, 2, 4...
+# consultas simultâneas, até o número de núcleos. Mostra o tempo mediano e o
+# ganho sobre a execução serial de cada cenário e grava em JSON.
+#
+# Uso:
+#   python benchmarks/bench_agregacao.py                 # 10M lançamentos
+#   python benchmarks/bench_agregacao.py -t 1 2 4 8 16 -r 5
+#   DATABASE_URI=postgresql://... python benchmarks/bench_agregacao.py -n 2000000
+#
+# O número de consultas simultâneas fica limitado ao pool de conexões: para
+# ir além de DB_POOL_SIZE + DB_MAX_OVERFLOW, aumente o pool.
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime
+
+from bench_api import RESULTADOS, commit_atual
+
+import agregacao
+from app import app
+from conexoes import MAX_OVERFLOW, POOL_SIZE
+from dados import operacoes_existentes, semear
+from models import db, Operacoes
+from relatorios import relatorio_categorias
+from saldos import calcular_serie_diaria
+
+# (nome, função)
+CENARIOS = [
+    ("relatorio mensal", lambda: relatorio_categorias([], "mes")),
+    ("relatorio anual", lambda: relatorio_categorias([], "ano")),
+    ("relatorio total", lambda: relatorio_categorias([], "total")),
+    (
+        "relatorio da conta",
+        lambda: relatorio_categorias([Operacoes.operacoes_conta == 3], "mes", 3),
+    ),
+    ("serie diaria", calcular_serie_diaria),
+]
+
+
+def medir(repeticoes: int) -> dict:
+    resultados = {}
+    for nome, funcao in CENARIOS:
+        funcao()
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            funcao()
+            tempos.append(time.perf_counter() - inicio)
+            db.session.remove()
+        resultados[nome] = statistics.median(tempos) * 1000
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark da agregação paralela")
+    parser.add_argument("-n", "--operacoes", type=int, default=10_000_000)
+    parser.add_argument("--semear", action="store_true", help="Gera o banco de novo")
+    parser.add_argument("-t", "--threads", type=int, nargs="+")
+    parser.add_argument("-r", "--repeticoes", type=int, default=3)
+    parser.add_argument("-o", "--saida", help="Arquivo JSON do resultado")
+    args = parser.parse_args()
+    nucleos = os.cpu_count() or 1
+    threads = args.threads or sorted(
+        {1, nucleos, *(2**i for i in range(nucleos.bit_length()) if 2**i < nucleos)}
+    )
+    limite = POOL_SIZE + MAX_OVERFLOW
+    if max(threads) > limite:
+        raise SystemExit(f"O pool tem {limite} conexões: aumente DB_POOL_SIZE")
+
+    with app.app_context():
+        url = db.engine.url
+        if url.get_backend_name() == "sqlite" and not url.database:
+            raise SystemExit("O benchmark precisa de um banco em arquivo")
+        operacoes = operacoes_existentes()
+        if args.semear or not operacoes:
+            print(f"Gerando {args.operacoes} lançamentos...")
+            semear(args.operacoes)
+            operacoes = args.operacoes
+        db.session.remove()
+
+        medidas = {}
+        for quantidade in threads:
+            agregacao.THREADS_AGREGACAO = quantidade
+            print(f"\n{quantidade} consulta(s) simultânea(s)")
+            medidas[str(quantidade)] = medir(args.repeticoes)
+            for nome, ms in medidas[str(quantidade)].items():
+                print(f"  {nome:20s} {ms:10.1f} ms")
+
+    print(f"\n{'cenário':20s} " + " ".join(f"{f't={t}':>8s}" for t in threads))
+    for nome, _ in CENARIOS:
+        serial = medidas[str(threads[0])][nome]
+        ganhos = [serial / max(medidas[str(t)][nome], 1e-9) for t in threads]
+        print(f"{nome:20s} " + " ".join(f"{g:7.2f}x" for g in ganhos))
+
+    resultado = {
+        "meta": {
+            "commit": commit_atual(),
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "nucleos": nucleos,
+            "banco": url.render_as_string(hide_password=True),
+            "operacoes": operacoes,
+            "repeticoes": args.repeticoes,
+            "threads": threads,
+        },
+        "ms": medidas,
+    }
+    saida = args.saida or os.path.join(
+        RESULTADOS, f"agregacao-{resultado['meta']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    print(f"\nResultado gravado em {saida}")
+
+
+if __name__ == "__main__":
+    main()
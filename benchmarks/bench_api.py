@@ -0,0 +1,456 @@
+# Benchmark de carga da API.
+#
+# Chama cada rota de app.py (cenários abaixo) sobre o banco gerado por
+# benchmarks/dados.py, pelo test client do Flask (no mesmo processo) ou por
+# um servidor WSGI de verdade (gunicorn, se instalado; senão o servidor com
+# threads do werkzeug) com N clientes simultâneos. Para cada cenário mostra
+# latência p50/p95/p99, vazão e pico de memória (RSS) do processo que
+# atendeu, e grava tudo em JSON para comparar entre commits.
+#
+# Uso:
+#   python benchmarks/bench_api.py                      # test client, SQLite local
+#   python benchmarks/bench_api.py --servidor -c 8      # servidor WSGI, 8 clientes
+#   python benchmarks/bench_api.py --comparar benchmarks/resultados/anterior.json
+#   DATABASE_URI=mysql+pymysql://... python benchmarks/bench_api.py --semear -n 200000
+#
+# O banco só é gerado se estiver vazio (ou com --semear). Os cenários de
+# escrita alteram os dados e rodam por último; gere o banco de novo para
+# repetir uma medição nas mesmas condições.
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+os.environ.setdefault(
+    "DATABASE_URI", "sqlite:///" + os.path.join(RAIZ, "benchmarks", "bench_api.db")
+)
+
+from app import app  # noqa: E402
+from dados import DATA_BASE, operacoes_existentes, semear  # noqa: E402
+from models import db  # noqa: E402
+
+RESULTADOS = os.path.join(RAIZ, "benchmarks", "resultados")
+
+# (nome, método, caminho, corpo JSON). Ids e datas existem no banco gerado.
+CENARIOS = [
+    ("home", "GET", "/", None),
+    ("tipos-contas", "GET", "/tipos-contas", None),
+    ("tipo-conta", "GET", "/tipos-contas/1", None),
+    ("categorias", "GET", "/categorias", None),
+    ("categoria", "GET", "/categorias/3", None),
+    ("subcategorias da categoria", "GET", "/categorias/3/subcategorias", None),
+    ("subcategoria", "GET", "/subcategorias/7", None),
+    ("lancamentos", "GET", "/lancamentos?limit=100", None),
+    (
+        "lancamentos conta + período",
+        "GET",
+        "/lancamentos?operacoes_conta=3&de=2024-01-01&ate=2024-03-31&limit=500",
+        None,
+    ),
+    ("lancamentos da fatura", "GET", "/lancamentos?operacoes_fatura=42", None),
+    ("lancamento", "GET", "/lancamentos/5000", None),
+    (
+        "exportação ndjson",
+        "GET",
+        "/lancamentos/export?format=ndjson&operacoes_conta=3"
+        "&de=2024-01-01&ate=2024-12-31",
+        None,
+    ),
+    ("contas-bancarias", "GET", "/contas-bancarias", None),
+    ("conta-bancaria", "GET", "/contas-bancarias/3", None),
+    ("saldo da conta", "GET", "/contas-bancarias/3/saldo", None),
+    ("saldos", "GET", "/contas-bancarias/saldos", None),
+    ("projeção", "GET", "/projecao?meses=12", None),
+    (
+        "relatório de categorias",
+        "GET",
+        "/relatorios/categorias?agrupamento=mes&de=2024-01-01&ate=2024-12-31",
+        None,
+    ),
+    ("cartoes", "GET", "/cartoes", None),
+    ("cartao", "GET", "/cartoes/2", None),
+    ("faturas do cartão", "GET", "/cartoes/2/faturas", None),
+    ("lancamentos-recorrentes", "GET", "/lancamentos-recorrentes?limit=100", None),
+    ("regras-recorrencia", "GET", "/regras-recorrencia?limit=100", None),
+    ("sync", "GET", "/sync?since=0&limit=1000", None),
+    # Escritas
+    (
+        "criar lançamento",
+        "POST",
+        "/lancamentos",
+        {
+            "operacoes_tipo": 2,
+            "operacoes_descricao": "Benchmark",
+            "operacoes_data": "2025-05-10",
+            "operacoes_valor": "42.50",
+            "contas_bancarias_id": 3,
+            "subcategorias_id": 7,
+        },
+    ),
+    (
+        "alterar lançamento",
+        "PUT",
+        "/lancamentos/2000",
+        {"operacoes_valor": "99.90", "operacoes_descricao": "Alterado"},
+    ),
+    (
+        "lote de 100 alterações",
+        "POST",
+        "/lancamentos/batch",
+        {
+            "operacoes": [
+                {"acao": "atualizar", "id": 1000 + i, "operacoes_efetivado": True}
+                for i in range(100)
+            ]
+        },
+    ),
+    (
+        "gerar recorrências",
+        "POST",
+        f"/regras-recorrencia/gerar?ate={DATA_BASE.isoformat()}",
+        None,
+    ),
+    (
+        "fechar faturas",
+        "POST",
+        f"/cartoes/faturas/fechar?ate={DATA_BASE.isoformat()}",
+        None,
+    ),
+]
+
+
+# --- Memória ---
+
+
+# Processo e filhos (workers do gunicorn), pelo /proc do Linux
+def _processos(pid: int):
+    pids = [pid]
+    for tarefa in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{tarefa}/children") as arquivo:
+            for filho in arquivo.read().split():
+                pids.extend(_processos(int(filho)))
+    return pids
+
+
+# Zera o pico de RSS (VmHWM) dos processos, para medir cada cenário
+def zerar_pico_rss(pid: int) -> None:
+    try:
+        for processo in _processos(pid):
+            with open(f"/proc/{processo}/clear_refs", "w") as arquivo:
+                arquivo.write("5")
+    except OSError:
+        pass
+
+
+# Maior pico de RSS (MB) entre os processos desde o último zerar_pico_rss. Sem
+# /proc, o pico da vida inteira deste processo (getrusage).
+def pico_rss_mb(pid: int):
+    try:
+        picos = []
+        for processo in _processos(pid):
+            with open(f"/proc/{processo}/status") as arquivo:
+                for linha in arquivo:
+                    if linha.startswith("VmHWM:"):
+                        picos.append(int(linha.split()[1]) / 1024)
+        return round(max(picos), 1)
+    except (OSError, ValueError):
+        if pid != os.getpid():
+            return None
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # KB no Linux, bytes no macOS
+        return round(maximo / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# --- Execução ---
+
+
+# Chamadas pelo test client, uma por vez: [(segundos, status, bytes)]
+def executar_cliente(cliente, metodo: str, caminho: str, corpo, total: int):
+    medidas = []
+    for _ in range(total):
+        inicio = time.perf_counter()
+        resposta = cliente.open(caminho, method=metodo, json=corpo)
+        tamanho = len(resposta.get_data())
+        medidas.append((time.perf_counter() - inicio, resposta.status_code, tamanho))
+    return medidas
+
+
+# Chamadas HTTP com 'concorrencia' clientes, cada um com sua conexão keep-alive
+def executar_http(porta: int, metodo, caminho, corpo, total: int, concorrencia: int):
+    local = threading.local()
+    dados = None if corpo is None else json.dumps(corpo).encode()
+    cabecalhos = {"Content-Type": "application/json"} if dados else {}
+
+    def chamar(_):
+        if not hasattr(local, "conexao"):
+            local.conexao = http.client.HTTPConnection("127.0.0.1", porta, timeout=300)
+        inicio = time.perf_counter()
+        try:
+            local.conexao.request(metodo, caminho, body=dados, headers=cabecalhos)
+            resposta = local.conexao.getresponse()
+            tamanho = len(resposta.read())
+            status = resposta.status
+        except (OSError, http.client.HTTPException):
+            local.conexao.close()
+            tamanho, status = 0, 599
+        return time.perf_counter() - inicio, status, tamanho
+
+    with ThreadPoolExecutor(concorrencia) as executor:
+        return list(executor.map(chamar, range(total)))
+
+
+def resumir(metodo: str, caminho: str, medidas, duracao: float, rss) -> dict:
+    tempos = sorted(m[0] * 1000 for m in medidas)
+    if len(tempos) > 1:
+        percentis = statistics.quantiles(tempos, n=100, method="inclusive")
+        p50, p95, p99 = percentis[49], percentis[94], percentis[98]
+    else:
+        p50 = p95 = p99 = tempos[0]
+    return {
+        "metodo": metodo,
+        "caminho": caminho,
+        "requisicoes": len(medidas),
+        "erros": sum(1 for m in medidas if m[1] >= 400),
+        "status": sorted({m[1] for m in medidas}),
+        "p50_ms": round(p50, 3),
+        "p95_ms": round(p95, 3),
+        "p99_ms": round(p99, 3),
+        "media_ms": round(statistics.fmean(tempos), 3),
+        "max_ms": round(tempos[-1], 3),
+        "rps": round(len(medidas) / duracao, 1),
+        "bytes_medio": round(statistics.fmean(m[2] for m in medidas)),
+        "rss_pico_mb": rss,
+    }
+
+
+# Sobe o servidor WSGI num processo separado e espera ele responder
+def iniciar_servidor(porta: int, workers: int):
+    if importlib.util.find_spec("gunicorn") is not None:
+        comando = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--workers",
+            str(workers),
+            "--threads",
+            "4",
+            "--bind",
+            f"127.0.0.1:{porta}",
+            "--timeout",
+            "300",
+            "app:app",
+        ]
+        nome = f"gunicorn ({workers} workers x 4 threads)"
+    else:
+        comando = [sys.executable, os.path.abspath(__file__), "--servir", str(porta)]
+        nome = "werkzeug (threads)"
+    return subir_servidor(comando, porta), nome
+
+
+# Roda o comando do servidor e espera ele responder na porta
+def subir_servidor(comando, porta: int, ambiente=None):
+    processo = subprocess.Popen(
+        comando,
+        cwd=RAIZ,
+        env=ambiente,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise SystemExit(f"O servidor terminou ao iniciar: {' '.join(comando)}")
+        try:
+            conexao = http.client.HTTPConnection("127.0.0.1", porta, timeout=5)
+            conexao.request("GET", "/")
+            conexao.getresponse().read()
+            conexao.close()
+            return processo
+        except OSError:
+            time.sleep(0.2)
+    processo.terminate()
+    raise SystemExit("O servidor não respondeu em 60s")
+
+
+def servir(porta: int) -> None:
+    from werkzeug.serving import run_simple
+
+    run_simple("127.0.0.1", porta, app, threaded=True)
+
+
+def commit_atual() -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=RAIZ,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        sujo = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=RAIZ,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        return commit + ("-sujo" if sujo else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecido"
+
+
+# Compara com um resultado anterior; devolve os cenários cujo p95 piorou mais
+# que 'limite' (fração)
+def comparar(atual: dict, anterior: dict, limite: float):
+    print(f"\nComparação com {anterior['meta']['commit']} ({anterior['meta']['data']})")
+    for campo in ("modo", "servidor", "concorrencia", "operacoes", "banco"):
+        if atual["meta"].get(campo) != anterior["meta"].get(campo):
+            print(
+                f"ATENÇÃO: '{campo}' diferente ({anterior['meta'].get(campo)} -> "
+                f"{atual['meta'].get(campo)}); os números não são comparáveis"
+            )
+    print(f"{'cenário':32s} {'p50':>17s} {'p95':>17s} {'req/s':>17s}")
+    regressoes = []
+    for nome, depois in atual["cenarios"].items():
+        antes = anterior["cenarios"].get(nome)
+        if antes is None:
+            continue
+        colunas = []
+        for campo in ("p50_ms", "p95_ms", "rps"):
+            variacao = (depois[campo] - antes[campo]) / max(antes[campo], 1e-9)
+            colunas.append(f"{depois[campo]:9.2f} {variacao:+6.1%}")
+        piorou = (depois["p95_ms"] - antes["p95_ms"]) / max(antes["p95_ms"], 1e-9)
+        marca = "  REGRESSÃO" if piorou > limite else ""
+        if marca:
+            regressoes.append(nome)
+        print(f"{nome:32s} {'  '.join(colunas)}{marca}")
+    return regressoes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de carga da API")
+    parser.add_argument("-n", "--operacoes", type=int, default=1_000_000)
+    parser.add_argument("--semear", action="store_true", help="Gera o banco de novo")
+    parser.add_argument("-r", "--requisicoes", type=int, default=50)
+    parser.add_argument("-a", "--aquecimento", type=int, default=3)
+    parser.add_argument("--servidor", action="store_true", help="Via servidor WSGI")
+    parser.add_argument("-c", "--concorrencia", type=int, default=4)
+    parser.add_argument("-w", "--workers", type=int, default=2)
+    parser.add_argument("-p", "--porta", type=int, default=8765)
+    parser.add_argument("-f", "--filtro", help="Só os cenários com este trecho")
+    parser.add_argument("-o", "--saida", help="Arquivo JSON do resultado")
+    parser.add_argument("--comparar", help="Resultado anterior (JSON)")
+    parser.add_argument("--limite-regressao", type=float, default=0.10)
+    parser.add_argument("--servir", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servir:
+        servir(args.servir)
+        return
+
+    with app.app_context():
+        url = db.engine.url
+        if args.servidor and url.get_backend_name() == "sqlite" and not url.database:
+            raise SystemExit("O modo --servidor precisa de um banco em arquivo")
+        operacoes = operacoes_existentes()
+        if args.semear or not operacoes:
+            print(f"Gerando {args.operacoes} lançamentos...")
+            semear(args.operacoes)
+            operacoes = args.operacoes
+        db.session.remove()
+
+    cenarios = [c for c in CENARIOS if not args.filtro or args.filtro in c[0]]
+    meta = {
+        "commit": commit_atual(),
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "banco": url.render_as_string(hide_password=True),
+        "operacoes": operacoes,
+        "modo": "servidor" if args.servidor else "cliente",
+        "requisicoes": args.requisicoes,
+        "aquecimento": args.aquecimento,
+    }
+
+    servidor = None
+    if args.servidor:
+        servidor, meta["servidor"] = iniciar_servidor(args.porta, args.workers)
+        meta["concorrencia"] = args.concorrencia
+        pid = servidor.pid
+    else:
+        cliente = app.test_client()
+        pid = os.getpid()
+    print(
+        f"{meta['banco']}: {operacoes} lançamentos; modo {meta['modo']}"
+        + (f", {meta['servidor']}, {args.concorrencia} clientes" if servidor else "")
+    )
+
+    resultados = {}
+    try:
+        for nome, metodo, caminho, corpo in cenarios:
+            if servidor:
+                executar_http(args.porta, metodo, caminho, corpo, args.aquecimento, 1)
+            else:
+                executar_cliente(cliente, metodo, caminho, corpo, args.aquecimento)
+            zerar_pico_rss(pid)
+            inicio = time.perf_counter()
+            if servidor:
+                medidas = executar_http(
+                    args.porta,
+                    metodo,
+                    caminho,
+                    corpo,
+                    args.requisicoes,
+                    args.concorrencia,
+                )
+            else:
+                medidas = executar_cliente(
+                    cliente, metodo, caminho, corpo, args.requisicoes
+                )
+            duracao = time.perf_counter() - inicio
+            resultados[nome] = resumir(
+                metodo, caminho, medidas, duracao, pico_rss_mb(pid)
+            )
+            r = resultados[nome]
+            print(
+                f"{nome:32s} p50 {r['p50_ms']:9.2f}  p95 {r['p95_ms']:9.2f}  "
+                f"p99 {r['p99_ms']:9.2f} ms  {r['rps']:8.1f} req/s  "
+                f"RSS {r['rss_pico_mb']} MB"
+                + (f"  ERROS {r['erros']} {r['status']}" if r["erros"] else "")
+            )
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait()
+
+    resultado = {"meta": meta, "cenarios": resultados}
+    saida = args.saida or os.path.join(
+        RESULTADOS, f"api-{meta['modo']}-{meta['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    print(f"\nResultado gravado em {saida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            regressoes = comparar(resultado, json.load(arquivo), args.limite_regressao)
+        if regressoes:
+            print(f"\n{len(regressoes)} cenário(s) com p95 acima do limite")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# Benchmark do modo ASGI (asgi.py) contra o modo WSGI (app.py).
+#
+# Sobe um processo de cada servidor sobre o banco gerado por
+# benchmarks/dados.py e chama as rotas atendidas de forma assíncrona com
+# concorrência crescente. O modo WSGI atende com um pool fixo de threads
+# (gunicorn, 1 worker; sem gunicorn, o servidor com threads do werkzeug) e o
+# ASGI com o uvicorn, 1 worker. Mostra vazão, p50/p95 e pico de memória (RSS)
+# de cada modo em cada nível de concorrência e grava em JSON.
+#
+# Uso:
+#   python benchmarks/bench_asgi.py
+#   python benchmarks/bench_asgi.py -c 1 16 64 --threads 8 -r 200
+#   DATABASE_URI=mysql+pymysql://... python benchmarks/bench_asgi.py
+#
+# Precisa de uvicorn, a2wsgi, sqlalchemy[asyncio] e do driver assíncrono do
+# banco (ver asgi.py). As duas engines usam o mesmo DB_POOL_SIZE.
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+from bench_api import (
+    RAIZ,
+    RESULTADOS,
+    commit_atual,
+    executar_http,
+    pico_rss_mb,
+    resumir,
+    subir_servidor,
+    zerar_pico_rss,
+)
+
+from app import app
+from dados import operacoes_existentes, semear
+from models import db
+
+# (nome, caminho). Todos GET, atendidos por asgi.py no modo ASGI.
+CENARIOS = [
+    ("projecao", "/projecao?meses=24"),
+    ("relatorio mensal", "/relatorios/categorias?de=2024-01-01&ate=2024-12-31"),
+    ("relatorio anual", "/relatorios/categorias?agrupamento=ano"),
+    ("saldos", "/contas-bancarias/saldos"),
+    ("saldo da conta", "/contas-bancarias/3/saldo?ate=2024-12-31"),
+]
+
+
+def comando_wsgi(porta: int, threads: int):
+    if importlib.util.find_spec("gunicorn") is not None:
+        return [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--workers",
+            "1",
+            "--threads",
+            str(threads),
+            "--bind",
+            f"127.0.0.1:{porta}",
+            "--timeout",
+            "300",
+            "app:app",
+        ], f"gunicorn (1 worker x {threads} threads)"
+    return [
+        sys.executable,
+        os.path.join(RAIZ, "benchmarks", "bench_api.py"),
+        "--servir",
+        str(porta),
+    ], "werkzeug (1 processo, uma thread por conexão)"
+
+
+def comando_asgi(porta: int):
+    return [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "asgi:aplicacao",
+        "--workers",
+        "1",
+        "--host",
+        "127.0.0.1",
+        "--port",
+        str(porta),
+        "--no-access-log",
+    ], "uvicorn (1 worker)"
+
+
+# Roda os cenários em cada nível de concorrência contra o servidor já no ar
+def medir(processo, porta: int, concorrencias, requisicoes: int, aquecimento: int):
+    resultados = {}
+    for nome, caminho in CENARIOS:
+        executar_http(porta, "GET", caminho, None, aquecimento, 1)
+        resultados[nome] = {}
+        for concorrencia in concorrencias:
+            total = max(requisicoes, concorrencia * 4)
+            zerar_pico_rss(processo.pid)
+            inicio = time.perf_counter()
+            medidas = executar_http(porta, "GET", caminho, None, total, concorrencia)
+            duracao = time.perf_counter() - inicio
+            r = resumir("GET", caminho, medidas, duracao, pico_rss_mb(processo.pid))
+            resultados[nome][str(concorrencia)] = r
+            print(
+                f"  {nome:20s} c={concorrencia:<4d} {r['rps']:8.1f} req/s  "
+                f"p50 {r['p50_ms']:9.2f}  p95 {r['p95_ms']:9.2f} ms  "
+                f"RSS {r['rss_pico_mb']} MB"
+                + (f"  ERROS {r['erros']} {r['status']}" if r["erros"] else "")
+            )
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark ASGI x WSGI")
+    parser.add_argument("-n", "--operacoes", type=int, default=1_000_000)
+    parser.add_argument("--semear", action="store_true", help="Gera o banco de novo")
+    parser.add_argument("-c", "--concorrencia", type=int, nargs="+")
+    parser.add_argument("-r", "--requisicoes", type=int, default=100)
+    parser.add_argument("-a", "--aquecimento", type=int, default=3)
+    parser.add_argument("-t", "--threads", type=int, default=8, help="Threads WSGI")
+    parser.add_argument("--pool", type=int, default=10, help="DB_POOL_SIZE")
+    parser.add_argument("-p", "--porta", type=int, default=8766)
+    parser.add_argument("-o", "--saida", help="Arquivo JSON do resultado")
+    args = parser.parse_args()
+    concorrencias = args.concorrencia or [1, 8, 32, 64]
+
+    for modulo in ("uvicorn", "a2wsgi"):
+        if importlib.util.find_spec(modulo) is None:
+            raise SystemExit(f"O modo ASGI precisa do pacote {modulo}")
+
+    with app.app_context():
+        url = db.engine.url
+        if url.get_backend_name() == "sqlite" and not url.database:
+            raise SystemExit("O benchmark precisa de um banco em arquivo")
+        operacoes = operacoes_existentes()
+        if args.semear or not operacoes:
+            print(f"Gerando {args.operacoes} lançamentos...")
+            semear(args.operacoes)
+            operacoes = args.operacoes
+        db.session.remove()
+
+    ambiente = dict(os.environ, DB_POOL_SIZE=str(args.pool), PERFIL_SQL="0")
+    meta = {
+        "commit": commit_atual(),
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "banco": url.render_as_string(hide_password=True),
+        "operacoes": operacoes,
+        "requisicoes": args.requisicoes,
+        "pool": args.pool,
+        "concorrencias": concorrencias,
+    }
+
+    modos = {}
+    for modo, (comando, servidor) in (
+        ("wsgi", comando_wsgi(args.porta, args.threads)),
+        ("asgi", comando_asgi(args.porta)),
+    ):
+        print(f"\n{modo.upper()}: {servidor}")
+        processo = subir_servidor(comando, args.porta, ambiente)
+        try:
+            modos[modo] = {
+                "servidor": servidor,
+                "cenarios": medir(
+                    processo,
+                    args.porta,
+                    concorrencias,
+                    args.requisicoes,
+                    args.aquecimento,
+                ),
+            }
+        finally:
+            processo.terminate()
+            processo.wait()
+
+    print(f"\n{'cenário':20s} {'c':>4s} {'req/s WSGI':>11s} {'req/s ASGI':>11s}")
+    for nome, _ in CENARIOS:
+        for concorrencia in map(str, concorrencias):
+            wsgi = modos["wsgi"]["cenarios"][nome][concorrencia]["rps"]
+            asgi = modos["asgi"]["cenarios"][nome][concorrencia]["rps"]
+            print(
+                f"{nome:20s} {concorrencia:>4s} {wsgi:11.1f} {asgi:11.1f}"
+                f"  {asgi / max(wsgi, 1e-9):5.2f}x"
+            )
+
+    resultado = {"meta": meta, "modos": modos}
+    saida = args.saida or os.path.join(RESULTADOS, f"asgi-{meta['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    print(f"\nResultado gravado em {saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# Benchmark da cópia colunar dos lançamentos (colunar.py).
+#
+# Sobre o banco gerado por benchmarks/dados.py, mede o tempo da carga e a
+# memória por lançamento da cópia colunar, comparada à de objetos do ORM
+# (amostra medida com tracemalloc), e o tempo mediano de resumos típicos de
+# painel na cópia e da consulta agrupada equivalente no banco.
+#
+# Uso:
+#   python benchmarks/bench_colunar.py
+#   python benchmarks/bench_colunar.py -n 10000000 --semear -r 20
+#   DATABASE_URI=postgresql://... python benchmarks/bench_colunar.py
+import argparse
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from datetime import date, datetime
+
+from bench_api import RESULTADOS, commit_atual
+from sqlalchemy import func, select
+
+from app import app
+from colunar import operacoes_colunares, resumir
+from dados import operacoes_existentes, semear
+from models import db, Operacoes
+
+# Objetos do ORM carregados para estimar a memória por lançamento
+AMOSTRA_ORM = 20_000
+
+
+def _ano():
+    return func.extract("year", Operacoes.operacoes_data_lancamento)
+
+
+def _mes():
+    return func.extract("month", Operacoes.operacoes_data_lancamento)
+
+
+# Consulta agrupada equivalente a um resumo, no banco
+def _agrupada(colunas, *condicoes):
+    return (
+        select(*colunas, func.sum(Operacoes.operacoes_valor), func.count())
+        .where(*condicoes)
+        .group_by(*colunas)
+    )
+
+
+# (nome, agrupamentos, filtros, consulta equivalente no banco)
+CENARIOS = [
+    (
+        "mes x conta",
+        ["mes", "conta"],
+        {},
+        lambda: _agrupada([_ano(), _mes(), Operacoes.operacoes_conta]),
+    ),
+    (
+        "subcategoria no ano",
+        ["subcategoria"],
+        {"de": date(2024, 1, 1), "ate": date(2024, 12, 31)},
+        lambda: _agrupada(
+            [Operacoes.operacoes_categoria],
+            Operacoes.operacoes_data_lancamento.between(
+                date(2024, 1, 1), date(2024, 12, 31)
+            ),
+        ),
+    ),
+    (
+        "dia da conta",
+        ["dia"],
+        {"contas": [3], "de": date(2025, 1, 1)},
+        lambda: _agrupada(
+            [Operacoes.operacoes_data_lancamento],
+            Operacoes.operacoes_conta == 3,
+            Operacoes.operacoes_data_lancamento >= date(2025, 1, 1),
+        ),
+    ),
+    (
+        "pendentes por mes",
+        ["mes", "tipo"],
+        {"efetivado": False},
+        lambda: _agrupada(
+            [_ano(), _mes(), Operacoes.operacoes_tipo],
+            Operacoes.operacoes_efetivado.is_(False),
+        ),
+    ),
+]
+
+
+def mediana_ms(funcao, repeticoes: int) -> float:
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos) * 1000
+
+
+# Bytes por lançamento de objetos do ORM (instância, estado e dicionário)
+def bytes_por_objeto_orm() -> float:
+    db.session.expunge_all()
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    objetos = db.session.scalars(select(Operacoes).limit(AMOSTRA_ORM)).all()
+    depois = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    quantidade = len(objetos)
+    db.session.expunge_all()
+    return (depois - antes) / max(quantidade, 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark da cópia colunar")
+    parser.add_argument("-n", "--operacoes", type=int, default=1_000_000)
+    parser.add_argument("--semear", action="store_true", help="Gera o banco de novo")
+    parser.add_argument("-r", "--repeticoes", type=int, default=10)
+    parser.add_argument("-o", "--saida", help="Arquivo JSON do resultado")
+    args = parser.parse_args()
+
+    with app.app_context():
+        url = db.engine.url
+        operacoes = operacoes_existentes()
+        if args.semear or not operacoes:
+            print(f"Gerando {args.operacoes} lançamentos...")
+            semear(args.operacoes)
+            operacoes = args.operacoes
+        db.session.remove()
+
+        inicio = time.perf_counter()
+        operacoes_colunares.atualizar()
+        carga = time.perf_counter() - inicio
+        memoria = operacoes_colunares.estatisticas()
+        orm = bytes_por_objeto_orm()
+        print(f"Carga de {memoria['linhas']} lançamentos: {carga:.1f}s")
+        print(
+            f"Memória por lançamento: {memoria['bytes_por_linha']} bytes na cópia "
+            f"colunar, {orm:.0f} bytes em objetos do ORM"
+        )
+
+        cenarios = {}
+        print(f"\n{'cenário':20s} {'grupos':>7s} {'colunar':>10s} {'banco':>10s}")
+        for nome, agrupar, filtros, consulta in CENARIOS:
+            grupos = len(resumir(agrupar, **filtros))
+            colunar_ms = mediana_ms(
+                lambda: resumir(agrupar, **filtros), args.repeticoes
+            )
+            banco_ms = mediana_ms(
+                lambda: db.session.execute(consulta()).all(), args.repeticoes
+            )
+            cenarios[nome] = {
+                "grupos": grupos,
+                "colunar_ms": round(colunar_ms, 2),
+                "banco_ms": round(banco_ms, 2),
+            }
+            print(f"{nome:20s} {grupos:7d} {colunar_ms:8.2f}ms {banco_ms:8.2f}ms")
+
+    resultado = {
+        "meta": {
+            "commit": commit_atual(),
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "banco": url.render_as_string(hide_password=True),
+            "operacoes": operacoes,
+            "repeticoes": args.repeticoes,
+        },
+        "carga_s": round(carga, 2),
+        "bytes_por_linha": memoria["bytes_por_linha"],
+        "bytes_por_objeto_orm": round(orm),
+        "cenarios": cenarios,
+    }
+    saida = args.saida or os.path.join(
+        RESULTADOS, f"colunar-{resultado['meta']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    print(f"\nResultado gravado em {saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# Benchmark dos índices de `operacoes`.
+#
+# Popula o banco com N lançamentos e mede as consultas de cada padrão de
+# acesso sem os índices e depois de criá-los, mostrando o plano (EXPLAIN) e
+# o tempo mediano de cada uma.
+#
+# Uso:
+#   python benchmarks/bench_indices.py                  # SQLite local, 1M linhas
+#   DATABASE_URI=postgresql://... python benchmarks/bench_indices.py -n 200000
+#
+# ATENÇÃO: o script recria todas as tabelas do banco apontado.
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault(
+    "DATABASE_URI", "sqlite:///" + os.path.join(RAIZ, "benchmarks", "bench_indices.db")
+)
+
+from sqlalchemy import insert, select, text  # noqa: E402
+
+from app import app  # noqa: E402
+from models import (  # noqa: E402
+    db,
+    TiposContas,
+    Categorias,
+    Subcategorias,
+    ContasBancarias,
+    Cartoes,
+    FaturasCartoes,
+    TiposOperacoes,
+    Operacoes,
+)
+
+N_CONTAS = 20
+N_SUBCATEGORIAS = 60
+N_CARTOES = 5
+MESES = 60
+INICIO = date(2020, 1, 1)
+LOTE = 50_000
+
+
+def semear(n_operacoes: int, semente: int = 42) -> None:
+    rnd = random.Random(semente)
+    db.session.execute(
+        insert(TiposContas), [{"tipos_contas": "Corrente"}, {"tipos_contas": "Cartão"}]
+    )
+    db.session.execute(
+        insert(TiposOperacoes),
+        [
+            {"tipo_operacao_id": 1, "tipo_operacao_nome": "Receita"},
+            {"tipo_operacao_id": 2, "tipo_operacao_nome": "Despesa"},
+        ],
+    )
+    db.session.execute(
+        insert(ContasBancarias),
+        [
+            {"nome_conta": f"Conta {i}", "tipo_conta": 1, "conta_saldo_inicial": 0}
+            for i in range(1, N_CONTAS + 1)
+        ],
+    )
+    db.session.execute(
+        insert(Categorias),
+        [
+            {"categorias_nome": f"Categoria {i}", "categorias_classe": i % 2 + 1}
+            for i in range(1, 11)
+        ],
+    )
+    db.session.execute(
+        insert(Subcategorias),
+        [
+            {
+                "subcategorias_nome": f"Subcategoria {i}",
+                "subcategorias_classe": i % 2 + 1,
+                "categorias_id": i % 10 + 1,
+            }
+            for i in range(1, N_SUBCATEGORIAS + 1)
+        ],
+    )
+    db.session.execute(
+        insert(Cartoes),
+        [
+            {
+                "cartoes_nome": f"Cartão {i}",
+                "cartoes_final": 1000 + i,
+                "cartoes_tipo": 1,
+            }
+            for i in range(1, N_CARTOES + 1)
+        ],
+    )
+    db.session.execute(
+        insert(FaturasCartoes),
+        [
+            {
+                "faturasCartoesVinculado": cartao,
+                "faturasCartoesDtVencimento": INICIO + timedelta(days=30 * mes + 10),
+                "faturasCartoesFechamento": INICIO + timedelta(days=30 * mes),
+                "faturasCartoesFechado": False,
+                "faturasCartoesValor": 0,
+            }
+            for cartao in range(1, N_CARTOES + 1)
+            for mes in range(MESES)
+        ],
+    )
+
+    dias = MESES * 30
+    lote = []
+    for i in range(n_operacoes):
+        dia = rnd.randrange(dias)
+        no_cartao = rnd.random() < 0.2
+        cartao = rnd.randint(1, N_CARTOES) if no_cartao else None
+        lote.append(
+            {
+                "operacoes_data_lancamento": INICIO + timedelta(days=dia),
+                "operacoes_descricao": f"Lançamento {i}",
+                "operacoes_conta": rnd.randint(1, N_CONTAS),
+                "operacoes_valor": round(rnd.uniform(1, 2000), 2),
+                "operacoes_tipo": 1 if rnd.random() < 0.3 else 2,
+                "operacoes_categoria": rnd.randint(1, N_SUBCATEGORIAS),
+                "operacoes_cartao_atrelado": cartao,
+                "operacoes_fatura": (
+                    (cartao - 1) * MESES + dia // 30 + 1 if no_cartao else None
+                ),
+                "operacoes_efetivado": rnd.random() < 0.95,
+            }
+        )
+        if len(lote) == LOTE:
+            db.session.execute(insert(Operacoes), lote)
+            lote = []
+    if lote:
+        db.session.execute(insert(Operacoes), lote)
+    db.session.commit()
+
+
+# Consultas representativas de cada padrão de acesso indexado
+def consultas():
+    mes_de, mes_ate = date(2023, 3, 1), date(2023, 3, 31)
+    colunas = (
+        Operacoes.operacoes_id,
+        Operacoes.operacoes_data_lancamento,
+        Operacoes.operacoes_valor,
+    )
+    return {
+        "conta + período": select(*colunas).where(
+            Operacoes.operacoes_conta == 7,
+            Operacoes.operacoes_data_lancamento.between(mes_de, mes_ate),
+        ),
+        "fatura": select(*colunas).where(Operacoes.operacoes_fatura == 42),
+        "categoria + período": select(*colunas).where(
+            Operacoes.operacoes_categoria == 13,
+            Operacoes.operacoes_data_lancamento.between(mes_de, mes_ate),
+        ),
+        "cartão": select(*colunas).where(Operacoes.operacoes_cartao_atrelado == 3),
+        "pendentes da conta": select(*colunas).where(
+            Operacoes.operacoes_efetivado == db.false(),
+            Operacoes.operacoes_conta == 7,
+        ),
+    }
+
+
+def explicar(consulta) -> str:
+    sql = str(
+        consulta.compile(db.engine, compile_kwargs={"literal_binds": True})
+    ).replace("\n", " ")
+    if db.engine.dialect.name == "sqlite":
+        linhas = db.session.execute(text("EXPLAIN QUERY PLAN " + sql)).all()
+        return "; ".join(linha[-1] for linha in linhas)
+    linhas = db.session.execute(text("EXPLAIN " + sql)).all()
+    return "\n    ".join(linha[0] for linha in linhas)
+
+
+def medir(repeticoes: int):
+    resultados = {}
+    for nome, consulta in consultas().items():
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            n = len(db.session.execute(consulta).all())
+            tempos.append(time.perf_counter() - inicio)
+        resultados[nome] = (statistics.median(tempos) * 1000, n, explicar(consulta))
+    return resultados
+
+
+def analisar() -> None:
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark dos índices de operacoes")
+    parser.add_argument("-n", "--operacoes", type=int, default=1_000_000)
+    parser.add_argument("-r", "--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Banco: {db.engine.url.render_as_string(hide_password=True)}")
+        db.drop_all()
+        db.create_all()
+        indices = list(Operacoes.__table__.indexes)
+        for indice in indices:
+            indice.drop(db.engine)
+
+        inicio = time.perf_counter()
+        semear(args.operacoes)
+        print(f"{args.operacoes} operações em {time.perf_counter() - inicio:.1f}s")
+
+        analisar()
+        antes = medir(args.repeticoes)
+
+        inicio = time.perf_counter()
+        for indice in indices:
+            indice.create(db.engine)
+        analisar()
+        print(f"Índices criados em {time.perf_counter() - inicio:.1f}s\n")
+        depois = medir(args.repeticoes)
+
+        for nome in antes:
+            ms_antes, linhas, plano_antes = antes[nome]
+            ms_depois, _, plano_depois = depois[nome]
+            print(f"== {nome} ({linhas} linhas)")
+            print(f"  antes:  {ms_antes:9.2f} ms  {plano_antes}")
+            print(f"  depois: {ms_depois:9.2f} ms  {plano_depois}")
+            print(f"  ganho:  {ms_antes / max(ms_depois, 1e-6):.1f}x\n")
+
+
+if __name__ == "__main__":
+    main()
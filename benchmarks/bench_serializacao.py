@@ -0,0 +1,177 @@
+# Benchmark da serialização JSON dos lançamentos.
+#
+# Compara, para N lançamentos já lidos do banco, o caminho antigo (dicionário
+# montado campo a campo com str() e o json da biblioteca padrão do Flask) com
+# o novo (serializador declarativo sobre as tuplas e ProvedorJSON/orjson). Mede
+# também a leitura das mesmas linhas como instâncias ORM e como tuplas.
+#
+# Uso:
+#   python benchmarks/bench_serializacao.py             # SQLite em memória, 100k
+#   python benchmarks/bench_serializacao.py -n 500000 -r 3
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault("DATABASE_URI", "sqlite://")
+
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from app import LANCAMENTO_JSON, _consulta_lancamentos, app  # noqa: E402
+from models import (  # noqa: E402
+    db,
+    Categorias,
+    ContasBancarias,
+    Operacoes,
+    Subcategorias,
+    TiposContas,
+    TiposOperacoes,
+)
+from serializacao import orjson  # noqa: E402
+
+N_CONTAS = 10
+N_SUBCATEGORIAS = 40
+INICIO = date(2020, 1, 1)
+
+
+def semear(n_operacoes: int, semente: int = 42) -> None:
+    rnd = random.Random(semente)
+    db.session.execute(insert(TiposContas), [{"tipos_contas": "Corrente"}])
+    db.session.execute(
+        insert(TiposOperacoes),
+        [
+            {"tipo_operacao_id": 1, "tipo_operacao_nome": "Receita"},
+            {"tipo_operacao_id": 2, "tipo_operacao_nome": "Despesa"},
+        ],
+    )
+    db.session.execute(
+        insert(ContasBancarias),
+        [{"nome_conta": f"Conta {i}", "tipo_conta": 1} for i in range(N_CONTAS)],
+    )
+    db.session.execute(
+        insert(Categorias),
+        [
+            {"categorias_nome": f"Categoria {i}", "categorias_classe": i % 3}
+            for i in range(8)
+        ],
+    )
+    db.session.execute(
+        insert(Subcategorias),
+        [
+            {
+                "subcategorias_nome": f"Subcategoria {i}",
+                "subcategorias_classe": 1,
+                "categorias_id": i % 8 + 1,
+            }
+            for i in range(N_SUBCATEGORIAS)
+        ],
+    )
+    db.session.execute(
+        insert(Operacoes),
+        [
+            {
+                "operacoes_data_lancamento": INICIO
+                + timedelta(days=rnd.randrange(1800)),
+                "operacoes_descricao": f"Lançamento {i}",
+                "operacoes_conta": rnd.randrange(N_CONTAS) + 1,
+                "operacoes_valor": rnd.randrange(100, 500_000) / 100,
+                "operacoes_tipo": rnd.choice((1, 2)),
+                # Um em cada dez sem subcategoria
+                "operacoes_categoria": (
+                    rnd.randrange(N_SUBCATEGORIAS) + 1 if i % 10 else None
+                ),
+            }
+            for i in range(n_operacoes)
+        ],
+    )
+    db.session.commit()
+
+
+# Caminho anterior: dicionário montado à mão, com str() em Numeric e Date
+def lancamento_para_dict(linha):
+    return {
+        "id": linha.operacoes_id,
+        "tipo": linha.operacoes_tipo,
+        "descricao": linha.operacoes_descricao,
+        "data": str(linha.operacoes_data_lancamento),
+        "valor": str(linha.operacoes_valor),
+        "conta": (
+            {"id": linha.idcontas_bancarias, "nome": linha.nome_conta}
+            if linha.idcontas_bancarias is not None
+            else None
+        ),
+        "subcategoria": (
+            {
+                "id": linha.subcategorias_id,
+                "nome": linha.subcategorias_nome,
+                "categoria": linha.categorias_nome,
+            }
+            if linha.subcategorias_id is not None
+            else None
+        ),
+    }
+
+
+def mediana_ms(funcao, repeticoes: int):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return statistics.median(tempos) * 1000, resultado
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark da serialização JSON")
+    parser.add_argument("-n", "--operacoes", type=int, default=100_000)
+    parser.add_argument("-r", "--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        semear(args.operacoes)
+        print(f"{args.operacoes} lançamentos; orjson: {orjson is not None}\n")
+
+        padrao = DefaultJSONProvider(app)
+        linhas = _consulta_lancamentos().order_by(Operacoes.operacoes_id).all()
+
+        medicoes = {
+            "leitura ORM (instâncias)": lambda: (
+                db.session.expunge_all(),
+                Operacoes.query.order_by(Operacoes.operacoes_id).all(),
+            ),
+            "leitura de colunas (tuplas)": lambda: _consulta_lancamentos()
+            .order_by(Operacoes.operacoes_id)
+            .all(),
+            "antes: dict à mão + json": lambda: padrao.dumps(
+                [lancamento_para_dict(linha) for linha in linhas]
+            ),
+            "depois: serializador + ProvedorJSON": lambda: app.json.dumps(
+                LANCAMENTO_JSON.lista(linhas)
+            ),
+            "só montar: dict à mão": lambda: [
+                lancamento_para_dict(linha) for linha in linhas
+            ],
+            "só montar: serializador": lambda: LANCAMENTO_JSON.lista(linhas),
+        }
+        resultados = {}
+        for nome, funcao in medicoes.items():
+            ms, resultados[nome] = mediana_ms(funcao, args.repeticoes)
+            print(f"{nome:40s} {ms:9.1f} ms")
+
+        antes = resultados["antes: dict à mão + json"]
+        depois = resultados["depois: serializador + ProvedorJSON"]
+        iguais = json.loads(antes) == json.loads(depois)
+        print(f"\nMesmo JSON nos dois caminhos: {iguais}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+# Gerador de dados para os benchmarks: preenche todos os modelos de models.py
+# com volumes realistas (contas, cartões e faturas, 1M de lançamentos,
+# recorrências, saldos diários e registro de alterações). Com a mesma semente
+# e o mesmo volume gera sempre o mesmo banco, e os ids saem em ordem (a conta
+# 1, o cartão 1...), para que os cenários possam apontar para eles.
+#
+# Uso:
+#   python benchmarks/dados.py                          # SQLite local, 1M
+#   DATABASE_URI=mysql+pymysql://... python benchmarks/dados.py -n 200000
+#
+# ATENÇÃO: o script recria todas as tabelas do banco apontado.
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault(
+    "DATABASE_URI", "sqlite:///" + os.path.join(RAIZ, "benchmarks", "bench_api.db")
+)
+
+from sqlalchemy import bindparam, func, insert, inspect, select, update  # noqa: E402
+
+from app import app  # noqa: E402
+from duplicados import calcular_fingerprint  # noqa: E402
+from faturas import periodo_da_compra, valor_na_fatura  # noqa: E402
+from models import (  # noqa: E402
+    db,
+    Cartoes,
+    Categorias,
+    ContasBancarias,
+    ContasMoedas,
+    FaturasCartoes,
+    Login,
+    Operacoes,
+    OperacoesRecorrente,
+    Projetos,
+    Recorrencias,
+    Subcategorias,
+    TiposContas,
+    TiposOperacoes,
+)
+from saldos import reconstruir_saldos_diarios  # noqa: E402
+from sincronizacao import iniciar_sincronizacao  # noqa: E402
+
+# Período dos lançamentos; os posteriores a DATA_BASE ficam pendentes
+INICIO = date(2020, 1, 1)
+FIM = date(2025, 12, 31)
+DATA_BASE = date(2025, 6, 30)
+
+N_CONTAS = 20
+# As últimas contas são as dos cartões (com dia de fechamento e de débito)
+N_CARTOES = 6
+N_CATEGORIAS = 12
+N_SUBCATEGORIAS = 80
+N_PROJETOS = 10
+N_RECORRENCIAS = 200
+N_TEMPLATES = 200
+
+# Fração dos lançamentos feitos no cartão e fração de receitas
+FRACAO_CARTAO = 0.25
+FRACAO_RECEITAS = 0.2
+
+LOTE = 50_000
+
+DESCRICOES = (
+    "Supermercado",
+    "Padaria",
+    "Posto de combustível",
+    "Farmácia",
+    "Restaurante",
+    "Aluguel",
+    "Conta de luz",
+    "Conta de água",
+    "Internet",
+    "Streaming",
+    "Transporte por aplicativo",
+    "Academia",
+    "Salário",
+    "Rendimento",
+    "PIX recebido",
+    "Transferência",
+)
+FREQUENCIAS = ("mensal", "semanal", "quinzenal", "bimestral", "anual")
+
+
+def _conta_do_cartao(cartao: int) -> int:
+    return N_CONTAS - N_CARTOES + cartao
+
+
+def semear_referencias() -> None:
+    db.session.execute(
+        insert(TiposContas),
+        [
+            {"tipos_contas": nome}
+            for nome in ("Corrente", "Poupança", "Investimento", "Cartão")
+        ],
+    )
+    db.session.execute(
+        insert(ContasMoedas),
+        [
+            {
+                "contas_moedas_nome": nome,
+                "contas_moedas_simbolo": simbolo,
+                "contas_moedas_cotacao": cotacao,
+            }
+            for nome, simbolo, cotacao in (
+                ("Real", "R$", 1),
+                ("Dólar", "US$", 5.2),
+                ("Euro", "€", 5.6),
+            )
+        ],
+    )
+    db.session.execute(
+        insert(TiposOperacoes),
+        [
+            {"tipo_operacao_id": 1, "tipo_operacao_nome": "Receita"},
+            {"tipo_operacao_id": 2, "tipo_operacao_nome": "Despesa"},
+        ],
+    )
+    contas = []
+    for i in range(1, N_CONTAS + 1):
+        cartao = i > N_CONTAS - N_CARTOES
+        contas.append(
+            {
+                "nome_conta": f"{'Cartão' if cartao else 'Conta'} {i}",
+                "tipo_conta": 4 if cartao else i % 3 + 1,
+                "conta_saldo_inicial": 0 if cartao else 1000 * i,
+                "data_conta_saldo_incial": INICIO,
+                "conta_moeda": 1,
+                "contas_limite": 10_000 if cartao else 0,
+                "contas_liquidez": 1,
+                "contas_cartao_fechamento": 3 + i % 25 if cartao else None,
+                "contas_prev_debito": 10 + i % 18 if cartao else None,
+                "contas_desconsiderar_saldo": 0,
+            }
+        )
+    db.session.execute(insert(ContasBancarias), contas)
+    db.session.execute(
+        insert(Cartoes),
+        [
+            {
+                "cartoes_nome": f"Cartão {i}",
+                "cartoes_final": 1000 + i,
+                "cartoes_atrelado": _conta_do_cartao(i),
+                "cartoes_tipo": 1,
+            }
+            for i in range(1, N_CARTOES + 1)
+        ],
+    )
+    db.session.execute(
+        insert(Categorias),
+        [
+            {"categorias_nome": f"Categoria {i}", "categorias_classe": i % 2 + 1}
+            for i in range(1, N_CATEGORIAS + 1)
+        ],
+    )
+    db.session.execute(
+        insert(Subcategorias),
+        [
+            {
+                "subcategorias_nome": f"Subcategoria {i}",
+                "subcategorias_classe": i % 2 + 1,
+                "categorias_id": i % N_CATEGORIAS + 1,
+            }
+            for i in range(1, N_SUBCATEGORIAS + 1)
+        ],
+    )
+    db.session.execute(
+        insert(Projetos),
+        [
+            {
+                "projetos_nome": f"Projeto {i}",
+                "projetos_inicio": INICIO + timedelta(days=120 * i),
+                "projetos_fim": INICIO + timedelta(days=120 * i + 90),
+                "projetos_cor": f"{i * 20:02x}80c0",
+            }
+            for i in range(1, N_PROJETOS + 1)
+        ],
+    )
+    db.session.execute(
+        insert(Login),
+        [
+            {
+                "UsuarioNome": f"Usuário {i}",
+                "UsuarioEmail": f"usuario{i}@exemplo.com",
+                "UsuarioNivel": i,
+                "UsuarioAcesso": "total" if i == 1 else "leitura",
+                "UsuarioSenha": "x" * 60,
+            }
+            for i in range(1, 4)
+        ],
+    )
+
+
+# Lançamentos; as compras no cartão já saem com a fatura, e as faturas com o
+# total das compras
+def semear_operacoes(n_operacoes: int, rnd: random.Random) -> None:
+    configuracoes = {
+        cartao: (3 + _conta_do_cartao(cartao) % 25, 10 + _conta_do_cartao(cartao) % 18)
+        for cartao in range(1, N_CARTOES + 1)
+    }
+    # (cartão, fechamento) -> [id, vencimento, mês/ano, total]
+    faturas = {}
+    dias = (FIM - INICIO).days + 1
+    lote = []
+    for i in range(n_operacoes):
+        dia = INICIO + timedelta(days=rnd.randrange(dias))
+        receita = rnd.random() < FRACAO_RECEITAS
+        tipo = 1 if receita else 2
+        cartao = (
+            None
+            if receita or rnd.random() >= FRACAO_CARTAO
+            else rnd.randint(1, N_CARTOES)
+        )
+        conta = (
+            _conta_do_cartao(cartao) if cartao else rnd.randint(1, N_CONTAS - N_CARTOES)
+        )
+        valor = round(rnd.lognormvariate(4, 1.2) + 0.01, 2)
+        descricao = f"{rnd.choice(DESCRICOES)} {i % 1000}"
+        fatura = None
+        if cartao:
+            fechamento, vencimento, mes_ano = periodo_da_compra(
+                dia, *configuracoes[cartao]
+            )
+            chave = (cartao, fechamento)
+            if chave not in faturas:
+                faturas[chave] = [len(faturas) + 1, vencimento, mes_ano, 0]
+            faturas[chave][3] += valor_na_fatura(tipo, valor)
+            fatura = faturas[chave][0]
+        efetivado = dia <= DATA_BASE and rnd.random() < 0.97
+        lote.append(
+            {
+                "operacoes_data_lancamento": dia,
+                "operacoes_descricao": descricao,
+                "operacoes_conta": conta,
+                "operacoes_valor": valor,
+                "operacoes_tipo": tipo,
+                "operacoes_categoria": rnd.randint(1, N_SUBCATEGORIAS),
+                "operacoes_fatura": fatura,
+                "operacoes_cartao_atrelado": cartao,
+                "operacoes_projeto": (
+                    rnd.randint(1, N_PROJETOS) if rnd.random() < 0.05 else None
+                ),
+                "operacoes_data_efetivado": dia if efetivado else None,
+                "operacoes_efetivado": efetivado,
+                "operacoes_validacao": True,
+                "operacoes_fingerprint": calcular_fingerprint(
+                    conta, dia, tipo, valor, descricao
+                ),
+            }
+        )
+        if len(lote) == LOTE:
+            db.session.execute(insert(Operacoes), lote)
+            lote = []
+    if lote:
+        db.session.execute(insert(Operacoes), lote)
+
+    linhas = sorted(
+        (
+            fatura_id,
+            cartao,
+            fechamento,
+            vencimento,
+            mes_ano,
+            total,
+        )
+        for (cartao, fechamento), (fatura_id, vencimento, mes_ano, total) in (
+            faturas.items()
+        )
+    )
+    for inicio in range(0, len(linhas), LOTE):
+        db.session.execute(
+            insert(FaturasCartoes),
+            [
+                {
+                    "faturasCartoesId": fatura_id,
+                    "faturasCartoesVinculado": cartao,
+                    "faturasCartoesDtVencimento": vencimento,
+                    "faturasCartoesFechamento": fechamento,
+                    "faturasCartoesFechado": fechamento <= DATA_BASE,
+                    "faturasCartoesValor": total,
+                    "faturasCartoesMesAno": mes_ano,
+                }
+                for fatura_id, cartao, fechamento, vencimento, mes_ano, total in (
+                    linhas[inicio : inicio + LOTE]
+                )
+            ],
+        )
+
+
+# Regras de recorrência (sobre lançamentos existentes) e templates
+def semear_recorrencias(rnd: random.Random) -> None:
+    total = db.session.execute(select(func.count()).select_from(Operacoes)).scalar()
+    modelos = sorted(rnd.sample(range(1, total + 1), min(N_RECORRENCIAS, total)))
+    regras = []
+    for numero, operacao in enumerate(modelos):
+        inicio = INICIO + timedelta(days=rnd.randrange(365 * 5))
+        regras.append(
+            {
+                "operacao_id": operacao,
+                "recorrencia_descricao": f"Recorrência {numero + 1}",
+                "frequencia": FREQUENCIAS[numero % len(FREQUENCIAS)],
+                "data_inicio": inicio,
+                "data_fim": inicio + timedelta(days=730) if numero % 4 == 0 else None,
+                "status": "Ativo" if numero % 10 else "Inativo",
+                "ultimo_lancamento": None,
+                "dias_uteis": numero % 3 == 0,
+            }
+        )
+    db.session.execute(insert(Recorrencias), regras)
+    # As operações modelo passam a apontar para a regra, como na aplicação
+    tabela = Operacoes.__table__
+    db.session.execute(
+        update(tabela)
+        .where(tabela.c.operacoes_id == bindparam("b_id"))
+        .values(operacoes_recorrencia=bindparam("b_regra")),
+        [
+            {"b_id": operacao, "b_regra": regra_id}
+            for regra_id, operacao in enumerate(modelos, start=1)
+        ],
+    )
+    db.session.execute(
+        insert(OperacoesRecorrente),
+        [
+            {
+                "recorrencia_data_lancamento": INICIO + timedelta(days=i * 9),
+                "recorrencia_descricao": f"{rnd.choice(DESCRICOES)} (template)",
+                "recorrencia_conta": rnd.randint(1, N_CONTAS - N_CARTOES),
+                "recorrencia_valor": round(rnd.uniform(20, 3000), 2),
+                "recorrencia_tipo": 1 if i % 5 == 0 else 2,
+                "recorrencia_categoria": rnd.randint(1, N_SUBCATEGORIAS),
+                "recorrencia_fatura": None,
+                "recorrencia_prazo": rnd.choice((None, 6, 12, 24)),
+                "recorrencia_validacao": True,
+            }
+            for i in range(N_TEMPLATES)
+        ],
+    )
+
+
+def semear(n_operacoes: int, semente: int = 42) -> dict:
+    rnd = random.Random(semente)
+    db.drop_all()
+    db.create_all()
+    resumo = {}
+
+    inicio = time.perf_counter()
+    semear_referencias()
+    semear_operacoes(n_operacoes, rnd)
+    semear_recorrencias(rnd)
+    db.session.commit()
+    resumo["operacoes_s"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    resumo["saldos_diarios"] = reconstruir_saldos_diarios()
+    resumo["saldos_diarios_s"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    resumo["alteracoes"] = sum(iniciar_sincronizacao().values())
+    resumo["alteracoes_s"] = time.perf_counter() - inicio
+    return resumo
+
+
+# Volume de lançamentos já gravados (0 se as tabelas não existem)
+def operacoes_existentes() -> int:
+    if not inspect(db.engine).has_table(Operacoes.__tablename__):
+        return 0
+    return db.session.execute(select(func.count()).select_from(Operacoes)).scalar()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Gera os dados dos benchmarks")
+    parser.add_argument("-n", "--operacoes", type=int, default=1_000_000)
+    parser.add_argument("-s", "--semente", type=int, default=42)
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Banco: {db.engine.url.render_as_string(hide_password=True)}")
+        inicio = time.perf_counter()
+        resumo = semear(args.operacoes, args.semente)
+        print(
+            f"{args.operacoes} lançamentos em {resumo['operacoes_s']:.1f}s; "
+            f"{resumo['saldos_diarios']} saldos diários "
+            f"em {resumo['saldos_diarios_s']:.1f}s; "
+            f"{resumo['alteracoes']} alterações em {resumo['alteracoes_s']:.1f}s; "
+            f"total {time.perf_counter() - inicio:.1f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
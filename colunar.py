@@ -0,0 +1,518 @@
+import math
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Sequence, Union
+
+import numpy as np
+from sqlalchemy import Integer, String, case, cast, func, select, type_coerce
+
+import referencias
+from models import db, Alteracoes, Operacoes
+from saldos import TIPO_DESPESA, TIPO_RECEITA
+from sincronizacao import LOTE_SINCRONIZACAO, MARGEM_SINCRONIZACAO
+
+# Cópia colunar de operacoes em memória, para os painéis: um array NumPy por
+# coluna (dia, mês, centavos, conta, subcategoria, tipo e flags), em vez de
+# objetos do ORM, com filtros e agrupamentos feitos em bloco. São uns 33 bytes
+# por lançamento. Cada processo (worker) tem a sua cópia, carregada no primeiro
+# uso e mantida em dia pelo registro de alterações (sincronizacao.py), que os
+# handlers que alteram lançamentos já gravam na mesma transação: a cada
+# consulta, só os lançamentos alterados desde a última são relidos.
+
+# Acima desse número de lançamentos alterados (importações grandes, por
+# exemplo), recarrega tudo em vez de reler um a um
+LIMITE_INCREMENTAL = int(os.getenv("COLUNAR_LIMITE_INCREMENTAL", "100000"))
+
+# Linhas lidas do banco por vez na carga completa
+LOTE_CARGA = 50_000
+
+# Colunas e tipos. Valores nulos: dia SEM_DATA, mes, conta e subcategoria
+# -1, tipo 0. Nas chaves dos agrupamentos, o nulo é sempre NULO.
+COLUNAS = {
+    "id": np.int64,
+    "dia": np.int32,  # dias desde 1970-01-01
+    "centavos": np.int64,
+    "conta": np.int32,
+    "subcategoria": np.int32,
+    "tipo": np.int8,
+    "flags": np.uint8,
+    "mes": np.int16,  # ano * 12 + mês - 1, calculado do dia
+}
+SEM_DATA = np.iinfo(np.int32).min
+FLAG_EFETIVADO = 1
+FLAG_CARTAO = 2
+NULO = -1
+ORDINAL_1970 = date(1970, 1, 1).toordinal()
+
+# Até esse número de combinações de chaves, agrupa contando (bincount)
+LIMITE_CONTAGEM = 1 << 22
+
+# Agrupamentos aceitos por resumir()
+AGRUPAMENTOS_RESUMO = (
+    "dia",
+    "mes",
+    "ano",
+    "conta",
+    "subcategoria",
+    "categoria",
+    "tipo",
+    "efetivado",
+)
+
+
+# As colunas já convertidas no banco: centavos inteiros, nulos trocados pelos
+# marcadores e as flags num só inteiro. A data vem como o driver entrega (texto
+# no SQLite), sem virar date linha a linha.
+def _consulta_colunas():
+    return select(
+        Operacoes.operacoes_id,
+        type_coerce(Operacoes.operacoes_data_lancamento, String),
+        cast(func.round(Operacoes.operacoes_valor * 100), Integer),
+        func.coalesce(Operacoes.operacoes_conta, -1),
+        func.coalesce(Operacoes.operacoes_categoria, -1),
+        func.coalesce(Operacoes.operacoes_tipo, 0),
+        case((Operacoes.operacoes_efetivado.is_(True), FLAG_EFETIVADO), else_=0)
+        + case((Operacoes.operacoes_cartao_atrelado.isnot(None), FLAG_CARTAO), else_=0),
+    )
+
+
+# Dias desde 1970 das datas, em bloco (o NumPy converte texto ISO bem mais
+# rápido que objetos date)
+def _dias(datas) -> np.ndarray:
+    dias = np.array(
+        [d if d is None or isinstance(d, str) else d.isoformat() for d in datas],
+        dtype="datetime64[D]",
+    )
+    resultado = dias.astype(np.int64)
+    resultado[np.isnat(dias)] = SEM_DATA
+    return resultado.astype(np.int32)
+
+
+def _meses(dias: np.ndarray) -> np.ndarray:
+    meses = dias.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return np.where(dias == SEM_DATA, NULO, meses + 1970 * 12)
+
+
+# Linhas de _consulta_colunas em arrays, uma por coluna
+def _em_colunas(linhas) -> Dict[str, np.ndarray]:
+    if not linhas:
+        return {nome: np.empty(0, dtype=tipo) for nome, tipo in COLUNAS.items()}
+    valores = list(zip(*linhas))
+    valores[1] = _dias(valores[1])
+    valores.append(_meses(valores[1]))
+    return {
+        nome: np.asarray(coluna, dtype=tipo)
+        for (nome, tipo), coluna in zip(COLUNAS.items(), valores)
+    }
+
+
+def _dia(valor: Union[date, None]) -> Union[int, None]:
+    return None if valor is None else int(np.datetime64(valor, "D").astype(np.int64))
+
+
+def _de_centavos(centavos: int) -> str:
+    sinal = "-" if centavos < 0 else ""
+    reais, resto = divmod(abs(centavos), 100)
+    return f"{sinal}{reais}.{resto:02d}"
+
+
+class OperacoesColunares:
+    def __init__(self):
+        # Arrays com folga no fim (capacidade); as 'n' primeiras posições
+        # valem, em ordem de id. Lançamentos removidos ficam marcados em
+        # 'vivos' até a próxima compactação.
+        self._colunas = None
+        self._vivos = None
+        self._n = 0
+        self._removidos = 0
+        self._token = 0
+        self._trava = threading.Lock()
+        self._contadores = {"cargas": 0, "atualizacoes": 0, "relidos": 0}
+        self._carregado_em = None
+        self._carga_ms = None
+
+    # --- Sincronização ---
+
+    # Último id do registro de alterações que já pode ser dado como lido: o
+    # anterior à primeira alteração ainda dentro da margem. O registro é
+    # gravado logo antes do commit, e a margem cobre o que falta até ele (ver
+    # sincronizacao.MARGEM_SINCRONIZACAO). Alterações depois dele são relidas
+    # na próxima atualização, o que não muda nada se já estavam aplicadas.
+    @staticmethod
+    def _token_seguro() -> int:
+        corte = datetime.now() - MARGEM_SINCRONIZACAO
+        consulta = select(Alteracoes.alteracoes_id, Alteracoes.alteracoes_momento)
+        anterior = None
+        while True:
+            pagina = consulta.order_by(Alteracoes.alteracoes_id.desc())
+            if anterior is not None:
+                pagina = pagina.where(Alteracoes.alteracoes_id < anterior)
+            linhas = db.session.execute(pagina.limit(LOTE_SINCRONIZACAO)).all()
+            for alteracao_id, momento in linhas:
+                if momento <= corte:
+                    return alteracao_id
+                anterior = alteracao_id
+            if len(linhas) < LOTE_SINCRONIZACAO:
+                return 0
+
+    def _carregar(self) -> None:
+        inicio = time.perf_counter()
+        token = self._token_seguro()
+        # Pela conexão (Core), sem o processamento de linhas do ORM
+        resultado = db.session.connection().execute(
+            _consulta_colunas().order_by(Operacoes.operacoes_id),
+            execution_options={"yield_per": LOTE_CARGA},
+        )
+        partes = [_em_colunas(linhas) for linhas in resultado.partitions()]
+        colunas = _em_colunas([])
+        if partes:
+            colunas = {
+                nome: np.concatenate([parte[nome] for parte in partes])
+                for nome in COLUNAS
+            }
+        self._colunas = colunas
+        self._n = len(colunas["id"])
+        self._vivos = np.ones(self._n, dtype=bool)
+        self._removidos = 0
+        self._token = token
+        self._contadores["cargas"] += 1
+        self._carregado_em = datetime.now()
+        self._carga_ms = round((time.perf_counter() - inicio) * 1000, 1)
+
+    def _garantir_capacidade(self, total: int) -> None:
+        capacidade = len(self._vivos)
+        if total <= capacidade:
+            return
+        capacidade = max(total, capacidade + capacidade // 4, 1024)
+        for nome, coluna in self._colunas.items():
+            nova = np.empty(capacidade, dtype=coluna.dtype)
+            nova[: self._n] = coluna[: self._n]
+            self._colunas[nome] = nova
+        vivos = np.zeros(capacidade, dtype=bool)
+        vivos[: self._n] = self._vivos[: self._n]
+        self._vivos = vivos
+
+    # Posição de cada id nos arrays, ou -1
+    def _posicoes(self, ids: np.ndarray) -> np.ndarray:
+        if not self._n:
+            return np.full(len(ids), -1, dtype=np.int64)
+        existentes = self._colunas["id"][: self._n]
+        posicoes = np.searchsorted(existentes, ids)
+        limitadas = np.minimum(posicoes, self._n - 1)
+        encontradas = (posicoes < self._n) & (existentes[limitadas] == ids)
+        return np.where(encontradas, posicoes, -1)
+
+    # Relê os lançamentos 'ids': atualiza os que existem, acrescenta os novos
+    # e marca os que sumiram do banco
+    def _aplicar(self, ids: Iterable[int]) -> None:
+        ids = np.unique(np.fromiter(ids, dtype=np.int64))
+        linhas = []
+        for inicio in range(0, len(ids), LOTE_SINCRONIZACAO):
+            linhas.extend(
+                db.session.execute(
+                    _consulta_colunas().where(
+                        Operacoes.operacoes_id.in_(
+                            ids[inicio : inicio + LOTE_SINCRONIZACAO].tolist()
+                        )
+                    )
+                ).all()
+            )
+        novas = _em_colunas(sorted(linhas))
+
+        posicoes = self._posicoes(ids)
+        antes = int(self._vivos[posicoes[posicoes >= 0]].sum())
+        self._vivos[posicoes[posicoes >= 0]] = False
+
+        posicoes = self._posicoes(novas["id"])
+        existentes = posicoes >= 0
+        for nome, coluna in self._colunas.items():
+            coluna[posicoes[existentes]] = novas[nome][existentes]
+        self._vivos[posicoes[existentes]] = True
+
+        faltantes = ~existentes
+        if faltantes.any():
+            ultimo = self._colunas["id"][self._n - 1] if self._n else 0
+            total = self._n + int(faltantes.sum())
+            self._garantir_capacidade(total)
+            for nome, coluna in self._colunas.items():
+                coluna[self._n : total] = novas[nome][faltantes]
+            self._vivos[self._n : total] = True
+            self._n = total
+            # Id menor que o último (o banco reaproveitou um id): reordena
+            if novas["id"][faltantes][0] < ultimo:
+                self._compactar()
+        self._removidos += antes - int(existentes.sum())
+        if self._removidos > self._n // 4:
+            self._compactar()
+        self._contadores["relidos"] += len(ids)
+
+    # Tira os removidos e deixa os arrays em ordem de id
+    def _compactar(self) -> None:
+        vivos = self._vivos[: self._n]
+        ordem = np.argsort(self._colunas["id"][: self._n][vivos], kind="stable")
+        self._colunas = {
+            nome: coluna[: self._n][vivos][ordem]
+            for nome, coluna in self._colunas.items()
+        }
+        self._n = len(ordem)
+        self._vivos = np.ones(self._n, dtype=bool)
+        self._removidos = 0
+
+    # Aplica as alterações de lançamentos registradas desde a última vez
+    def atualizar(self) -> None:
+        if self._colunas is None:
+            self._carregar()
+            return
+        corte = datetime.now() - MARGEM_SINCRONIZACAO
+        entradas = db.session.execute(
+            select(
+                Alteracoes.alteracoes_id,
+                Alteracoes.alteracoes_registro,
+                Alteracoes.alteracoes_momento,
+            )
+            .where(
+                Alteracoes.alteracoes_id > self._token,
+                Alteracoes.alteracoes_tabela == Operacoes.__tablename__,
+            )
+            .order_by(Alteracoes.alteracoes_id)
+            .limit(LIMITE_INCREMENTAL + 1)
+        ).all()
+        if not entradas:
+            return
+        if len(entradas) > LIMITE_INCREMENTAL:
+            self._carregar()
+            return
+        token = self._token
+        for alteracao_id, _, momento in entradas:
+            if momento > corte:
+                break
+            token = alteracao_id
+        self._aplicar(registro for _, registro, _ in entradas)
+        self._token = token
+        self._contadores["atualizacoes"] += 1
+
+    # --- Consultas ---
+
+    # Chave de cada linha selecionada para um agrupamento, com NULO nos
+    # lançamentos sem o valor
+    def _chave(self, nome: str, linhas) -> np.ndarray:
+        colunas = self._colunas
+        if nome == "dia":
+            dias = colunas["dia"][linhas].astype(np.int64)
+            return np.where(dias == SEM_DATA, NULO, dias + ORDINAL_1970)
+        if nome == "ano":
+            meses = colunas["mes"][linhas].astype(np.int64)
+            return np.where(meses == NULO, NULO, meses // 12)
+        if nome == "categoria":
+            subcategorias = referencias.subcategorias()
+            tabela = np.full(max(subcategorias, default=0) + 1, NULO, dtype=np.int64)
+            for sub_id, sub in subcategorias.items():
+                if sub["categoria_id"] is not None:
+                    tabela[sub_id] = sub["categoria_id"]
+            sub = colunas["subcategoria"][linhas].astype(np.int64)
+            return np.where(
+                (sub >= 0) & (sub < len(tabela)),
+                tabela[np.clip(sub, 0, len(tabela) - 1)],
+                NULO,
+            )
+        if nome == "efetivado":
+            return (colunas["flags"][linhas] & FLAG_EFETIVADO).astype(np.int64)
+        if nome == "tipo":
+            tipos = colunas["tipo"][linhas].astype(np.int64)
+            return np.where(tipos == 0, NULO, tipos)
+        return colunas[nome][linhas].astype(np.int64)
+
+    # Linhas (posições, ou uma fatia se são todas) que atendem aos filtros
+    def _filtrar(self, de, ate, contas, subcategorias, tipo, efetivado, cartao):
+        colunas = self._colunas
+        n = self._n
+        filtros = (de, ate, contas, subcategorias, tipo, efetivado, cartao)
+        if not self._removidos and all(f is None for f in filtros):
+            return slice(0, n)
+        mascara = self._vivos[:n].copy()
+        dia = colunas["dia"][:n]
+        if de is not None:
+            mascara &= (dia >= _dia(de)) & (dia != SEM_DATA)
+        if ate is not None:
+            mascara &= (dia <= _dia(ate)) & (dia != SEM_DATA)
+        if contas is not None:
+            mascara &= np.isin(colunas["conta"][:n], list(contas))
+        if subcategorias is not None:
+            mascara &= np.isin(colunas["subcategoria"][:n], list(subcategorias))
+        if tipo is not None:
+            mascara &= colunas["tipo"][:n] == tipo
+        if efetivado is not None:
+            mascara &= ((colunas["flags"][:n] & FLAG_EFETIVADO) != 0) == efetivado
+        if cartao is not None:
+            mascara &= ((colunas["flags"][:n] & FLAG_CARTAO) != 0) == cartao
+        return np.flatnonzero(mascara)
+
+    # Receitas, despesas e quantidade de lançamentos por grupo, em ordem de
+    # grupo. 'agrupar' são nomes de AGRUPAMENTOS_RESUMO; 'categorias' filtra
+    # pelas subcategorias delas.
+    def resumir(
+        self,
+        agrupar: Sequence[str],
+        de: Union[date, None] = None,
+        ate: Union[date, None] = None,
+        contas: Union[Iterable[int], None] = None,
+        subcategorias: Union[Iterable[int], None] = None,
+        categorias: Union[Iterable[int], None] = None,
+        tipo: Union[int, None] = None,
+        efetivado: Union[bool, None] = None,
+        cartao: Union[bool, None] = None,
+    ) -> List[dict]:
+        if categorias is not None:
+            categorias = set(categorias)
+            das_categorias = {
+                sub_id
+                for sub_id, sub in referencias.subcategorias().items()
+                if sub["categoria_id"] in categorias
+            }
+            subcategorias = (
+                das_categorias
+                if subcategorias is None
+                else das_categorias & set(subcategorias)
+            )
+        with self._trava:
+            self.atualizar()
+            linhas = self._filtrar(
+                de, ate, contas, subcategorias, tipo, efetivado, cartao
+            )
+            chaves = [self._chave(nome, linhas) for nome in agrupar]
+            centavos = self._colunas["centavos"][linhas]
+            tipos = self._colunas["tipo"][linhas]
+            somar, valores = _combinar_chaves(chaves, len(centavos))
+            receitas = somar(np.where(tipos == TIPO_RECEITA, centavos, 0))
+            despesas = somar(np.where(tipos == TIPO_DESPESA, centavos, 0))
+            quantidades = somar(None)
+
+        # Rótulo de cada valor distinto de cada chave, calculado uma vez
+        rotulos = []
+        for nome, coluna in zip(agrupar, valores):
+            coluna = coluna.tolist()
+            rotulo = {valor: _rotulo(nome, valor) for valor in set(coluna)}
+            rotulos.append([rotulo[valor] for valor in coluna])
+        resultado = []
+        for chaves_grupo, receita, despesa, quantidade in zip(
+            zip(*rotulos) if rotulos else [()] * len(quantidades),
+            receitas.tolist(),
+            despesas.tolist(),
+            quantidades.tolist(),
+        ):
+            grupo = dict(zip(agrupar, chaves_grupo))
+            grupo["receitas"] = _de_centavos(receita)
+            grupo["despesas"] = _de_centavos(despesa)
+            grupo["saldo"] = _de_centavos(receita - despesa)
+            grupo["quantidade"] = quantidade
+            resultado.append(grupo)
+        return resultado
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            if self._colunas is None:
+                return {"carregado": False, **self._contadores}
+            memoria = sum(c.nbytes for c in self._colunas.values()) + self._vivos.nbytes
+            linhas = self._n - self._removidos
+            return {
+                "carregado": True,
+                "carregado_em": self._carregado_em.isoformat(timespec="seconds"),
+                "carga_ms": self._carga_ms,
+                "linhas": linhas,
+                "capacidade": len(self._vivos),
+                "removidos_pendentes": self._removidos,
+                "bytes": memoria,
+                "bytes_por_linha": round(memoria / linhas, 1) if linhas else None,
+                "token": self._token,
+                **self._contadores,
+            }
+
+
+# Troca cada chave por um código de 0 (NULO) a base - 1, no próprio array.
+# Devolve os códigos, a base e a função que volta dos códigos às chaves.
+def _codificar(chave: np.ndarray):
+    nulos = chave == NULO
+    grande = np.iinfo(np.int64).max
+    menor = int(chave.min(where=~nulos, initial=grande))
+    if menor == grande:
+        return np.zeros(len(chave), dtype=np.int64), 1, lambda c: np.full_like(c, NULO)
+    maior = int(chave.max(where=~nulos, initial=menor))
+    chave -= menor - 1
+    chave[nulos] = 0
+    return (
+        chave,
+        maior - menor + 2,
+        lambda c: np.where(c == 0, NULO, c + menor - 1),
+    )
+
+
+# Renumera os códigos de _codificar só com os valores presentes (ordena)
+def _numerar(codigos: np.ndarray, decodificar):
+    presentes, novos = np.unique(codigos, return_inverse=True)
+    return novos, max(len(presentes), 1), lambda c: decodificar(presentes[c])
+
+
+# Combina as chaves dos agrupamentos num só inteiro por linha. Devolve a
+# função que soma um array por grupo (None: conta as linhas), já só com os
+# grupos presentes e em ordem, e as chaves de cada grupo. Com poucas
+# combinações possíveis o próprio inteiro é o grupo, sem ordenar; senão, os
+# grupos saem do np.unique.
+def _combinar_chaves(chaves: List[np.ndarray], linhas: int):
+    codificadas = [_codificar(chave) for chave in chaves]
+    if math.prod(base for _, base, _ in codificadas) >= 2**62:
+        # Combinações demais para um int64
+        codificadas = [_numerar(c, decodificar) for c, _, decodificar in codificadas]
+    combinada = np.zeros(linhas, dtype=np.int64)
+    total = 1
+    for codigos, base, _ in codificadas:
+        combinada = combinada * base + codigos
+        total *= base
+
+    if total <= max(LIMITE_CONTAGEM, 4 * linhas):
+        indices = combinada
+        grupos = np.flatnonzero(np.bincount(combinada, minlength=total))
+        presentes = grupos
+    else:
+        grupos, indices = np.unique(combinada, return_inverse=True)
+        total = len(grupos)
+        presentes = slice(None)
+
+    # As somas passam por float64 no bincount: exatas até 2**53 centavos
+    def somar(pesos):
+        somas = np.bincount(indices, weights=pesos, minlength=total)[presentes]
+        return np.rint(somas).astype(np.int64)
+
+    valores = []
+    resto = grupos
+    for _, base, decodificar in reversed(codificadas):
+        valores.append(decodificar(resto % base))
+        resto = resto // base
+    valores.reverse()
+    return somar, valores
+
+
+def _rotulo(nome: str, valor: int):
+    if valor == NULO:
+        return None
+    if nome == "dia":
+        return date.fromordinal(valor).isoformat()
+    if nome == "mes":
+        return f"{valor // 12:04d}-{valor % 12 + 1:02d}"
+    if nome == "ano":
+        return f"{valor:04d}"
+    if nome == "efetivado":
+        return bool(valor)
+    return valor
+
+
+operacoes_colunares = OperacoesColunares()
+
+
+def resumir(agrupar: Sequence[str], **filtros) -> List[dict]:
+    return operacoes_colunares.resumir(agrupar, **filtros)
+
+
+def estatisticas_colunar() -> dict:
+    return operacoes_colunares.estatisticas()
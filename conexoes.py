@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Union
+
+from sqlalchemy import exc, insert
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# Pool de conexões do SQLAlchemy. Cada processo (worker do gunicorn) tem o
+# seu pool: o total de conexões no banco chega a
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+# Conexões extras abertas além do pool em picos (fechadas ao serem devolvidas)
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Segundos esperando uma conexão livre antes de desistir com erro
+POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Segundos de vida de uma conexão; reabre antes do wait_timeout do servidor
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Testa a conexão ao retirá-la do pool (descarta as derrubadas pelo servidor)
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() not in ("0", "false", "")
+
+# Esperas recentes guardadas para o percentil nas métricas
+AMOSTRAS_ESPERA = 1_000
+
+
+# Tempos de espera por conexão (retirada do pool) deste processo
+class MetricasPool:
+    def __init__(self, amostras: int):
+        self._amostras = deque(maxlen=amostras)
+        self._retiradas = 0
+        self._esgotados = 0
+        self._total = 0.0
+        self._maxima = 0.0
+        self._trava = threading.Lock()
+
+    def registrar(self, espera: float, esgotado: bool = False) -> None:
+        with self._trava:
+            self._amostras.append(espera)
+            self._total += espera
+            self._maxima = max(self._maxima, espera)
+            if esgotado:
+                self._esgotados += 1
+            else:
+                self._retiradas += 1
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            amostras = sorted(self._amostras)
+            medidas = self._retiradas + self._esgotados
+            return {
+                "retiradas": self._retiradas,
+                "esgotados": self._esgotados,
+                "espera_media_ms": (
+                    round(self._total / medidas * 1000, 3) if medidas else None
+                ),
+                "espera_p95_ms": (
+                    round(amostras[int(len(amostras) * 0.95)] * 1000, 3)
+                    if amostras
+                    else None
+                ),
+                "espera_maxima_ms": round(self._maxima * 1000, 3),
+            }
+
+
+metricas_pool = MetricasPool(AMOSTRAS_ESPERA)
+
+
+# QueuePool que mede quanto cada retirada de conexão esperou (pela fila do
+# pool ou pela abertura de uma conexão nova)
+class PoolMedido(QueuePool):
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            conexao = super()._do_get()
+        except exc.TimeoutError:
+            metricas_pool.registrar(time.perf_counter() - inicio, esgotado=True)
+            raise
+        metricas_pool.registrar(time.perf_counter() - inicio)
+        return conexao
+
+
+# SQLALCHEMY_ENGINE_OPTIONS para a URI. O SQLite em memória (testes) fica com
+# o StaticPool que o Flask-SQLAlchemy já usa: uma única conexão compartilhada,
+# sem tamanho de pool nem reciclagem, que apagariam o banco.
+def opcoes_engine(uri: Union[str, None]) -> dict:
+    if not uri:
+        return {}
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": PoolMedido,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+
+
+# Estado atual do pool da engine e tempos de espera acumulados
+def estatisticas_pool(engine) -> dict:
+    pool = engine.pool
+    estado = {"classe": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        estado.update(
+            {
+                "tamanho": pool.size(),
+                "max_overflow": MAX_OVERFLOW,
+                "timeout": pool.timeout(),
+                "em_uso": pool.checkedout(),
+                "livres": pool.checkedin(),
+                # overflow() é negativo enquanto o pool não está cheio
+                "overflow": max(pool.overflow(), 0),
+            }
+        )
+    if isinstance(pool, PoolMedido):
+        estado.update(metricas_pool.estatisticas())
+    return estado
+
+
+# INSERT que não falha quando a chave primária (ou única) já existe: se outra
+# transação gravou a mesma chave, espera por ela e não insere nada, em vez de
+# terminar com IntegrityError
+def insert_ignorando_conflito(tabela, dialeto: str):
+    if dialeto == "sqlite":
+        return sqlite.insert(tabela).on_conflict_do_nothing()
+    if dialeto == "postgresql":
+        return postgresql.insert(tabela).on_conflict_do_nothing()
+    if dialeto in ("mysql", "mariadb"):
+        # Sem DO NOTHING no MySQL: atualiza a chave para ela mesma
+        chave = next(iter(tabela.primary_key.columns))
+        return mysql.insert(tabela).on_duplicate_key_update({chave.name: chave})
+    return insert(tabela)
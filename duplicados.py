@@ -0,0 +1,121 @@
+import hashlib
+import re
+import unicodedata
+from datetime import date
+from decimal import Decimal
+from typing import Iterable, Set, Union
+
+from sqlalchemy import bindparam, select, update
+
+from models import db, Operacoes
+
+# Quantas impressões são conferidas por consulta IN
+LOTE_FINGERPRINT = 5_000
+
+_NAO_ALFANUMERICO = re.compile(r"[^a-z0-9]+")
+
+
+# Descrição sem acentos, caixa, pontuação e espaços repetidos: extratos do
+# mesmo banco trazem "PAG*Padaria  São João" e "pag padaria sao joao"
+def normalizar_descricao(descricao: Union[str, None]) -> str:
+    texto = unicodedata.normalize("NFKD", descricao or "")
+    texto = texto.encode("ascii", "ignore").decode("ascii").lower()
+    return _NAO_ALFANUMERICO.sub(" ", texto).strip()
+
+
+# Parte da chave que não depende da data (tipo, valor e descrição), para
+# quem gera vários lançamentos iguais em datas diferentes calcular uma vez só
+def chave_fixa_fingerprint(tipo: Union[int, None], valor, descricao) -> str:
+    valor = Decimal(str(valor)).quantize(Decimal("0.01"))
+    return f"{tipo}|{valor}|{normalizar_descricao(descricao)}"
+
+
+def fingerprint_da_chave(conta: int, data_lancamento: date, chave_fixa: str) -> str:
+    chave = f"{conta}|{data_lancamento.isoformat()}|{chave_fixa}"
+    return hashlib.blake2b(chave.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Impressão digital de um lançamento: hash de conta, data, tipo, valor e
+# descrição normalizada. Lançamentos iguais reimportados geram o mesmo valor.
+def calcular_fingerprint(
+    conta: Union[int, None],
+    data_lancamento: Union[date, None],
+    tipo: Union[int, None],
+    valor,
+    descricao: Union[str, None],
+) -> Union[str, None]:
+    if conta is None or data_lancamento is None or valor is None:
+        return None
+    return fingerprint_da_chave(
+        conta, data_lancamento, chave_fixa_fingerprint(tipo, valor, descricao)
+    )
+
+
+def fingerprint_operacao(operacao: Operacoes) -> Union[str, None]:
+    return calcular_fingerprint(
+        operacao.operacoes_conta,
+        operacao.operacoes_data_lancamento,
+        operacao.operacoes_tipo,
+        operacao.operacoes_valor,
+        operacao.operacoes_descricao,
+    )
+
+
+# Das impressões recebidas, devolve as que já existem no banco. Uma consulta
+# IN por lote, usando o índice: o custo depende do lote, não da tabela.
+def fingerprints_existentes(fingerprints: Iterable[str]) -> Set[str]:
+    pendentes = list({f for f in fingerprints if f})
+    existentes = set()
+    for inicio in range(0, len(pendentes), LOTE_FINGERPRINT):
+        parte = pendentes[inicio : inicio + LOTE_FINGERPRINT]
+        existentes.update(
+            db.session.execute(
+                select(Operacoes.operacoes_fingerprint)
+                .where(Operacoes.operacoes_fingerprint.in_(parte))
+                .distinct()
+            ).scalars()
+        )
+    return existentes
+
+
+# Calcula a impressão dos lançamentos antigos que ainda não têm, em lotes
+# pela chave primária
+def preencher_fingerprints() -> int:
+    tabela = Operacoes.__table__
+    atualizar = (
+        update(tabela)
+        .where(tabela.c.operacoes_id == bindparam("b_id"))
+        .values(operacoes_fingerprint=bindparam("b_fingerprint"))
+    )
+    total = 0
+    ultimo_id = 0
+    while True:
+        linhas = db.session.execute(
+            select(
+                Operacoes.operacoes_id,
+                Operacoes.operacoes_conta,
+                Operacoes.operacoes_data_lancamento,
+                Operacoes.operacoes_tipo,
+                Operacoes.operacoes_valor,
+                Operacoes.operacoes_descricao,
+            )
+            .where(
+                Operacoes.operacoes_id > ultimo_id,
+                Operacoes.operacoes_fingerprint.is_(None),
+            )
+            .order_by(Operacoes.operacoes_id)
+            .limit(LOTE_FINGERPRINT)
+        ).all()
+        if not linhas:
+            break
+        ultimo_id = linhas[-1].operacoes_id
+        valores = [
+            {"b_id": linha[0], "b_fingerprint": calcular_fingerprint(*linha[1:])}
+            for linha in linhas
+        ]
+        valores = [v for v in valores if v["b_fingerprint"]]
+        if valores:
+            db.session.execute(atualizar, valores)
+        db.session.commit()
+        total += len(valores)
+    return total
@@ -0,0 +1,339 @@
+import calendar
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Set, Tuple, Union
+
+from sqlalchemy import bindparam, func, select, update
+
+from conexoes import insert_ignorando_conflito
+from models import db, FaturasCartoes, Operacoes
+from referencias import configuracao_cartoes, invalidar_referencias
+from saldos import movimento_valores, valor_com_sinal
+from sincronizacao import registrar_alteracoes, registrar_alteracoes_onde
+
+# Período de uma fatura: (data de fechamento, data de vencimento, mês/ano)
+Periodo = Tuple[date, date, date]
+
+
+# Alteração que mudaria o valor de uma fatura já fechada
+class FaturaFechada(ValueError):
+    pass
+
+
+# --- Calendário das faturas ---
+
+
+def _dia_no_mes(ano: int, mes: int, dia: int) -> date:
+    return date(ano, mes, min(dia, calendar.monthrange(ano, mes)[1]))
+
+
+def _somar_meses(ano: int, mes: int, meses: int) -> Tuple[int, int]:
+    total = ano * 12 + mes - 1 + meses
+    return total // 12, total % 12 + 1
+
+
+# Fatura em que cai uma compra feita no dia informado. Compras a partir do
+# dia de fechamento entram na fatura do mês seguinte. O vencimento fica no
+# mesmo mês do fechamento se o dia de débito for depois dele, senão no mês
+# seguinte; mês/ano é o mês do vencimento.
+def periodo_da_compra(dia: date, dia_fechamento: int, dia_vencimento: int) -> Periodo:
+    ano, mes = dia.year, dia.month
+    if dia >= _dia_no_mes(ano, mes, dia_fechamento):
+        ano, mes = _somar_meses(ano, mes, 1)
+    fechamento = _dia_no_mes(ano, mes, dia_fechamento)
+    if dia_vencimento <= dia_fechamento:
+        ano, mes = _somar_meses(ano, mes, 1)
+    vencimento = _dia_no_mes(ano, mes, dia_vencimento)
+    return fechamento, vencimento, date(ano, mes, 1)
+
+
+# --- Faturas ---
+
+
+# Condição das faturas ainda não fechadas
+def fatura_em_aberto():
+    return db.or_(
+        FaturasCartoes.faturasCartoesFechado.is_(None),
+        FaturasCartoes.faturasCartoesFechado.is_(False),
+    )
+
+
+# Carrega as faturas existentes dos cartões: {(cartão, fechamento): (id, fechada)}
+def _faturas_existentes(cartoes) -> Dict[Tuple[int, date], Tuple[int, bool]]:
+    linhas = db.session.execute(
+        select(
+            FaturasCartoes.faturasCartoesVinculado,
+            FaturasCartoes.faturasCartoesFechamento,
+            FaturasCartoes.faturasCartoesId,
+            FaturasCartoes.faturasCartoesFechado,
+        ).where(FaturasCartoes.faturasCartoesVinculado.in_(list(cartoes)))
+    )
+    return {
+        (cartao, fechamento): (fatura_id, bool(fechada))
+        for cartao, fechamento, fatura_id, fechada in linhas
+    }
+
+
+# Cria a fatura do cartão com o fechamento informado, se ela ainda não
+# existir, e devolve (id, fechada). Com outra transação criando a mesma
+# fatura ao mesmo tempo, o índice único faz esta esperar e usar a dela.
+def _criar_fatura(cartao, fechamento, vencimento, mes_ano) -> Tuple[int, bool]:
+    dialeto = db.session.get_bind().dialect.name
+    criada = db.session.execute(
+        insert_ignorando_conflito(FaturasCartoes.__table__, dialeto).values(
+            faturasCartoesVinculado=cartao,
+            faturasCartoesFechamento=fechamento,
+            faturasCartoesDtVencimento=vencimento,
+            faturasCartoesMesAno=mes_ano,
+            faturasCartoesFechado=False,
+            faturasCartoesValor=0,
+        )
+    )
+    # Leitura com trava: no MySQL (REPEATABLE READ) enxerga a fatura que a
+    # outra transação acabou de gravar
+    fatura_id, fechada = db.session.execute(
+        select(FaturasCartoes.faturasCartoesId, FaturasCartoes.faturasCartoesFechado)
+        .where(
+            FaturasCartoes.faturasCartoesVinculado == cartao,
+            FaturasCartoes.faturasCartoesFechamento == fechamento,
+        )
+        .with_for_update()
+    ).one()
+    if criada.rowcount:
+        registrar_alteracoes(FaturasCartoes, [fatura_id])
+    return fatura_id, bool(fechada)
+
+
+# Fatura aberta que recebe uma compra do dia: a do período da compra ou, se
+# ela já estiver fechada, a próxima ainda aberta. Cria a fatura se preciso.
+def _fatura_aberta(cartao, dia, configuracao, existentes) -> int:
+    dia_fechamento, dia_vencimento = configuracao
+    fechamento, vencimento, mes_ano = periodo_da_compra(
+        dia, dia_fechamento, dia_vencimento
+    )
+    while True:
+        if (cartao, fechamento) not in existentes:
+            existentes[(cartao, fechamento)] = _criar_fatura(
+                cartao, fechamento, vencimento, mes_ano
+            )
+        fatura_id, fechada = existentes[(cartao, fechamento)]
+        if not fechada:
+            return fatura_id
+        fechamento, vencimento, mes_ano = periodo_da_compra(
+            fechamento, dia_fechamento, dia_vencimento
+        )
+
+
+# Quanto uma operação soma na fatura: compras (despesas) somam, estornos
+# (receitas) abatem
+def valor_na_fatura(tipo, valor) -> Decimal:
+    return -movimento_valores(None, None, tipo, valor, False)[2]
+
+
+# Fatura aberta de cada compra (cartão, dia), criando as que faltam, com uma
+# única leitura das faturas existentes. Cartões sem dia de fechamento ficam
+# de fora do resultado.
+def faturas_das_compras(compras) -> Dict[Tuple[int, date], int]:
+    compras = set(compras)
+    configuracoes = configuracao_cartoes()
+    existentes = _faturas_existentes({cartao for cartao, _ in compras})
+    return {
+        (cartao, dia): _fatura_aberta(cartao, dia, configuracoes[cartao], existentes)
+        for cartao, dia in sorted(compras)
+        if cartao in configuracoes
+    }
+
+
+# Atribui às faturas certas todas as compras de cartão ainda sem fatura: um
+# UPDATE por fatura, pelos dias de compra que caem nela
+def atribuir_faturas() -> int:
+    pendentes = db.session.execute(
+        select(Operacoes.operacoes_cartao_atrelado, Operacoes.operacoes_data_lancamento)
+        .where(
+            Operacoes.operacoes_cartao_atrelado.isnot(None),
+            Operacoes.operacoes_fatura.is_(None),
+            Operacoes.operacoes_data_lancamento.isnot(None),
+        )
+        .distinct()
+    ).all()
+    if not pendentes:
+        return 0
+
+    dias_por_fatura = defaultdict(list)
+    for (cartao, dia), fatura_id in faturas_das_compras(pendentes).items():
+        dias_por_fatura[(fatura_id, cartao)].append(dia)
+
+    atribuidas = 0
+    for (fatura_id, cartao), dias in dias_por_fatura.items():
+        condicoes = (
+            Operacoes.operacoes_cartao_atrelado == cartao,
+            Operacoes.operacoes_fatura.is_(None),
+            Operacoes.operacoes_data_lancamento.in_(dias),
+        )
+        registrar_alteracoes_onde(Operacoes, *condicoes)
+        atribuidas += db.session.execute(
+            update(Operacoes)
+            .where(*condicoes)
+            .values(operacoes_fatura=fatura_id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    return atribuidas
+
+
+# Recalcula o valor das faturas que atendem às condições com um único
+# GROUP BY e grava só os que mudaram
+def _recalcular_faturas(*condicoes) -> int:
+    totais = db.session.execute(
+        select(
+            FaturasCartoes.faturasCartoesId,
+            FaturasCartoes.faturasCartoesValor,
+            -func.sum(valor_com_sinal()),
+        )
+        .outerjoin(
+            Operacoes, Operacoes.operacoes_fatura == FaturasCartoes.faturasCartoesId
+        )
+        .where(*condicoes)
+        .group_by(FaturasCartoes.faturasCartoesId, FaturasCartoes.faturasCartoesValor)
+    ).all()
+    alteradas = {
+        fatura_id: total or 0
+        for fatura_id, atual, total in totais
+        if atual is None or atual != (total or 0)
+    }
+    if alteradas:
+        tabela = FaturasCartoes.__table__
+        db.session.execute(
+            update(tabela)
+            .where(tabela.c.faturasCartoesId == bindparam("b_id"))
+            .values(faturasCartoesValor=bindparam("b_valor")),
+            [
+                {"b_id": fatura_id, "b_valor": total}
+                for fatura_id, total in alteradas.items()
+            ],
+        )
+        registrar_alteracoes(FaturasCartoes, alteradas)
+    return len(totais)
+
+
+def recalcular_faturas_abertas() -> int:
+    return _recalcular_faturas(fatura_em_aberto())
+
+
+# Recalcula só as faturas informadas, depois de alterações em lote nas
+# compras delas. Faturas fechadas ficam como estão: quem altera as compras
+# confere antes (faturas_fechadas) que o valor delas não muda.
+def recalcular_faturas(faturas) -> int:
+    faturas = [f for f in set(faturas) if f is not None]
+    if not faturas:
+        return 0
+    return _recalcular_faturas(
+        FaturasCartoes.faturasCartoesId.in_(faturas), fatura_em_aberto()
+    )
+
+
+# Das faturas informadas, as já fechadas, travadas até o fim da transação
+# para que não fechem no meio de uma alteração das suas compras
+def faturas_fechadas(faturas) -> Set[int]:
+    faturas = sorted({f for f in faturas if f is not None})
+    if not faturas:
+        return set()
+    return set(
+        db.session.scalars(
+            select(FaturasCartoes.faturasCartoesId)
+            .where(
+                FaturasCartoes.faturasCartoesId.in_(faturas),
+                FaturasCartoes.faturasCartoesFechado.is_(True),
+            )
+            .with_for_update()
+        )
+    )
+
+
+# Motor de fechamento: atribui as compras sem fatura, recalcula os totais das
+# faturas abertas e fecha as que já passaram da data de fechamento
+def fechar_faturas(ate: date) -> dict:
+    atribuidas = atribuir_faturas()
+    recalculadas = recalcular_faturas_abertas()
+    vencidas = (fatura_em_aberto(), FaturasCartoes.faturasCartoesFechamento <= ate)
+    registrar_alteracoes_onde(FaturasCartoes, *vencidas)
+    fechadas = db.session.execute(
+        update(FaturasCartoes)
+        .where(*vencidas)
+        .values(faturasCartoesFechado=True)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    invalidar_referencias(FaturasCartoes)
+    return {
+        "compras_atribuidas": atribuidas,
+        "faturas_recalculadas": recalculadas,
+        "faturas_fechadas": fechadas,
+    }
+
+
+# --- Caminho incremental (uma compra) ---
+
+
+# Soma o valor numa fatura aberta. Fatura fechada não muda: FaturaFechada.
+def _somar_na_fatura(fatura_id: Union[int, None], valor: Decimal) -> None:
+    if fatura_id is None or not valor:
+        return
+    alteradas = db.session.execute(
+        update(FaturasCartoes)
+        .where(FaturasCartoes.faturasCartoesId == fatura_id, fatura_em_aberto())
+        .values(
+            faturasCartoesValor=func.coalesce(FaturasCartoes.faturasCartoesValor, 0)
+            + valor
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if alteradas:
+        registrar_alteracoes(FaturasCartoes, [fatura_id])
+    elif faturas_fechadas([fatura_id]):
+        raise FaturaFechada(
+            f"A fatura {fatura_id} está fechada e o valor dela não pode mudar"
+        )
+
+
+# Contribuição atual de uma operação às faturas: (fatura, valor)
+def lancamento_na_fatura(operacao: Operacoes) -> Tuple[Union[int, None], Decimal]:
+    return operacao.operacoes_fatura, valor_na_fatura(
+        operacao.operacoes_tipo, operacao.operacoes_valor
+    )
+
+
+# Atribui uma compra à sua fatura e soma só nela, sem recalcular as demais.
+# Numa alteração, 'anterior' é a contribuição antes dela; a compra só muda de
+# fatura se 'reatribuir' (data ou cartão alterados). Na mesma fatura, soma só
+# a diferença: uma alteração que não muda o valor passa numa fatura fechada.
+def registrar_compra_cartao(
+    operacao: Operacoes, anterior=None, reatribuir: bool = True
+) -> None:
+    cartao = operacao.operacoes_cartao_atrelado
+    if cartao is None or operacao.operacoes_data_lancamento is None:
+        operacao.operacoes_fatura = None
+    else:
+        configuracao = configuracao_cartoes().get(cartao)
+        # Cartão sem dia de fechamento: mantém a fatura informada
+        if reatribuir and configuracao is not None:
+            operacao.operacoes_fatura = _fatura_aberta(
+                cartao,
+                operacao.operacoes_data_lancamento,
+                configuracao,
+                _faturas_existentes([cartao]),
+            )
+
+    fatura_id, valor = lancamento_na_fatura(operacao)
+    if anterior is not None and anterior[0] == fatura_id:
+        _somar_na_fatura(fatura_id, valor - anterior[1])
+        return
+    if anterior is not None:
+        _somar_na_fatura(anterior[0], -anterior[1])
+    _somar_na_fatura(fatura_id, valor)
+
+
+# Desfaz a contribuição de uma compra excluída
+def remover_compra_cartao(operacao: Operacoes) -> None:
+    fatura_id, valor = lancamento_na_fatura(operacao)
+    _somar_na_fatura(fatura_id, -valor)
@@ -0,0 +1,343 @@
+import csv
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Iterable, Iterator, Tuple, Union
+
+from sqlalchemy import insert
+
+from duplicados import calcular_fingerprint, fingerprints_existentes
+from models import db, Operacoes
+import referencias
+from saldos import (
+    SINAIS_TIPOS_OPERACOES,
+    TIPO_DESPESA,
+    TIPO_RECEITA,
+    acumular_movimento,
+    aplicar_movimentos,
+)
+from sincronizacao import registrar_inseridos, ultimo_id
+
+# Linhas inseridas por executemany
+LOTE_IMPORTACAO = 5_000
+# Quantas linhas com erro são detalhadas na resposta
+MAXIMO_ERROS = 1_000
+
+# Linha lida do arquivo: (número da linha, campos)
+LinhaImportada = Tuple[int, dict]
+
+
+# Erro de validação de uma linha do extrato
+class ErroLinha(ValueError):
+    pass
+
+
+# --- Conversões ---
+
+
+def _texto(valor) -> str:
+    return (valor or "").strip()
+
+
+# Parte inteira com separador de milhar em grupos de 3 dígitos (1.234.567)
+_MILHARES = {
+    separador: re.compile(rf"[+-]?\d{{1,3}}(?:\{separador}\d{{3}})+")
+    for separador in ".,"
+}
+# Parte inteira que também poderia ser o primeiro grupo de um milhar
+_GRUPO = re.compile(r"[+-]?[1-9]\d{0,2}")
+
+
+def _sem_milhar(texto: str, separador: str, valor) -> str:
+    if separador not in texto:
+        return texto
+    if not _MILHARES[separador].fullmatch(texto):
+        raise ErroLinha(f"Valor inválido: {valor!r}")
+    return texto.replace(separador, "")
+
+
+# Aceita 1234.56, 1234,56, 1.234,56 e 1,234.56: com os dois separadores, o
+# último é o decimal; um separador repetido é de milhar. Um separador único
+# com até 3 dígitos antes e 3 depois (1.234 ou 1,234) pode ser os dois e é
+# recusado.
+def _decimal(valor) -> Decimal:
+    texto = _texto(valor).replace(" ", "")
+    separadores = [c for c in texto if c in ".,"]
+    if separadores:
+        decimal = separadores[-1]
+        milhar = "," if decimal == "." else "."
+        if len(separadores) > 1 and milhar not in separadores:
+            texto = _sem_milhar(texto, decimal, valor)
+        else:
+            inteiro, _, fracao = texto.rpartition(decimal)
+            if len(separadores) == 1 and len(fracao) == 3 and _GRUPO.fullmatch(inteiro):
+                raise ErroLinha(
+                    f"Valor ambíguo: {valor!r}. Informe as casas decimais "
+                    "(1.234,00 ou 1,234.00)"
+                )
+            texto = f"{_sem_milhar(inteiro, milhar, valor)}.{fracao}"
+    try:
+        numero = Decimal(texto)
+    except InvalidOperation:
+        raise ErroLinha(f"Valor inválido: {valor!r}")
+    if not numero.is_finite():
+        raise ErroLinha(f"Valor inválido: {valor!r}")
+    return numero
+
+
+def _data(valor) -> date:
+    if isinstance(valor, date):
+        return valor
+    texto = _texto(valor)
+    try:
+        return date.fromisoformat(texto)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(texto, "%d/%m/%Y").date()
+    except ValueError:
+        raise ErroLinha(f"Data inválida: {valor!r}. Use AAAA-MM-DD ou DD/MM/AAAA")
+
+
+def _inteiro(valor, campo: str) -> Union[int, None]:
+    if valor is None or valor == "":
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        raise ErroLinha(f"Campo '{campo}' deve ser inteiro: {valor!r}")
+
+
+def _booleano(valor, padrao: bool) -> bool:
+    texto = _texto(valor).lower()
+    if not texto:
+        return padrao
+    return texto in ("1", "true", "sim", "s")
+
+
+# --- Leitores ---
+
+
+# Lê um CSV com cabeçalho. Colunas: data, descricao, valor e, opcionalmente,
+# conta, subcategoria, tipo e efetivado. O separador (',' ou ';') é detectado
+# pela primeira linha. O BOM do UTF-8, que o Excel grava no início do
+# arquivo, é descartado.
+def ler_csv(arquivo: Iterable[str]) -> Iterator[LinhaImportada]:
+    linhas = iter(arquivo)
+    cabecalho = next(linhas, "").lstrip("\ufeff")
+    separador = ";" if cabecalho.count(";") > cabecalho.count(",") else ","
+    colunas = [
+        c.strip().lower() for c in next(csv.reader([cabecalho], delimiter=separador))
+    ]
+    for numero, valores in enumerate(csv.reader(linhas, delimiter=separador), start=2):
+        if not valores:
+            continue
+        yield numero, dict(zip(colunas, valores))
+
+
+_TAG_OFX = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)")
+
+
+# Lê as transações (<STMTTRN>) de um OFX, em SGML (1.x) ou XML (2.x),
+# linha a linha, sem carregar o arquivo inteiro
+def ler_ofx(arquivo: Iterable[str]) -> Iterator[LinhaImportada]:
+    transacao = None
+    numero = 0
+    for linha in arquivo:
+        for fechamento, tag, valor in _TAG_OFX.findall(linha):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if fechamento and transacao is not None:
+                    numero += 1
+                    yield numero, transacao
+                    transacao = None
+                elif not fechamento:
+                    transacao = {}
+            elif transacao is not None and not fechamento:
+                transacao[tag] = valor.strip()
+
+
+# Converte uma transação OFX para os campos usados no CSV
+def _campos_ofx(transacao: dict) -> dict:
+    data_ofx = transacao.get("DTPOSTED", "")[:8]
+    try:
+        data_lancamento = datetime.strptime(data_ofx, "%Y%m%d").date()
+    except ValueError:
+        raise ErroLinha(f"DTPOSTED inválido: {transacao.get('DTPOSTED')!r}")
+    return {
+        "data": data_lancamento,
+        "descricao": transacao.get("MEMO") or transacao.get("NAME"),
+        "valor": transacao.get("TRNAMT"),
+    }
+
+
+# --- Importação ---
+
+
+# Valida os campos de uma linha contra os conjuntos de contas e subcategorias
+# carregados uma única vez, e devolve a linha pronta para o INSERT
+def _converter_linha(campos, conta_padrao, subcategoria_padrao, contas, subcategorias):
+    data_lancamento = _data(campos.get("data"))
+    descricao = _texto(campos.get("descricao"))
+    if not descricao:
+        raise ErroLinha("Descrição obrigatória")
+    valor = _decimal(campos.get("valor"))
+
+    conta = _inteiro(campos.get("conta"), "conta") or conta_padrao
+    if conta is None:
+        raise ErroLinha("Conta não informada")
+    if conta not in contas:
+        raise ErroLinha(f"Conta {conta} não encontrada")
+
+    subcategoria = (
+        _inteiro(campos.get("subcategoria"), "subcategoria") or subcategoria_padrao
+    )
+    if subcategoria is not None and subcategoria not in subcategorias:
+        raise ErroLinha(f"Subcategoria {subcategoria} não encontrada")
+
+    # Sem a coluna tipo, o sinal do valor define receita ou despesa
+    tipo = _inteiro(campos.get("tipo"), "tipo")
+    if tipo is None:
+        tipo = TIPO_DESPESA if valor < 0 else TIPO_RECEITA
+        valor = abs(valor)
+    elif tipo not in SINAIS_TIPOS_OPERACOES:
+        raise ErroLinha(f"Tipo de operação {tipo} inválido")
+
+    # Linhas de extrato já aconteceram: entram como efetivadas
+    efetivado = _booleano(campos.get("efetivado"), True)
+    return {
+        "operacoes_data_lancamento": data_lancamento,
+        "operacoes_descricao": descricao[:255],
+        "operacoes_conta": conta,
+        "operacoes_valor": valor,
+        "operacoes_tipo": tipo,
+        "operacoes_categoria": subcategoria,
+        "operacoes_efetivado": efetivado,
+        "operacoes_data_efetivado": data_lancamento if efetivado else None,
+        "operacoes_fingerprint": calcular_fingerprint(
+            conta, data_lancamento, tipo, valor, descricao
+        ),
+    }
+
+
+# Modos de tratar lançamentos que já existem no banco (mesmo fingerprint)
+DUPLICADOS_PULAR = "pular"
+DUPLICADOS_IMPORTAR = "importar"
+
+
+# Resultado de uma importação, devolvido na resposta da rota
+def _novo_resultado() -> dict:
+    return {
+        "importados": 0,
+        "total_erros": 0,
+        "erros": [],
+        "total_duplicados": 0,
+        "duplicados": [],
+    }
+
+
+# Grava um lote já validado: confere os duplicados com uma única consulta IN,
+# insere com executemany e acumula o movimento para os saldos diários
+def _gravar_lote(lote, resultado, movimentos, modo_duplicados):
+    existentes = fingerprints_existentes(
+        operacao["operacoes_fingerprint"] for _, operacao in lote
+    )
+    gravar = []
+    for numero, operacao in lote:
+        if operacao["operacoes_fingerprint"] in existentes:
+            resultado["total_duplicados"] += 1
+            if len(resultado["duplicados"]) < MAXIMO_ERROS:
+                resultado["duplicados"].append(numero)
+            if modo_duplicados == DUPLICADOS_PULAR:
+                continue
+        gravar.append(operacao)
+        # O tipo já foi validado: o sinal sai direto do mapa
+        valor = SINAIS_TIPOS_OPERACOES[operacao["operacoes_tipo"]] * (
+            operacao["operacoes_valor"]
+        )
+        acumular_movimento(
+            movimentos,
+            (
+                operacao["operacoes_conta"],
+                operacao["operacoes_data_lancamento"],
+                valor,
+                valor if operacao["operacoes_efetivado"] else Decimal(0),
+            ),
+        )
+    if gravar:
+        db.session.execute(insert(Operacoes.__table__), gravar)
+        resultado["importados"] += len(gravar)
+
+
+# Aplica nos saldos diários e no log de alterações o que foi gravado desde o
+# lançamento de id 'anterior'
+def _registrar_gravados(movimentos, anterior) -> None:
+    # Saldos diários: uma atualização por conta e dia do extrato
+    aplicar_movimentos(movimentos)
+    if movimentos:
+        registrar_inseridos(Operacoes, anterior)
+
+
+# Importa as linhas lidas de um extrato numa única transação, com INSERTs em
+# lotes (executemany). Linhas inválidas são puladas e relatadas; lançamentos
+# que já existem são pulados (ou só relatados, com modo_duplicados="importar").
+#
+# Com 'confirmar' (tarefas em segundo plano), cada lote vai num commit próprio:
+# antes de cada commit, confirmar(número da última linha lida, resultado)
+# grava o ponto de retomada na mesma transação. Para retomar, passe as linhas
+# depois desse número e o 'resultado' guardado.
+def importar_lancamentos(
+    linhas: Iterable[LinhaImportada],
+    formato: str,
+    conta_padrao: Union[int, None] = None,
+    subcategoria_padrao: Union[int, None] = None,
+    modo_duplicados: str = DUPLICADOS_PULAR,
+    resultado: Union[dict, None] = None,
+    confirmar: Union[Callable[[Union[int, None], dict], None], None] = None,
+) -> dict:
+    # Contas e subcategorias válidas, do cache de referências (as que faltam
+    # nele são conferidas no banco uma vez)
+    contas = referencias.ConjuntoReferencias("contas_bancarias")
+    subcategorias = referencias.ConjuntoReferencias("subcategorias")
+    resultado = resultado or _novo_resultado()
+    lote = []
+    movimentos = {}
+    numero = None
+
+    try:
+        # Os lançamentos inseridos são os de id acima deste
+        anterior = ultimo_id(Operacoes)
+        for numero, campos in linhas:
+            try:
+                if formato == "ofx":
+                    campos = _campos_ofx(campos)
+                operacao = _converter_linha(
+                    campos, conta_padrao, subcategoria_padrao, contas, subcategorias
+                )
+            except ErroLinha as e:
+                resultado["total_erros"] += 1
+                if len(resultado["erros"]) < MAXIMO_ERROS:
+                    resultado["erros"].append({"linha": numero, "erro": str(e)})
+                continue
+
+            lote.append((numero, operacao))
+            if len(lote) == LOTE_IMPORTACAO:
+                _gravar_lote(lote, resultado, movimentos, modo_duplicados)
+                lote = []
+                if confirmar is not None:
+                    _registrar_gravados(movimentos, anterior)
+                    confirmar(numero, resultado)
+                    db.session.commit()
+                    movimentos = {}
+                    anterior = ultimo_id(Operacoes)
+
+        if lote:
+            _gravar_lote(lote, resultado, movimentos, modo_duplicados)
+        _registrar_gravados(movimentos, anterior)
+        if confirmar is not None:
+            confirmar(numero, resultado)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return resultado
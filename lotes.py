@@ -0,0 +1,400 @@
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Tuple, Union
+
+from sqlalchemy import bindparam, delete, select, update
+
+from duplicados import calcular_fingerprint
+from faturas import (
+    faturas_das_compras,
+    faturas_fechadas,
+    recalcular_faturas,
+    valor_na_fatura,
+)
+from models import db, FaturasCartoes, Operacoes
+import referencias
+from referencias import invalidar_referencias
+from saldos import (
+    SINAIS_TIPOS_OPERACOES,
+    acumular_movimento,
+    aplicar_movimentos,
+    movimento_valores,
+)
+from sincronizacao import registrar_alteracoes
+
+ACAO_CRIAR = "criar"
+ACAO_ATUALIZAR = "atualizar"
+ACAO_EXCLUIR = "excluir"
+ACOES = (ACAO_CRIAR, ACAO_ATUALIZAR, ACAO_EXCLUIR)
+
+# Itens aceitos por lote
+MAXIMO_ITENS_LOTE = 5_000
+# Ids por UPDATE/DELETE ... WHERE id IN (...)
+LOTE_IDS = 1_000
+
+# Campos do item (os mesmos de POST/PUT /lancamentos) -> coluna
+CAMPOS_LOTE = {
+    "operacoes_tipo": "operacoes_tipo",
+    "operacoes_descricao": "operacoes_descricao",
+    "operacoes_data": "operacoes_data_lancamento",
+    "operacoes_valor": "operacoes_valor",
+    "contas_bancarias_id": "operacoes_conta",
+    "subcategorias_id": "operacoes_categoria",
+    "operacoes_efetivado": "operacoes_efetivado",
+    "operacoes_cartao_atrelado": "operacoes_cartao_atrelado",
+}
+# Obrigatórios na criação, como em POST /lancamentos
+OBRIGATORIOS_CRIAR = (
+    "operacoes_tipo",
+    "operacoes_descricao",
+    "operacoes_data",
+    "operacoes_valor",
+    "contas_bancarias_id",
+    "subcategorias_id",
+)
+
+# Colunas lidas dos lançamentos alterados ou excluídos
+COLUNAS_LOTE = (
+    Operacoes.operacoes_id,
+    Operacoes.operacoes_conta,
+    Operacoes.operacoes_data_lancamento,
+    Operacoes.operacoes_tipo,
+    Operacoes.operacoes_valor,
+    Operacoes.operacoes_descricao,
+    Operacoes.operacoes_categoria,
+    Operacoes.operacoes_efetivado,
+    Operacoes.operacoes_cartao_atrelado,
+    Operacoes.operacoes_fatura,
+    Operacoes.operacoes_fingerprint,
+)
+
+# Item validado: (índice, ação, id, {coluna: valor})
+ItemLote = Tuple[int, str, Union[int, None], dict]
+
+
+# Erro de validação de um item do lote
+class ErroItem(ValueError):
+    pass
+
+
+# Lote recusado: nada é gravado. 'erros' traz [{indice, erro}].
+class LoteInvalido(ValueError):
+    def __init__(self, mensagem: str, erros: Union[List[dict], None] = None):
+        super().__init__(mensagem)
+        self.erros = erros or []
+
+
+# --- Validação (contra o cache de referências) ---
+
+
+# Id vindo do JSON: só inteiros (true/false também são int em Python)
+def _inteiro(valor) -> bool:
+    return isinstance(valor, int) and not isinstance(valor, bool)
+
+
+def _converter_campo(campo: str, valor, conjuntos: dict):
+    if campo == "operacoes_data":
+        try:
+            return date.fromisoformat(valor)
+        except (TypeError, ValueError):
+            raise ErroItem("Formato de data inválido. Use AAAA-MM-DD")
+    if campo == "operacoes_valor":
+        try:
+            numero = Decimal(str(valor))
+        except InvalidOperation:
+            raise ErroItem(f"Valor inválido: {valor!r}")
+        if not numero.is_finite():
+            raise ErroItem(f"Valor inválido: {valor!r}")
+        return numero
+    if campo == "operacoes_tipo":
+        if not _inteiro(valor) or valor not in SINAIS_TIPOS_OPERACOES:
+            raise ErroItem(f"Tipo de operação {valor} inválido")
+        return valor
+    if campo == "contas_bancarias_id":
+        if valor not in conjuntos["contas_bancarias"]:
+            raise ErroItem("Conta não encontrada")
+        return valor
+    if campo == "subcategorias_id":
+        if valor is not None and valor not in conjuntos["subcategorias"]:
+            raise ErroItem("Subcategoria não encontrada")
+        return valor
+    if campo == "operacoes_cartao_atrelado":
+        if valor is not None and valor not in conjuntos["cartoes"]:
+            raise ErroItem("Cartão não encontrado")
+        return valor
+    if campo == "operacoes_efetivado":
+        if not isinstance(valor, bool):
+            raise ErroItem("operacoes_efetivado deve ser true ou false")
+        return valor
+    if campo == "operacoes_descricao" and not isinstance(valor, str):
+        raise ErroItem("A descrição deve ser um texto")
+    return valor
+
+
+def _validar_item(
+    item, ids_vistos: set, conjuntos: dict
+) -> Tuple[str, Union[int, None], dict]:
+    if not isinstance(item, dict):
+        raise ErroItem("Item deve ser um objeto")
+    acao = item.get("acao")
+    if acao not in ACOES:
+        raise ErroItem(f"Ação inválida. Use {', '.join(ACOES)}")
+
+    lancamento_id = None
+    if acao != ACAO_CRIAR:
+        lancamento_id = item.get("id")
+        if not _inteiro(lancamento_id):
+            raise ErroItem("O id do lançamento é obrigatório")
+        if lancamento_id in ids_vistos:
+            raise ErroItem(f"Lançamento {lancamento_id} repetido no lote")
+        ids_vistos.add(lancamento_id)
+    elif not all(item.get(campo) for campo in OBRIGATORIOS_CRIAR):
+        raise ErroItem("Dados incompletos")
+
+    valores = {}
+    if acao != ACAO_EXCLUIR:
+        for campo, coluna in CAMPOS_LOTE.items():
+            if campo in item:
+                valores[coluna] = _converter_campo(campo, item[campo], conjuntos)
+        if not valores:
+            raise ErroItem("Nenhum campo para alterar")
+    return acao, lancamento_id, valores
+
+
+def _carregar_atuais(ids: List[int]) -> Dict[int, dict]:
+    atuais = {}
+    for inicio in range(0, len(ids), LOTE_IDS):
+        for linha in db.session.execute(
+            select(*COLUNAS_LOTE).where(
+                Operacoes.operacoes_id.in_(ids[inicio : inicio + LOTE_IDS])
+            )
+        ).mappings():
+            atuais[linha["operacoes_id"]] = dict(linha)
+    return atuais
+
+
+def _validar_lote(itens) -> Tuple[List[ItemLote], Dict[int, dict]]:
+    if not isinstance(itens, list) or not itens:
+        raise LoteInvalido("Informe a lista de operações do lote")
+    if len(itens) > MAXIMO_ITENS_LOTE:
+        raise LoteInvalido(f"O lote aceita no máximo {MAXIMO_ITENS_LOTE} operações")
+
+    erros = []
+    validos = []
+    ids_vistos = set()
+    # Ids válidos de cada referência; os que faltam no cache são conferidos no
+    # banco uma vez por lote
+    conjuntos = {
+        nome: referencias.ConjuntoReferencias(nome)
+        for nome in ("contas_bancarias", "subcategorias", "cartoes")
+    }
+    for indice, item in enumerate(itens):
+        try:
+            validos.append((indice, *_validar_item(item, ids_vistos, conjuntos)))
+        except ErroItem as e:
+            erros.append({"indice": indice, "erro": str(e)})
+
+    # Lançamentos alterados ou excluídos: uma consulta IN para todos
+    atuais = _carregar_atuais(sorted(ids_vistos))
+    # Compras em faturas fechadas: só passam as alterações que não mudam a
+    # fatura nem o valor delas
+    fechadas = faturas_fechadas(a["operacoes_fatura"] for a in atuais.values())
+    for indice, acao, lancamento_id, valores in validos:
+        anterior = atuais.get(lancamento_id)
+        if acao != ACAO_CRIAR and anterior is None:
+            erros.append({"indice": indice, "erro": "Lançamento não encontrado"})
+        elif anterior is not None and anterior["operacoes_fatura"] in fechadas:
+            if _muda_fatura_fechada(acao, anterior, valores):
+                erros.append(
+                    {
+                        "indice": indice,
+                        "erro": f"A fatura {anterior['operacoes_fatura']} está "
+                        "fechada e o valor dela não pode mudar",
+                    }
+                )
+    if erros:
+        erros.sort(key=lambda e: e["indice"])
+        raise LoteInvalido("Lote inválido; nenhuma operação foi gravada", erros)
+    return validos, atuais
+
+
+# --- Execução ---
+
+
+def _movimento(linha: dict, fator: int = 1):
+    conta, dia, valor, efetivado = movimento_valores(
+        linha.get("operacoes_conta"),
+        linha.get("operacoes_data_lancamento"),
+        linha.get("operacoes_tipo"),
+        linha.get("operacoes_valor"),
+        linha.get("operacoes_efetivado"),
+    )
+    return conta, dia, fator * valor, fator * efetivado
+
+
+def _fingerprint(linha: dict) -> Union[str, None]:
+    return calcular_fingerprint(
+        linha.get("operacoes_conta"),
+        linha.get("operacoes_data_lancamento"),
+        linha.get("operacoes_tipo"),
+        linha.get("operacoes_valor"),
+        linha.get("operacoes_descricao"),
+    )
+
+
+# Compras de cartão que precisam de (nova) fatura: criação, ou cartão ou data
+# alterados
+def _muda_de_fatura(acao: str, anterior: dict, novo: dict) -> bool:
+    if acao == ACAO_CRIAR:
+        return novo.get("operacoes_cartao_atrelado") is not None
+    return (
+        novo["operacoes_cartao_atrelado"],
+        novo["operacoes_data_lancamento"],
+    ) != (
+        anterior["operacoes_cartao_atrelado"],
+        anterior["operacoes_data_lancamento"],
+    )
+
+
+# Se a alteração ou exclusão de uma compra tira ou muda o valor dela na
+# fatura
+def _muda_fatura_fechada(acao: str, anterior: dict, valores: dict) -> bool:
+    valor_anterior = valor_na_fatura(
+        anterior["operacoes_tipo"], anterior["operacoes_valor"]
+    )
+    if acao == ACAO_EXCLUIR:
+        return bool(valor_anterior)
+    novo = {**anterior, **valores}
+    return _muda_de_fatura(acao, anterior, novo) or valor_anterior != (
+        valor_na_fatura(novo["operacoes_tipo"], novo["operacoes_valor"])
+    )
+
+
+# Aplica um lote de criações, alterações e exclusões de lançamentos numa
+# única transação, em operações de conjunto: as alterações iguais viram um
+# UPDATE ... WHERE id IN (...), as exclusões um DELETE ... WHERE id IN (...).
+# Saldos diários, faturas e o registro de alterações são atualizados uma vez
+# para o lote todo. Se algum item for inválido, nada é gravado.
+def executar_lote(itens) -> dict:
+    validos, atuais = _validar_lote(itens)
+
+    # Estado final de cada lançamento criado ou alterado
+    novos = {}
+    for indice, acao, lancamento_id, valores in validos:
+        if acao != ACAO_EXCLUIR:
+            novos[indice] = {**atuais.get(lancamento_id, {}), **valores}
+
+    # Compras que mudaram de cartão ou de data precisam de nova fatura
+    compras = {}
+    for indice, acao, lancamento_id, _ in validos:
+        novo = novos.get(indice)
+        if novo is not None and _muda_de_fatura(acao, atuais.get(lancamento_id), novo):
+            cartao = novo["operacoes_cartao_atrelado"]
+            if cartao is None:
+                novo["operacoes_fatura"] = None
+            else:
+                compras[indice] = (cartao, novo["operacoes_data_lancamento"])
+
+    try:
+        # Faturas das compras, lidas e criadas de uma vez
+        faturas = faturas_das_compras(compras.values())
+        for indice, compra in compras.items():
+            # Cartão sem dia de fechamento: mantém a fatura que já tinha
+            novos[indice]["operacoes_fatura"] = faturas.get(
+                compra, novos[indice].get("operacoes_fatura")
+            )
+
+        movimentos = {}
+        faturas_afetadas = set()
+        criados = []
+        alteracoes_comuns = defaultdict(list)
+        alteracoes_individuais = []
+        excluidos = []
+        resultados = []
+        for indice, acao, lancamento_id, valores in validos:
+            anterior = atuais.get(lancamento_id)
+            novo = novos.get(indice)
+            if anterior is not None:
+                acumular_movimento(movimentos, _movimento(anterior, -1))
+                faturas_afetadas.add(anterior["operacoes_fatura"])
+            if novo is not None:
+                acumular_movimento(movimentos, _movimento(novo))
+                faturas_afetadas.add(novo.get("operacoes_fatura"))
+                novo["operacoes_fingerprint"] = _fingerprint(novo)
+
+            if acao == ACAO_CRIAR:
+                operacao = Operacoes(**novo)
+                db.session.add(operacao)
+                criados.append((len(resultados), operacao))
+            elif acao == ACAO_ATUALIZAR:
+                # Campos pedidos vão no UPDATE do grupo com as mesmas
+                # alterações; fatura e impressão digital variam por linha
+                alteracoes_comuns[frozenset(valores.items())].append(lancamento_id)
+                individuais = {
+                    coluna: novo[coluna]
+                    for coluna in ("operacoes_fatura", "operacoes_fingerprint")
+                    if novo[coluna] != anterior[coluna]
+                }
+                if individuais:
+                    alteracoes_individuais.append((lancamento_id, individuais))
+            else:
+                excluidos.append(lancamento_id)
+            resultados.append({"indice": indice, "acao": acao, "id": lancamento_id})
+
+        if criados:
+            db.session.flush()
+            for posicao, operacao in criados:
+                resultados[posicao]["id"] = operacao.operacoes_id
+
+        for valores, ids in alteracoes_comuns.items():
+            for inicio in range(0, len(ids), LOTE_IDS):
+                db.session.execute(
+                    update(Operacoes)
+                    .where(Operacoes.operacoes_id.in_(ids[inicio : inicio + LOTE_IDS]))
+                    .values(dict(valores))
+                    .execution_options(synchronize_session=False)
+                )
+        # Fatura e impressão digital: um executemany por conjunto de colunas
+        por_colunas = defaultdict(list)
+        for lancamento_id, individuais in alteracoes_individuais:
+            por_colunas[tuple(sorted(individuais))].append(
+                {
+                    "b_id": lancamento_id,
+                    **{f"b_{coluna}": v for coluna, v in individuais.items()},
+                }
+            )
+        tabela = Operacoes.__table__
+        for colunas, linhas in por_colunas.items():
+            db.session.execute(
+                update(tabela)
+                .where(tabela.c.operacoes_id == bindparam("b_id"))
+                .values({coluna: bindparam(f"b_{coluna}") for coluna in colunas}),
+                linhas,
+            )
+        for inicio in range(0, len(excluidos), LOTE_IDS):
+            db.session.execute(
+                delete(Operacoes)
+                .where(
+                    Operacoes.operacoes_id.in_(excluidos[inicio : inicio + LOTE_IDS])
+                )
+                .execution_options(synchronize_session=False)
+            )
+
+        aplicar_movimentos(movimentos)
+        faturas_afetadas.discard(None)
+        recalcular_faturas(faturas_afetadas)
+        registrar_alteracoes(Operacoes, [r["id"] for r in resultados])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if faturas_afetadas or compras:
+        invalidar_referencias(FaturasCartoes)
+    return {
+        "criados": len(criados),
+        "atualizados": sum(len(ids) for ids in alteracoes_comuns.values()),
+        "excluidos": len(excluidos),
+        "resultados": resultados,
+    }
@@ -27,8 +27,8 @@ class Categorias(db.Model):
     categorias_nome = db.Column(db.String(255), nullable=False)
     categorias_classe = db.Column(db.Integer, nullable=False)
     subcategorias = db.relationship(
-        "Subcategorias", backref="categorias_id", lazy=True
-    )  # Nome alterado para refletir 'categorias_pai'
+        "Subcategorias", backref="categoria", lazy=True
+    )  # 'categorias_id' já é a coluna FK em Subcategorias
 
 
 # 3. Tabela subcategorias
@@ -97,6 +97,19 @@ class FaturasCartoes(db.Model):
     faturasCartoesValor = db.Column(db.Numeric(10, 2))
     faturasCartoesMesAno = db.Column(db.Date)
 
+    # Uma fatura por cartão e data de fechamento: duas compras simultâneas no
+    # mesmo período não criam faturas repetidas (ver faturas._criar_fatura).
+    # Num banco existente, faturas já repetidas precisam ser unidas antes do
+    # `flask --app app migrar-esquema`, senão a criação do índice falha.
+    __table_args__ = (
+        db.Index(
+            "ix_faturas_cartao_fechamento",
+            "faturasCartoesVinculado",
+            "faturasCartoesFechamento",
+            unique=True,
+        ),
+    )
+
 
 # 8. Tabela tipos_operacoes (anteriormente TiposLancamentos)
 class TiposOperacoes(db.Model):
@@ -137,6 +150,35 @@ class Operacoes(db.Model):
     operacoes_data_efetivado = db.Column(db.Date)
     operacoes_efetivado = db.Column(db.Boolean)
     operacoes_validacao = db.Column(db.Boolean)
+    # Hash de conta, data, tipo, valor e descrição normalizada, usado para
+    # detectar lançamentos duplicados na importação (ver duplicados.py)
+    operacoes_fingerprint = db.Column(db.String(32))
+
+    # Índices para os filtros usados nas listagens, relatórios e saldos.
+    # Em bancos existentes são aplicados com `flask --app app migrar-esquema`.
+    __table_args__ = (
+        db.Index(
+            "ix_operacoes_conta_data", "operacoes_conta", "operacoes_data_lancamento"
+        ),
+        db.Index("ix_operacoes_fatura", "operacoes_fatura"),
+        db.Index(
+            "ix_operacoes_categoria_data",
+            "operacoes_categoria",
+            "operacoes_data_lancamento",
+        ),
+        db.Index("ix_operacoes_cartao_atrelado", "operacoes_cartao_atrelado"),
+        db.Index("ix_operacoes_fingerprint", "operacoes_fingerprint"),
+        # Lançamentos não efetivados: índice parcial no PostgreSQL/SQLite. Nos
+        # demais bancos vira um índice composto começando pela flag.
+        db.Index(
+            "ix_operacoes_pendentes",
+            "operacoes_efetivado",
+            "operacoes_conta",
+            "operacoes_data_lancamento",
+            postgresql_where=db.text("operacoes_efetivado = false"),
+            sqlite_where=db.text("operacoes_efetivado = 0"),
+        ),
+    )
 
 
 # 10. Tabela recorrencias
@@ -187,3 +229,76 @@ class Login(db.Model):
     UsuarioNivel = db.Column(db.Integer, nullable=False)
     UsuarioAcesso = db.Column(db.String(255), nullable=False)
     UsuarioSenha = db.Column(db.String(255), nullable=False)
+
+
+# 14. Tabela saldos_diarios
+# Saldo de fechamento de cada conta nos dias em que houve movimento,
+# mantido de forma incremental pelas rotas de lançamentos (ver saldos.py).
+# Guarda só o acumulado das operações; o saldo inicial da conta é somado
+# na leitura, para que editar a conta não invalide os registros.
+class SaldosDiarios(db.Model):
+    __tablename__ = "saldos_diarios"
+    saldos_diarios_conta = db.Column(
+        db.Integer,
+        db.ForeignKey("contas_bancarias.idcontas_bancarias"),
+        primary_key=True,
+    )
+    saldos_diarios_data = db.Column(db.Date, primary_key=True)
+    # Acumulado de todas as operações / só das efetivadas
+    saldos_diarios_saldo = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    saldos_diarios_efetivado = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+
+# 15. Tabela alteracoes
+# Registro de alterações para a sincronização incremental (GET /sync): uma
+# linha por registro criado, alterado ou excluído, gravada na mesma transação
+# da alteração (ver sincronizacao.py). O id é o token de versão do cliente.
+class Alteracoes(db.Model):
+    __tablename__ = "alteracoes"
+    alteracoes_id = db.Column(db.Integer, primary_key=True)
+    alteracoes_tabela = db.Column(db.String(45), nullable=False)
+    alteracoes_registro = db.Column(db.Integer, nullable=False)
+    alteracoes_momento = db.Column(db.DateTime, nullable=False)
+
+
+# 16. Tabela tarefas
+# Fila das tarefas em segundo plano (importações, geração de recorrências,
+# fechamento de faturas). O próprio banco é a fila: threads dos processos da
+# aplicação reservam e executam as tarefas (ver tarefas.py).
+class Tarefas(db.Model):
+    __tablename__ = "tarefas"
+    tarefas_id = db.Column(db.Integer, primary_key=True)
+    tarefas_tipo = db.Column(db.String(45), nullable=False)
+    # Chave de idempotência do envio (cabeçalho Idempotency-Key)
+    tarefas_chave = db.Column(db.String(255), unique=True)
+    # pendente, executando, concluida ou erro
+    tarefas_status = db.Column(db.String(20), nullable=False)
+    tarefas_progresso = db.Column(db.Integer, nullable=False, default=0)
+    tarefas_mensagem = db.Column(db.String(255))
+    # JSON. Text(16777215) vira MEDIUMTEXT no MySQL.
+    tarefas_parametros = db.Column(db.Text, nullable=False)
+    # Ponto de retomada, gravado no mesmo commit do trabalho já feito
+    tarefas_estado = db.Column(db.Text(16_777_215))
+    tarefas_resultado = db.Column(db.Text(16_777_215))
+    tarefas_erro = db.Column(db.Text)
+    tarefas_tentativas = db.Column(db.Integer, nullable=False, default=0)
+    # Worker (máquina:processo:thread) que está executando a tarefa
+    tarefas_dono = db.Column(db.String(100))
+    tarefas_criada = db.Column(db.DateTime, nullable=False)
+    tarefas_iniciada = db.Column(db.DateTime)
+    tarefas_concluida = db.Column(db.DateTime)
+    # Último sinal de vida do worker; parada há muito tempo, a tarefa volta
+    # para a fila
+    tarefas_atualizada = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index("ix_tarefas_status", "tarefas_status", "tarefas_id"),)
+
+
+# 17. Tabela versoes_referencias
+# Versão de cada tabela dos dados de referência, somada a cada alteração. Os
+# processos da aplicação a leem para descartar do seu cache local o que outro
+# processo alterou (ver referencias.py).
+class VersoesReferencias(db.Model):
+    __tablename__ = "versoes_referencias"
+    versoes_referencias_tabela = db.Column(db.String(64), primary_key=True)
+    versoes_referencias_versao = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+
+from models import db
+
+# Perfil das requisições: consultas SQL, tempo no banco e na serialização,
+# por rota, e o cabeçalho Server-Timing. Desligue com PERFIL_SQL=0.
+PERFIL_ATIVO = os.getenv("PERFIL_SQL", "1").lower() not in ("0", "false", "")
+# Consultas mais lentas que isso (ms) vão para o log com o plano (EXPLAIN)
+LIMITE_CONSULTA_LENTA = float(os.getenv("SQL_LENTA_MS", "200")) / 1000
+# Requisições com mais consultas que isso vão para o log (N+1)
+LIMITE_CONSULTAS_REQUISICAO = int(os.getenv("SQL_ALERTA_CONSULTAS", "50"))
+
+# Trecho da consulta mostrado no log
+TAMANHO_SQL_LOG = 2_000
+
+
+# Totais acumulados por rota (endpoint) neste processo
+class MetricasRotas:
+    def __init__(self):
+        self._rotas = defaultdict(lambda: defaultdict(float))
+        self._trava = threading.Lock()
+
+    def registrar(self, rota: str, valores: dict) -> None:
+        with self._trava:
+            totais = self._rotas[rota]
+            totais["requisicoes"] += 1
+            for nome, valor in valores.items():
+                totais[nome] += valor
+            totais["consultas_max"] = max(totais["consultas_max"], valores["consultas"])
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            rotas = {}
+            for rota, totais in sorted(self._rotas.items()):
+                n = totais["requisicoes"]
+                rotas[rota] = {
+                    "requisicoes": int(n),
+                    "consultas": int(totais["consultas"]),
+                    "consultas_media": round(totais["consultas"] / n, 2),
+                    "consultas_max": int(totais["consultas_max"]),
+                    "linhas": int(totais["linhas"]),
+                    "db_ms_medio": round(totais["db"] * 1000 / n, 3),
+                    "serializacao_ms_medio": round(
+                        totais["serializacao"] * 1000 / n, 3
+                    ),
+                    "total_ms_medio": round(totais["total"] * 1000 / n, 3),
+                    "bytes_medio": round(totais["bytes"] / n),
+                    "consultas_lentas": int(totais["lentas"]),
+                }
+            return rotas
+
+
+metricas_rotas = MetricasRotas()
+
+
+def _perfil():
+    if has_app_context():
+        return g.get("perfil")
+    return None
+
+
+# --- Eventos da engine (todas as engines do processo) ---
+
+
+def _antes_execucao(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._perfil_inicio = time.perf_counter()
+
+
+def _depois_execucao(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, "_perfil_inicio", None)
+    perfil = _perfil()
+    if inicio is None or perfil is None:
+        return
+    duracao = time.perf_counter() - inicio
+    perfil["consultas"] += 1
+    perfil["db"] += duracao
+    # rowcount dos SELECT vem do driver (MySQL e PostgreSQL informam as
+    # linhas devolvidas; o SQLite devolve -1 e não entra na conta)
+    if cursor.rowcount > 0:
+        perfil["linhas"] += cursor.rowcount
+    if duracao > LIMITE_CONSULTA_LENTA:
+        perfil["lentas"].append(
+            (duracao, statement, None if executemany else parameters)
+        )
+
+
+# Tempo gasto codificando JSON na requisição (chamado pelo ProvedorJSON)
+def registrar_serializacao(segundos: float) -> None:
+    perfil = _perfil()
+    if perfil is not None:
+        perfil["serializacao"] += segundos
+
+
+# --- Requisição ---
+
+
+def _iniciar_perfil():
+    g.perfil = {
+        "inicio": time.perf_counter(),
+        "consultas": 0,
+        "db": 0.0,
+        "linhas": 0,
+        "serializacao": 0.0,
+        "lentas": [],
+    }
+
+
+# Plano da consulta lenta, na conexão da própria sessão (só SELECT: o EXPLAIN
+# de um comando de escrita não é igual em todos os bancos)
+def _plano(statement: str, parameters):
+    if parameters is None or not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    prefixo = (
+        "EXPLAIN QUERY PLAN " if db.engine.dialect.name == "sqlite" else "EXPLAIN "
+    )
+    try:
+        linhas = db.session.connection().exec_driver_sql(
+            prefixo + statement, parameters
+        )
+        return [tuple(linha) for linha in linhas]
+    except exc.SQLAlchemyError as e:
+        return f"indisponível: {e.__class__.__name__}"
+
+
+# Consultas e streams lidos depois do after_request (exportação) ficam de fora
+def _finalizar_perfil(resposta):
+    perfil = g.pop("perfil", None)
+    if perfil is None:
+        return resposta
+    total = time.perf_counter() - perfil["inicio"]
+    rota = request.endpoint or "<sem rota>"
+
+    metricas_rotas.registrar(
+        rota,
+        {
+            "consultas": perfil["consultas"],
+            "linhas": perfil["linhas"],
+            "db": perfil["db"],
+            "serializacao": perfil["serializacao"],
+            "total": total,
+            "bytes": resposta.content_length or 0,
+            "lentas": len(perfil["lentas"]),
+        },
+    )
+    resposta.headers["Server-Timing"] = ", ".join(
+        [
+            f'db;dur={perfil["db"] * 1000:.2f};desc="{perfil["consultas"]} consultas"',
+            f'json;dur={perfil["serializacao"] * 1000:.2f}',
+            f"total;dur={total * 1000:.2f}",
+        ]
+    )
+
+    for duracao, statement, parameters in perfil["lentas"]:
+        current_app.logger.warning(
+            "Consulta lenta em %s (%.1f ms): %s | parâmetros: %r | plano: %r",
+            rota,
+            duracao * 1000,
+            statement[:TAMANHO_SQL_LOG],
+            parameters,
+            _plano(statement, parameters),
+        )
+    if perfil["consultas"] > LIMITE_CONSULTAS_REQUISICAO:
+        current_app.logger.warning(
+            "%s %s fez %d consultas (limite %d)",
+            request.method,
+            request.path,
+            perfil["consultas"],
+            LIMITE_CONSULTAS_REQUISICAO,
+        )
+    return resposta
+
+
+def iniciar_perfil(app) -> None:
+    if not PERFIL_ATIVO:
+        return
+    event.listen(Engine, "before_cursor_execute", _antes_execucao)
+    event.listen(Engine, "after_cursor_execute", _depois_execucao)
+    app.before_request(_iniciar_perfil)
+    app.after_request(_finalizar_perfil)
+
+
+def estatisticas_rotas() -> dict:
+    return metricas_rotas.estatisticas()
@@ -0,0 +1,293 @@
+import asyncio
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import List
+
+import numpy as np
+from sqlalchemy import func, select
+
+from faturas import fatura_em_aberto
+from models import db, FaturasCartoes, Operacoes
+from recorrencias import (
+    consulta_regras_pendentes,
+    expandir_ocorrencias,
+    filtrar_regras_pendentes,
+    regras_pendentes,
+)
+from saldos import (
+    SINAIS_TIPOS_OPERACOES,
+    consulta_saldos,
+    consultar_saldos,
+    saldos_das_linhas,
+    valor_com_sinal,
+)
+
+# Limite de meses aceitos em GET /projecao
+MESES_PADRAO = 12
+MESES_MAXIMO = 120
+
+
+def _indice_mes(dia: date) -> int:
+    return dia.year * 12 + dia.month - 1
+
+
+# Índice do mês (ano * 12 + mês - 1) de uma sequência de datas, em bloco
+def _indices_meses(dias) -> np.ndarray:
+    return np.array(dias, dtype="datetime64[M]").astype(np.int64) + 1970 * 12
+
+
+def _inicio_do_mes(indice: int) -> date:
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def _em_centavos(valor) -> int:
+    return int(Decimal(valor or 0).scaleb(2).to_integral_value())
+
+
+def _de_centavos(centavos: int) -> Decimal:
+    return Decimal(int(centavos)).scaleb(-2)
+
+
+# Soma movimentos por (conta, mês) numa matriz de centavos, em bloco.
+# 'linhas' é a posição da conta na matriz (-1 para contas desconhecidas).
+def _acumular(fluxo, linhas, meses, valores, primeiro_mes):
+    linhas = np.asarray(linhas, dtype=np.int64)
+    colunas = np.maximum(np.asarray(meses, dtype=np.int64) - primeiro_mes, 0)
+    validos = (linhas >= 0) & (colunas < fluxo.shape[1])
+    np.add.at(
+        fluxo,
+        (linhas[validos], colunas[validos]),
+        np.asarray(valores, dtype=np.int64)[validos],
+    )
+
+
+# Movimento por conta e dia dos lançamentos do período, agrupado no banco
+# (índice de conta/data). Compras em fatura aberta contam no vencimento.
+def _consulta_lancamentos(contas, inicio, fim):
+    dia = func.coalesce(
+        FaturasCartoes.faturasCartoesDtVencimento,
+        Operacoes.operacoes_data_lancamento,
+    )
+    return (
+        select(Operacoes.operacoes_conta, dia, func.sum(valor_com_sinal()))
+        .outerjoin(
+            FaturasCartoes,
+            db.and_(
+                FaturasCartoes.faturasCartoesId == Operacoes.operacoes_fatura,
+                fatura_em_aberto(),
+            ),
+        )
+        .where(
+            Operacoes.operacoes_conta.in_(list(contas)),
+            Operacoes.operacoes_data_lancamento.between(inicio, fim),
+        )
+        .group_by(Operacoes.operacoes_conta, dia)
+    )
+
+
+# Soma as linhas de _consulta_lancamentos por conta e mês; o mês de cada dia
+# sai em bloco no NumPy
+def _fluxo_lancamentos(fluxo, posicao_conta, inicio, linhas):
+    if linhas:
+        contas, dias, totais = zip(*linhas)
+        _acumular(
+            fluxo,
+            [posicao_conta[c] for c in contas],
+            _indices_meses(dias),
+            [_em_centavos(t) for t in totais],
+            _indice_mes(inicio),
+        )
+
+
+# Faturas abertas que vencem a partir do início do período: (id, vencimento)
+def _consulta_vencimentos(inicio):
+    return select(
+        FaturasCartoes.faturasCartoesId,
+        FaturasCartoes.faturasCartoesDtVencimento,
+    ).where(
+        fatura_em_aberto(),
+        FaturasCartoes.faturasCartoesDtVencimento >= inicio,
+    )
+
+
+# Compras atrasadas (pendentes de antes do período) nessas faturas, só pelas
+# operações delas (índice de operacoes_fatura)
+def _consulta_faturas_atrasadas(faturas, inicio):
+    return (
+        select(
+            Operacoes.operacoes_conta,
+            Operacoes.operacoes_fatura,
+            func.sum(valor_com_sinal()),
+        )
+        .where(
+            Operacoes.operacoes_fatura.in_(list(faturas)),
+            Operacoes.operacoes_data_lancamento < inicio,
+            db.or_(
+                Operacoes.operacoes_efetivado.is_(None),
+                Operacoes.operacoes_efetivado.is_(False),
+            ),
+        )
+        .group_by(Operacoes.operacoes_conta, Operacoes.operacoes_fatura)
+    )
+
+
+# As compras atrasadas saem do primeiro mês, onde entram os pendentes, e vão
+# para o mês do vencimento
+def _fluxo_faturas_atrasadas(fluxo, posicao_conta, inicio, vencimentos, linhas):
+    if linhas:
+        contas, faturas, totais = zip(*linhas)
+        linhas = [posicao_conta.get(c, -1) for c in contas]
+        centavos = np.array([_em_centavos(t) for t in totais], dtype=np.int64)
+        primeiro_mes = _indice_mes(inicio)
+        meses = _indices_meses([vencimentos[f] for f in faturas])
+        _acumular(fluxo, linhas, meses, centavos, primeiro_mes)
+        _acumular(fluxo, linhas, [primeiro_mes] * len(linhas), -centavos, primeiro_mes)
+
+
+# Ocorrências futuras das regras de recorrência, expandidas em memória (sem
+# gravar) e somadas por conta e mês
+def _fluxo_recorrencias(fluxo, posicao_conta, inicio, validas):
+    if not validas:
+        return
+    regra_de, _, datas = expandir_ocorrencias(validas)
+    linhas = np.array(
+        [posicao_conta.get(r.operacoes_conta, -1) for r, _, _, _ in validas],
+        dtype=np.int64,
+    )
+    valores = np.array(
+        [
+            SINAIS_TIPOS_OPERACOES.get(r.operacoes_tipo, 0)
+            * _em_centavos(r.operacoes_valor)
+            for r, _, _, _ in validas
+        ],
+        dtype=np.int64,
+    )
+    # Ocorrências anteriores ao período ainda não geradas: pendentes,
+    # entram no primeiro mês
+    _acumular(
+        fluxo,
+        linhas[regra_de],
+        _indices_meses(datas),
+        valores[regra_de],
+        _indice_mes(inicio),
+    )
+
+
+# Início, fim e véspera do período projetado
+def _periodo(hoje: date, meses: int):
+    inicio = hoje.replace(day=1)
+    fim = _inicio_do_mes(_indice_mes(inicio) + meses) - timedelta(days=1)
+    return inicio, fim, inicio - timedelta(days=1)
+
+
+# Saldo previsto de cada conta ao fim de cada mês, a partir do mês de 'hoje'.
+# Parte do saldo efetivado até o fim do mês anterior; os pendentes de antes
+# dele (a diferença entre os dois saldos de saldos_diarios) entram no primeiro
+# mês. Soma o fluxo mensal (lançamentos, recorrências e faturas) e acumula
+# com cumsum.
+def projetar_saldos(hoje: date, meses: int) -> dict:
+    inicio, fim, vespera = _periodo(hoje, meses)
+    saldos = consultar_saldos(vespera, somente_efetivados=True)
+    previstos = consultar_saldos(vespera)
+    vencimentos = dict(db.session.execute(_consulta_vencimentos(inicio)).all())
+    validas, _ = regras_pendentes(fim)
+    lancamentos = db.session.execute(
+        _consulta_lancamentos([s["conta"] for s in saldos], inicio, fim)
+    ).all()
+    atrasadas = (
+        db.session.execute(_consulta_faturas_atrasadas(vencimentos, inicio)).all()
+        if vencimentos
+        else []
+    )
+    return _montar_projecao(
+        inicio,
+        fim,
+        meses,
+        saldos,
+        previstos,
+        lancamentos,
+        vencimentos,
+        atrasadas,
+        validas,
+    )
+
+
+# O mesmo cálculo para o modo ASGI: 'executar' é uma função assíncrona que
+# roda uma consulta e devolve as linhas (ver asgi.py). As consultas que não
+# dependem umas das outras vão juntas, em duas levas.
+async def projetar_saldos_async(executar, hoje: date, meses: int) -> dict:
+    inicio, fim, vespera = _periodo(hoje, meses)
+    saldos, previstos, vencimentos, regras = await asyncio.gather(
+        executar(consulta_saldos(vespera, somente_efetivados=True)),
+        executar(consulta_saldos(vespera)),
+        executar(_consulta_vencimentos(inicio)),
+        executar(consulta_regras_pendentes(fim)),
+    )
+    saldos = saldos_das_linhas(saldos)
+    previstos = saldos_das_linhas(previstos)
+    vencimentos = dict(vencimentos)
+    validas, _ = filtrar_regras_pendentes(regras, fim)
+    consultas = [_consulta_lancamentos([s["conta"] for s in saldos], inicio, fim)]
+    if vencimentos:
+        consultas.append(_consulta_faturas_atrasadas(vencimentos, inicio))
+    lancamentos, *atrasadas = await asyncio.gather(*map(executar, consultas))
+    return _montar_projecao(
+        inicio,
+        fim,
+        meses,
+        saldos,
+        previstos,
+        lancamentos,
+        vencimentos,
+        atrasadas[0] if atrasadas else [],
+        validas,
+    )
+
+
+def _montar_projecao(
+    inicio, fim, meses, saldos, previstos, lancamentos, vencimentos, atrasadas, validas
+) -> dict:
+    primeiro_mes = _indice_mes(inicio)
+    posicao_conta = {s["conta"]: i for i, s in enumerate(saldos)}
+    fluxo = np.zeros((len(saldos), meses), dtype=np.int64)
+    fluxo[:, 0] = [
+        _em_centavos(p["saldo"]) - _em_centavos(s["saldo"])
+        for p, s in zip(previstos, saldos)
+    ]
+    _fluxo_lancamentos(fluxo, posicao_conta, inicio, lancamentos)
+    _fluxo_faturas_atrasadas(fluxo, posicao_conta, inicio, vencimentos, atrasadas)
+    _fluxo_recorrencias(fluxo, posicao_conta, inicio, validas)
+
+    abertura = np.array([_em_centavos(s["saldo"]) for s in saldos], dtype=np.int64)
+    projetado = abertura[:, None] + np.cumsum(fluxo, axis=1)
+    considerar = np.array([not s["desconsiderar_saldo"] for s in saldos], dtype=bool)
+    consolidado = projetado[considerar].sum(axis=0)
+
+    rotulos = [_inicio_do_mes(primeiro_mes + i).strftime("%Y-%m") for i in range(meses)]
+    contas: List[dict] = []
+    for saldo, linha_fluxo, linha_saldo in zip(saldos, fluxo, projetado):
+        contas.append(
+            {
+                "conta": saldo["conta"],
+                "nome": saldo["nome"],
+                "saldo_abertura": str(saldo["saldo"]),
+                "desconsiderar_saldo": saldo["desconsiderar_saldo"],
+                "meses": [
+                    {
+                        "mes": rotulo,
+                        "movimento": str(_de_centavos(m)),
+                        "saldo": str(_de_centavos(s)),
+                    }
+                    for rotulo, m, s in zip(rotulos, linha_fluxo, linha_saldo)
+                ],
+            }
+        )
+    return {
+        "inicio": str(inicio),
+        "fim": str(fim),
+        "contas": contas,
+        "consolidado": [
+            {"mes": rotulo, "saldo": str(_de_centavos(s))}
+            for rotulo, s in zip(rotulos, consolidado)
+        ],
+    }
@@ -0,0 +1,321 @@
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, insert, select, update
+
+from duplicados import (
+    chave_fixa_fingerprint,
+    fingerprint_da_chave,
+    normalizar_descricao,
+)
+from models import db, Operacoes, Recorrencias
+from saldos import acumular_movimento, aplicar_movimentos, movimento_valores
+from sincronizacao import registrar_inseridos, ultimo_id
+
+# Frequências aceitas em Recorrencias.frequencia: (unidade, passo).
+# 'D' avança em dias; 'M' em meses, mantendo o dia de data_inicio (limitado
+# ao último dia do mês).
+FREQUENCIAS: Dict[str, Tuple[str, int]] = {
+    "diaria": ("D", 1),
+    "semanal": ("D", 7),
+    "quinzenal": ("D", 14),
+    "mensal": ("M", 1),
+    "bimestral": ("M", 2),
+    "trimestral": ("M", 3),
+    "semestral": ("M", 6),
+    "anual": ("M", 12),
+}
+
+STATUS_ATIVO = "Ativo"
+LOTE_RECORRENCIAS = 5_000
+
+# Campos copiados da operação modelo (Recorrencias.operacao_id)
+COLUNAS_MODELO = (
+    Operacoes.operacoes_data_lancamento,
+    Operacoes.operacoes_descricao,
+    Operacoes.operacoes_conta,
+    Operacoes.operacoes_valor,
+    Operacoes.operacoes_tipo,
+    Operacoes.operacoes_categoria,
+    Operacoes.operacoes_cartao_atrelado,
+    Operacoes.operacoes_projeto,
+)
+
+
+# --- Calendário de dias úteis ---
+
+
+# Domingo de Páscoa (algoritmo de Meeus/Jones/Butcher)
+def _pascoa(ano: int) -> date:
+    a, b, c = ano % 19, ano // 100, ano % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    m = (32 + 2 * e + 2 * i - h - k) % 7
+    n = (a + 11 * h + 22 * m) // 451
+    mes = (h + m - 7 * n + 114) // 31
+    dia = (h + m - 7 * n + 114) % 31 + 1
+    return date(ano, mes, dia)
+
+
+# Feriados nacionais (fixos e móveis) de um intervalo de anos, pré-calculados
+# uma vez como vetor para o np.busday_offset
+@lru_cache(maxsize=8)
+def feriados_nacionais(ano_inicio: int, ano_fim: int) -> np.ndarray:
+    feriados = []
+    for ano in range(ano_inicio, ano_fim + 1):
+        pascoa = _pascoa(ano)
+        feriados += [
+            date(ano, 1, 1),  # Confraternização Universal
+            pascoa - timedelta(days=48),  # Carnaval (segunda)
+            pascoa - timedelta(days=47),  # Carnaval (terça)
+            pascoa - timedelta(days=2),  # Sexta-feira Santa
+            date(ano, 4, 21),  # Tiradentes
+            date(ano, 5, 1),  # Dia do Trabalho
+            pascoa + timedelta(days=60),  # Corpus Christi
+            date(ano, 9, 7),  # Independência
+            date(ano, 10, 12),  # Nossa Senhora Aparecida
+            date(ano, 11, 2),  # Finados
+            date(ano, 11, 15),  # Proclamação da República
+            date(ano, 11, 20),  # Consciência Negra
+            date(ano, 12, 25),  # Natal
+        ]
+    return np.array(sorted(feriados), dtype="datetime64[D]")
+
+
+# --- Séries de datas ---
+
+
+# Datas da k-ésima ocorrência de cada regra, calculadas em bloco
+def _datas_ocorrencias(unidade_mensal, passo, inicio, dia_inicio, k):
+    datas = inicio + (passo * k).astype("timedelta64[D]")
+    if unidade_mensal.any():
+        meses = inicio[unidade_mensal].astype("datetime64[M]") + (
+            passo[unidade_mensal] * k[unidade_mensal]
+        ).astype("timedelta64[M]")
+        primeiro_dia = meses.astype("datetime64[D]")
+        dias_no_mes = ((meses + 1).astype("datetime64[D]") - primeiro_dia).astype(int)
+        deslocamento = np.minimum(dia_inicio[unidade_mensal], dias_no_mes) - 1
+        datas[unidade_mensal] = primeiro_dia + deslocamento.astype("timedelta64[D]")
+    return datas
+
+
+# Índice k da primeira ocorrência >= desde e da última <= ate, por regra
+def _intervalo_k(unidade_mensal, passo, inicio, dia_inicio, desde, ate):
+    # Regras diárias/semanais: divisão exata em dias
+    dias_desde = (desde - inicio).astype(int)
+    dias_ate = (ate - inicio).astype(int)
+    k_min = -(-dias_desde // passo)
+    k_max = dias_ate // passo
+
+    # Regras mensais: estimativa pelo número de meses, corrigida depois pelo
+    # dia do mês
+    mes_inicio = inicio.astype("datetime64[M]").astype(int)
+    meses_desde = desde.astype("datetime64[M]").astype(int) - mes_inicio
+    meses_ate = ate.astype("datetime64[M]").astype(int) - mes_inicio
+    k_min = np.where(unidade_mensal, -(-meses_desde // passo), k_min)
+    k_max = np.where(unidade_mensal, meses_ate // passo, k_max)
+    k_min = np.maximum(k_min, 0)
+
+    abaixo = (
+        _datas_ocorrencias(unidade_mensal, passo, inicio, dia_inicio, k_min) < desde
+    )
+    k_min = k_min + (unidade_mensal & abaixo)
+    acima = (
+        _datas_ocorrencias(
+            unidade_mensal, passo, inicio, dia_inicio, np.maximum(k_max, 0)
+        )
+        > ate
+    )
+    k_max = k_max - (unidade_mensal & acima)
+    return k_min, k_max
+
+
+# --- Materialização ---
+
+
+# Consulta das regras ativas que começam até a data alvo, junto com os campos
+# da operação modelo. 'bloquear' trava as regras (SELECT ... FOR UPDATE) para
+# quem vai gravar.
+def consulta_regras_pendentes(ate: date, bloquear: bool = False):
+    consulta = (
+        select(
+            Recorrencias.recorrencia_id,
+            Recorrencias.frequencia,
+            Recorrencias.data_inicio,
+            Recorrencias.data_fim,
+            Recorrencias.ultimo_lancamento,
+            Recorrencias.dias_uteis,
+            *COLUNAS_MODELO,
+        )
+        .join(Operacoes, Operacoes.operacoes_id == Recorrencias.operacao_id)
+        .where(
+            Recorrencias.status == STATUS_ATIVO,
+            Recorrencias.data_inicio.isnot(None),
+            Recorrencias.data_inicio <= ate,
+        )
+    )
+    if bloquear:
+        consulta = consulta.with_for_update(of=Recorrencias)
+    return consulta
+
+
+# Das linhas de consulta_regras_pendentes, as que têm ocorrências pendentes
+# até a data alvo: ([(regra, frequência, desde, limite)], [ignoradas])
+def filtrar_regras_pendentes(linhas, ate: date):
+    validas = []
+    ignoradas = []
+    for regra in linhas:
+        frequencia = FREQUENCIAS.get(normalizar_descricao(regra.frequencia))
+        if frequencia is None:
+            ignoradas.append(regra.recorrencia_id)
+            continue
+        # A operação modelo conta como a ocorrência da sua própria data
+        desde = regra.data_inicio
+        ja_gerado = regra.ultimo_lancamento or regra.operacoes_data_lancamento
+        if ja_gerado is not None:
+            desde = max(desde, ja_gerado + timedelta(days=1))
+        limite = min(ate, regra.data_fim) if regra.data_fim else ate
+        if desde <= limite:
+            validas.append((regra, frequencia, desde, limite))
+    return validas, ignoradas
+
+
+def regras_pendentes(ate: date, bloquear: bool = False):
+    return filtrar_regras_pendentes(
+        db.session.execute(consulta_regras_pendentes(ate, bloquear)), ate
+    )
+
+
+# Expande as ocorrências de todas as regras num único vetor, sem gravar nada:
+# (índice da regra em 'validas', data nominal, data efetiva)
+def expandir_ocorrencias(validas):
+    unidade_mensal = np.array([f[0] == "M" for _, f, _, _ in validas])
+    passo = np.array([f[1] for _, f, _, _ in validas], dtype=np.int64)
+    inicio = np.array([r.data_inicio for r, _, _, _ in validas], dtype="datetime64[D]")
+    dia_inicio = np.array([r.data_inicio.day for r, _, _, _ in validas])
+    desde = np.array([d for _, _, d, _ in validas], dtype="datetime64[D]")
+    limite = np.array([lim for _, _, _, lim in validas], dtype="datetime64[D]")
+
+    k_min, k_max = _intervalo_k(
+        unidade_mensal, passo, inicio, dia_inicio, desde, limite
+    )
+    quantidades = np.maximum(k_max - k_min + 1, 0)
+    total = int(quantidades.sum())
+
+    regra_de = np.repeat(np.arange(len(validas)), quantidades)
+    primeiros = np.cumsum(quantidades) - quantidades
+    k = k_min[regra_de] + (np.arange(total) - primeiros[regra_de])
+    nominais = _datas_ocorrencias(
+        unidade_mensal[regra_de],
+        passo[regra_de],
+        inicio[regra_de],
+        dia_inicio[regra_de],
+        k,
+    )
+
+    # Regras de dias úteis: empurra para o próximo dia útil
+    uteis = np.array([bool(r.dias_uteis) for r, _, _, _ in validas])[regra_de]
+    datas = nominais.copy()
+    if uteis.any():
+        anos = nominais[uteis].astype("datetime64[Y]").astype(int) + 1970
+        feriados = feriados_nacionais(int(anos.min()), int(anos.max()) + 1)
+        datas[uteis] = np.busday_offset(
+            nominais[uteis], 0, roll="forward", holidays=feriados
+        )
+    return regra_de, nominais, datas
+
+
+# Gera, numa passada e numa transação, os lançamentos de todas as regras
+# ativas desde o último lançamento gerado até a data alvo. Só avança
+# ultimo_lancamento junto com os lançamentos inseridos, então rodar de novo
+# com a mesma data não gera nada (idempotente).
+def materializar_recorrencias(ate: date) -> dict:
+    validas, ignoradas = regras_pendentes(ate, bloquear=True)
+    resultado = {"regras": len(validas), "lancamentos": 0, "ignoradas": ignoradas}
+    if not validas:
+        db.session.commit()
+        return resultado
+
+    regra_de, nominais, datas = expandir_ocorrencias(validas)
+    total = len(regra_de)
+
+    # Campos e movimento que só dependem da regra, calculados uma vez por regra
+    fixos = []
+    for regra, _, _, _ in validas:
+        fixos.append(
+            (
+                {
+                    "operacoes_descricao": regra.operacoes_descricao,
+                    "operacoes_conta": regra.operacoes_conta,
+                    "operacoes_valor": regra.operacoes_valor,
+                    "operacoes_tipo": regra.operacoes_tipo,
+                    "operacoes_categoria": regra.operacoes_categoria,
+                    "operacoes_cartao_atrelado": regra.operacoes_cartao_atrelado,
+                    "operacoes_projeto": regra.operacoes_projeto,
+                    "operacoes_recorrencia": regra.recorrencia_id,
+                    "operacoes_efetivado": False,
+                },
+                (
+                    chave_fixa_fingerprint(
+                        regra.operacoes_tipo,
+                        regra.operacoes_valor,
+                        regra.operacoes_descricao,
+                    )
+                    if regra.operacoes_conta is not None
+                    and regra.operacoes_valor is not None
+                    else None
+                ),
+                movimento_valores(
+                    regra.operacoes_conta,
+                    None,
+                    regra.operacoes_tipo,
+                    regra.operacoes_valor,
+                    False,
+                ),
+            )
+        )
+
+    movimentos = {}
+    lote = []
+    # Os lançamentos inseridos são os de id acima deste
+    anterior = ultimo_id(Operacoes)
+    for indice, data_lancamento in zip(regra_de.tolist(), datas.astype(object)):
+        campos, chave_fixa, (conta, _, valor, _) = fixos[indice]
+        operacao = dict(campos)
+        operacao["operacoes_data_lancamento"] = data_lancamento
+        operacao["operacoes_fingerprint"] = (
+            fingerprint_da_chave(conta, data_lancamento, chave_fixa)
+            if chave_fixa is not None
+            else None
+        )
+        lote.append(operacao)
+        acumular_movimento(movimentos, (conta, data_lancamento, valor, 0))
+        if len(lote) == LOTE_RECORRENCIAS:
+            db.session.execute(insert(Operacoes.__table__), lote)
+            lote = []
+    if lote:
+        db.session.execute(insert(Operacoes.__table__), lote)
+    registrar_inseridos(Operacoes, anterior)
+
+    # ultimo_lancamento guarda a última data nominal gerada de cada regra
+    ultimas = {}
+    for indice, nominal in zip(regra_de.tolist(), nominais.astype(object)):
+        ultimas[validas[indice][0].recorrencia_id] = nominal
+    if ultimas:
+        tabela = Recorrencias.__table__
+        db.session.execute(
+            update(tabela)
+            .where(tabela.c.recorrencia_id == bindparam("b_id"))
+            .values(ultimo_lancamento=bindparam("b_ultimo")),
+            [{"b_id": i, "b_ultimo": d} for i, d in ultimas.items()],
+        )
+
+    aplicar_movimentos(movimentos)
+    db.session.commit()
+    resultado["lancamentos"] = total
+    return resultado
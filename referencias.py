@@ -0,0 +1,458 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+from sqlalchemy import select, update
+
+from conexoes import insert_ignorando_conflito
+from models import (
+    db,
+    Cartoes,
+    Categorias,
+    ContasBancarias,
+    ContasMoedas,
+    FaturasCartoes,
+    Subcategorias,
+    TiposContas,
+    VersoesReferencias,
+)
+
+# Segundos que um dado de referência fica em cache. Cada processo (worker)
+# tem o seu cache; as alterações feitas por outro worker chegam pelas versões
+# compartilhadas (VersoesCompartilhadas), e um id que falta no cache é
+# conferido no banco antes de ser recusado (ver buscar).
+TTL_REFERENCIAS = float(os.getenv("CACHE_REFERENCIAS_TTL", "60"))
+# Segundos entre as leituras das versões compartilhadas: é o atraso máximo
+# para uma alteração feita em outro worker aparecer aqui (e nas ETags)
+VERIFICACAO_REFERENCIAS = float(os.getenv("CACHE_REFERENCIAS_VERIFICACAO", "1"))
+# Quantidade máxima de entradas; as usadas há mais tempo saem primeiro
+MAXIMO_REFERENCIAS = int(os.getenv("CACHE_REFERENCIAS_MAXIMO", "64"))
+
+
+# Cache em memória com TTL, descarte LRU e versão por tabela. Cada entrada
+# lembra as versões das tabelas de que depende; invalidar uma tabela sobe a
+# versão dela e derruba as entradas que a usam.
+class CacheVersionado:
+    def __init__(self, ttl: float, maximo: int):
+        self.ttl = ttl
+        self.maximo = maximo
+        # chave -> (tabelas, versões, expira_em, valor)
+        self._entradas = OrderedDict()
+        self._versoes = defaultdict(int)
+        self._contadores = defaultdict(int)
+        self._trava = threading.Lock()
+
+    def _versao(self, tabelas: Tuple[str, ...]) -> Tuple[int, ...]:
+        return tuple(self._versoes[t] for t in tabelas)
+
+    def obter(self, chave: str, tabelas: Iterable[str], carregar: Callable):
+        tabelas = tuple(tabelas)
+        with self._trava:
+            versao = self._versao(tabelas)
+            entrada = self._entradas.get(chave)
+            if entrada is not None:
+                if entrada[1] == versao and entrada[2] > time.monotonic():
+                    self._entradas.move_to_end(chave)
+                    self._contadores["acertos"] += 1
+                    return entrada[3]
+                del self._entradas[chave]
+                self._contadores["expiradas"] += 1
+            self._contadores["falhas"] += 1
+
+        # Carrega fora da trava; só guarda se nada foi invalidado no meio
+        valor = carregar()
+        with self._trava:
+            if self._versao(tabelas) == versao:
+                self._entradas[chave] = (
+                    tabelas,
+                    versao,
+                    time.monotonic() + self.ttl,
+                    valor,
+                )
+                self._entradas.move_to_end(chave)
+                while len(self._entradas) > self.maximo:
+                    self._entradas.popitem(last=False)
+                    self._contadores["descartes"] += 1
+        return valor
+
+    def invalidar(self, *tabelas: str) -> None:
+        with self._trava:
+            for tabela in tabelas:
+                self._versoes[tabela] += 1
+            vencidas = [
+                chave
+                for chave, entrada in self._entradas.items()
+                if set(entrada[0]) & set(tabelas)
+            ]
+            for chave in vencidas:
+                del self._entradas[chave]
+            self._contadores["invalidadas"] += len(vencidas)
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            acertos = self._contadores["acertos"]
+            falhas = self._contadores["falhas"]
+            return {
+                "entradas": len(self._entradas),
+                "maximo": self.maximo,
+                "ttl": self.ttl,
+                "acertos": acertos,
+                "falhas": falhas,
+                "taxa_acertos": (
+                    round(acertos / (acertos + falhas), 4) if acertos + falhas else None
+                ),
+                "expiradas": self._contadores["expiradas"],
+                "invalidadas": self._contadores["invalidadas"],
+                "descartes": self._contadores["descartes"],
+                "versoes": dict(self._versoes),
+            }
+
+
+cache_referencias = CacheVersionado(TTL_REFERENCIAS, MAXIMO_REFERENCIAS)
+
+
+# Versões das tabelas de referência gravadas no banco (versoes_referencias),
+# compartilhadas por todos os processos. Quem altera uma tabela sobe a versão
+# dela; os outros leem as versões no máximo uma vez por 'intervalo' e
+# descartam do cache local as tabelas que mudaram.
+class VersoesCompartilhadas:
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        # tabela -> versão já aplicada ao cache deste processo
+        self._vistas = {}
+        self._proxima = 0.0
+        self._trava = threading.Lock()
+
+    def conferir(self, cache: CacheVersionado) -> None:
+        agora = time.monotonic()
+        with self._trava:
+            if agora < self._proxima:
+                return
+            self._proxima = agora + self.intervalo
+        versoes = dict(
+            db.session.execute(
+                select(
+                    VersoesReferencias.versoes_referencias_tabela,
+                    VersoesReferencias.versoes_referencias_versao,
+                )
+            ).all()
+        )
+        with self._trava:
+            alteradas = [
+                tabela
+                for tabela in set(versoes) | set(self._vistas)
+                if versoes.get(tabela) != self._vistas.get(tabela)
+            ]
+            self._vistas = versoes
+        if alteradas:
+            cache.invalidar(*alteradas)
+
+    # Sobe a versão das tabelas no banco, numa transação própria
+    def publicar(self, tabelas: List[str]) -> None:
+        tabela = VersoesReferencias.__table__
+        dialeto = db.session.get_bind().dialect.name
+        db.session.execute(
+            insert_ignorando_conflito(tabela, dialeto),
+            [
+                {"versoes_referencias_tabela": nome, "versoes_referencias_versao": 0}
+                for nome in tabelas
+            ],
+        )
+        db.session.execute(
+            update(tabela)
+            .where(tabela.c.versoes_referencias_tabela.in_(tabelas))
+            .values(versoes_referencias_versao=tabela.c.versoes_referencias_versao + 1)
+        )
+        novas = db.session.execute(
+            select(
+                tabela.c.versoes_referencias_tabela,
+                tabela.c.versoes_referencias_versao,
+            ).where(tabela.c.versoes_referencias_tabela.in_(tabelas))
+        ).all()
+        db.session.commit()
+        with self._trava:
+            self._vistas.update(novas)
+
+
+versoes_compartilhadas = VersoesCompartilhadas(VERIFICACAO_REFERENCIAS)
+
+
+# Chamado pelos handlers depois do commit que altera um dos modelos: limpa o
+# cache deste processo e avisa os demais
+def invalidar_referencias(*modelos) -> None:
+    tabelas = sorted({m.__tablename__ for m in modelos})
+    cache_referencias.invalidar(*tabelas)
+    versoes_compartilhadas.publicar(tabelas)
+
+
+def estatisticas_referencias() -> dict:
+    return {
+        **cache_referencias.estatisticas(),
+        "verificacao": versoes_compartilhadas.intervalo,
+    }
+
+
+# --- Dados em cache ---
+# Cada função devolve {id: dicionário já no formato da resposta}. Os
+# dicionários são compartilhados entre as requisições: não altere.
+
+
+def _obter(chave: str, modelos, carregar: Callable) -> Dict[int, dict]:
+    versoes_compartilhadas.conferir(cache_referencias)
+    return cache_referencias.obter(chave, [m.__tablename__ for m in modelos], carregar)
+
+
+def _texto_ou_none(valor):
+    return str(valor) if valor is not None else None
+
+
+def tipos_contas() -> Dict[int, dict]:
+    def carregar():
+        return {
+            tipo.idtipos_contas: {"id": tipo.idtipos_contas, "nome": tipo.tipos_contas}
+            for tipo in db.session.execute(
+                select(TiposContas).order_by(TiposContas.idtipos_contas)
+            ).scalars()
+        }
+
+    return _obter("tipos_contas", [TiposContas], carregar)
+
+
+def subcategorias() -> Dict[int, dict]:
+    def carregar():
+        return {
+            sub.subcategorias_id: {
+                "id": sub.subcategorias_id,
+                "nome": sub.subcategorias_nome,
+                "categoria_id": sub.categorias_id,
+            }
+            for sub in db.session.execute(
+                select(Subcategorias).order_by(Subcategorias.subcategorias_id)
+            ).scalars()
+        }
+
+    return _obter("subcategorias", [Subcategorias], carregar)
+
+
+# Categorias com as suas subcategorias
+def categorias() -> Dict[int, dict]:
+    def carregar():
+        resultado = {
+            cat.categorias_id: {
+                "id": cat.categorias_id,
+                "nome": cat.categorias_nome,
+                "classe": cat.categorias_classe,
+                "subcategorias": [],
+            }
+            for cat in db.session.execute(
+                select(Categorias).order_by(Categorias.categorias_id)
+            ).scalars()
+        }
+        for sub in subcategorias().values():
+            if sub["categoria_id"] in resultado:
+                resultado[sub["categoria_id"]]["subcategorias"].append(
+                    {"id": sub["id"], "nome": sub["nome"]}
+                )
+        return resultado
+
+    return _obter("categorias", [Categorias, Subcategorias], carregar)
+
+
+# Contas com o tipo de conta já resolvido, sem consulta por conta
+def contas_bancarias() -> Dict[int, dict]:
+    def carregar():
+        tipos = tipos_contas()
+        resultado = {}
+        for conta in db.session.execute(
+            select(ContasBancarias).order_by(ContasBancarias.idcontas_bancarias)
+        ).scalars():
+            resultado[conta.idcontas_bancarias] = {
+                "id": conta.idcontas_bancarias,
+                "nome": conta.nome_conta,
+                "tipo_conta": tipos.get(conta.tipo_conta),
+                "saldo_inicial": _texto_ou_none(conta.conta_saldo_inicial),
+                "data_saldo_inicial": _texto_ou_none(conta.data_conta_saldo_incial),
+            }
+        return resultado
+
+    return _obter("contas_bancarias", [ContasBancarias, TiposContas], carregar)
+
+
+def cartoes() -> Dict[int, dict]:
+    def carregar():
+        return {
+            cartao.cartoes_id: {
+                "id": cartao.cartoes_id,
+                "nome": cartao.cartoes_nome,
+                "final": cartao.cartoes_final,
+                "tipo": cartao.cartoes_tipo,
+                "atrelado": cartao.cartoes_atrelado,
+            }
+            for cartao in db.session.execute(
+                select(Cartoes).order_by(Cartoes.cartoes_id)
+            ).scalars()
+        }
+
+    return _obter("cartoes", [Cartoes], carregar)
+
+
+def contas_moedas() -> Dict[int, dict]:
+    def carregar():
+        return {
+            moeda.idcontas_moedas: {
+                "id": moeda.idcontas_moedas,
+                "nome": moeda.contas_moedas_nome,
+                "simbolo": moeda.contas_moedas_simbolo,
+                "cotacao": _texto_ou_none(moeda.contas_moedas_cotacao),
+            }
+            for moeda in db.session.execute(
+                select(ContasMoedas).order_by(ContasMoedas.idcontas_moedas)
+            ).scalars()
+        }
+
+    return _obter("contas_moedas", [ContasMoedas], carregar)
+
+
+# Converte uma fatura no JSON de resposta. O valor é mantido pelo motor de
+# fechamento (faturas.py) a partir dos lançamentos da fatura.
+def fatura_para_dict(fatura):
+    return {
+        "id": fatura.faturasCartoesId,
+        "vencimento": str(fatura.faturasCartoesDtVencimento),
+        "fechamento": _texto_ou_none(fatura.faturasCartoesFechamento),
+        "valor": _texto_ou_none(fatura.faturasCartoesValor),
+        "fechada": bool(fatura.faturasCartoesFechado),
+    }
+
+
+# Faturas de cada cartão: {cartão: [fatura]}. Muda a cada compra no cartão,
+# por isso fica separado de cartoes(), que é usado nas validações.
+def faturas_por_cartao() -> Dict[int, List[dict]]:
+    def carregar():
+        resultado = defaultdict(list)
+        for fatura in db.session.execute(
+            select(FaturasCartoes)
+            .where(FaturasCartoes.faturasCartoesVinculado.isnot(None))
+            .order_by(FaturasCartoes.faturasCartoesId)
+        ).scalars():
+            resultado[fatura.faturasCartoesVinculado].append(fatura_para_dict(fatura))
+        return dict(resultado)
+
+    return _obter("faturas_por_cartao", [FaturasCartoes], carregar)
+
+
+# Dias de fechamento e de débito da fatura de cada cartão, vindos da conta a
+# que ele está atrelado: {cartão: (fechamento, vencimento)}
+def configuracao_cartoes() -> Dict[int, Tuple[int, int]]:
+    def carregar():
+        linhas = db.session.execute(
+            select(
+                Cartoes.cartoes_id,
+                ContasBancarias.contas_cartao_fechamento,
+                ContasBancarias.contas_prev_debito,
+            ).join(
+                ContasBancarias,
+                ContasBancarias.idcontas_bancarias == Cartoes.cartoes_atrelado,
+            )
+        )
+        return {
+            cartao: (fechamento, vencimento or fechamento)
+            for cartao, fechamento, vencimento in linhas
+            if fechamento
+        }
+
+    return _obter("configuracao_cartoes", [Cartoes, ContasBancarias], carregar)
+
+
+# --- Busca por id ---
+
+# Conjuntos buscados por id e a chave primária conferida no banco
+_ITENS = {
+    "tipos_contas": (tipos_contas, TiposContas.idtipos_contas),
+    "subcategorias": (subcategorias, Subcategorias.subcategorias_id),
+    "categorias": (categorias, Categorias.categorias_id),
+    "contas_bancarias": (contas_bancarias, ContasBancarias.idcontas_bancarias),
+    "cartoes": (cartoes, Cartoes.cartoes_id),
+}
+
+
+def _id_valido(identificador) -> bool:
+    return isinstance(identificador, int) and not isinstance(identificador, bool)
+
+
+def _existe_no_banco(coluna, identificador) -> bool:
+    encontrado = db.session.execute(
+        select(coluna).where(coluna == identificador)
+    ).first()
+    if encontrado is None:
+        return False
+    # Criado por outro processo depois da carga: descarta a cópia local
+    cache_referencias.invalidar(coluna.table.name)
+    return True
+
+
+# Item de um conjunto pelo id, ou None se ele não existir. Um id que falta no
+# cache pode ter sido criado por outro worker depois da carga: é conferido no
+# banco e, se existir, o conjunto é recarregado.
+def buscar(nome: str, identificador) -> Union[dict, None]:
+    funcao, coluna = _ITENS[nome]
+    if not _id_valido(identificador):
+        return None
+    item = funcao().get(identificador)
+    if item is None and _existe_no_banco(coluna, identificador):
+        item = funcao().get(identificador)
+    return item
+
+
+# Conjunto de ids válidos para conferir muitas linhas (importação, lotes):
+# o cache é lido uma vez e cada id que falta nele é conferido no banco uma
+# vez só
+class ConjuntoReferencias:
+    def __init__(self, nome: str):
+        funcao, self._coluna = _ITENS[nome]
+        self._ids = funcao().keys()
+        self._conferidos = {}
+
+    def __contains__(self, identificador) -> bool:
+        if not _id_valido(identificador):
+            return False
+        if identificador in self._ids:
+            return True
+        if identificador not in self._conferidos:
+            self._conferidos[identificador] = _existe_no_banco(
+                self._coluna, identificador
+            )
+        return self._conferidos[identificador]
+
+
+# --- Assinaturas (ETag) ---
+
+# Conjuntos que podem ser assinados e as tabelas de que dependem
+_CONJUNTOS = {
+    "tipos_contas": (tipos_contas, [TiposContas]),
+    "categorias": (categorias, [Categorias, Subcategorias]),
+    "contas_bancarias": (contas_bancarias, [ContasBancarias, TiposContas]),
+    "cartoes": (cartoes, [Cartoes]),
+    "faturas_por_cartao": (faturas_por_cartao, [FaturasCartoes]),
+}
+
+
+# Hash do conteúdo dos conjuntos, guardado no cache junto com eles: com o
+# cache quente não consulta o banco nem serializa nada. Por vir do conteúdo,
+# é o mesmo em todos os processos que têm os mesmos dados; uma alteração em
+# outro processo muda a ETag daqui depois de VERIFICACAO_REFERENCIAS.
+def assinatura(*nomes: str) -> str:
+    partes = []
+    for nome in nomes:
+        funcao, modelos = _CONJUNTOS[nome]
+
+        def carregar(funcao=funcao):
+            texto = json.dumps(funcao(), sort_keys=True, default=str)
+            return hashlib.sha1(texto.encode()).hexdigest()
+
+        partes.append(_obter(f"{nome}:assinatura", modelos, carregar))
+    return "-".join(partes)
@@ -0,0 +1,274 @@
+from decimal import Decimal
+from typing import Dict, List, Union
+
+from sqlalchemy import case, func, literal, null, select, tuple_
+
+import agregacao
+from agregacao import (
+    combinar,
+    executar_consultas,
+    paralelo_disponivel,
+    particoes_por_id,
+    particoes_por_periodo,
+)
+from models import db, Categorias, Operacoes, Subcategorias
+from saldos import TIPO_DESPESA, TIPO_RECEITA
+
+# Agrupamentos aceitos em GET /relatorios/categorias: partes da data que
+# formam o período
+AGRUPAMENTOS = {
+    "mes": ("year", "month"),
+    "ano": ("year",),
+    "total": (),
+}
+
+# Níveis do rollup, no formato do GROUPING(classe, categoria, subcategoria)
+NIVEL_SUBCATEGORIA = 0
+NIVEL_CATEGORIA = 1
+NIVEL_CLASSE = 3
+NIVEL_PERIODO = 7
+
+CENTAVO = Decimal("0.01")
+
+
+def _totais():
+    return (
+        func.sum(
+            case(
+                (Operacoes.operacoes_tipo == TIPO_RECEITA, Operacoes.operacoes_valor),
+                else_=0,
+            )
+        ).label("receitas"),
+        func.sum(
+            case(
+                (Operacoes.operacoes_tipo == TIPO_DESPESA, Operacoes.operacoes_valor),
+                else_=0,
+            )
+        ).label("despesas"),
+        func.count().label("quantidade"),
+    )
+
+
+def _base(colunas, condicoes):
+    return (
+        select(*colunas, *_totais())
+        .select_from(Operacoes)
+        .outerjoin(
+            Subcategorias,
+            Operacoes.operacoes_categoria == Subcategorias.subcategorias_id,
+        )
+        .outerjoin(Categorias, Subcategorias.categorias_id == Categorias.categorias_id)
+        .where(*condicoes)
+    )
+
+
+# Uma consulta com GROUP BY periodo, ROLLUP(classe, categoria, subcategoria):
+# devolve as subcategorias e os subtotais de categoria, classe e período
+def _consulta_rollup(periodo, condicoes):
+    categoria = (Categorias.categorias_id, Categorias.categorias_nome)
+    subcategoria = (Subcategorias.subcategorias_id, Subcategorias.subcategorias_nome)
+    nivel = func.grouping(
+        Categorias.categorias_classe,
+        Categorias.categorias_id,
+        Subcategorias.subcategorias_id,
+    )
+    return _base(
+        [
+            *periodo,
+            nivel.label("nivel"),
+            Categorias.categorias_classe,
+            *categoria,
+            *subcategoria,
+        ],
+        condicoes,
+    ).group_by(
+        *periodo,
+        func.rollup(
+            Categorias.categorias_classe, tuple_(*categoria), tuple_(*subcategoria)
+        ),
+    )
+
+
+# Equivalente sem ROLLUP (SQLite, MySQL): um GROUP BY por nível
+def _consultas_niveis(periodo, condicoes):
+    colunas = [
+        Categorias.categorias_classe,
+        Categorias.categorias_id,
+        Categorias.categorias_nome,
+        Subcategorias.subcategorias_id,
+        Subcategorias.subcategorias_nome,
+    ]
+    niveis = [
+        (NIVEL_SUBCATEGORIA, 5),
+        (NIVEL_CATEGORIA, 3),
+        (NIVEL_CLASSE, 1),
+        (NIVEL_PERIODO, 0),
+    ]
+    partes = []
+    for nivel, agrupadas in niveis:
+        vazias = [null().cast(c.type).label(c.key) for c in colunas[agrupadas:]]
+        partes.append(
+            _base(
+                [
+                    *periodo,
+                    literal(nivel).label("nivel"),
+                    *colunas[:agrupadas],
+                    *vazias,
+                ],
+                condicoes,
+            ).group_by(*periodo, *colunas[:agrupadas])
+        )
+    return partes
+
+
+def _valores(linha) -> dict:
+    receitas = Decimal(linha.receitas or 0).quantize(CENTAVO)
+    despesas = Decimal(linha.despesas or 0).quantize(CENTAVO)
+    return {
+        "receitas": str(receitas),
+        "despesas": str(despesas),
+        "saldo": str(receitas - despesas),
+        "quantidade": linha.quantidade,
+    }
+
+
+# Rótulo do período da linha; None para os lançamentos sem data, que formam
+# um período à parte (o último) nos agrupamentos por mês e por ano
+def _rotulo_periodo(linha, partes) -> Union[str, None]:
+    if partes and linha.ano is None:
+        return None
+    if partes == ("year", "month"):
+        return f"{int(linha.ano):04d}-{int(linha.mes):02d}"
+    if partes == ("year",):
+        return f"{int(linha.ano):04d}"
+    return "total"
+
+
+# Consultas do relatório: no PostgreSQL uma só, com ROLLUP; nos demais, uma
+# por nível, que relatorio_categorias une num UNION ALL (uma única ida ao
+# banco) e o modo ASGI roda em paralelo (ver asgi.py)
+def consultas_relatorio(condicoes, agrupamento: str, dialeto: str) -> list:
+    rotulos = {"year": "ano", "month": "mes"}
+    periodo = [
+        func.extract(parte, Operacoes.operacoes_data_lancamento).label(rotulos[parte])
+        for parte in AGRUPAMENTOS[agrupamento]
+    ]
+    if dialeto == "postgresql":
+        return [_consulta_rollup(periodo, condicoes)]
+    return _consultas_niveis(periodo, condicoes)
+
+
+# Partições do relatório. Com um filtro seletivo ('seletivo': categoria,
+# cartão, fatura...) a consulta única pelo índice já lê pouco, e dividi-la
+# só somaria trabalho: None. Relatório de uma conta só ('conta'): faixas de
+# meses entre o primeiro e o último lançamento dela, lidas pelo índice conta
+# + data, e os sem data à parte. Demais: faixas de id. None se não há o que
+# dividir.
+def _particoes_relatorio(condicoes, conta, seletivo) -> Union[List[list], None]:
+    if seletivo:
+        return None
+    if conta is None:
+        particoes = particoes_por_id(agregacao.THREADS_AGREGACAO)
+        return particoes if len(particoes) > 1 else None
+    data = Operacoes.operacoes_data_lancamento
+    inicio, fim = db.session.execute(
+        select(func.min(data), func.max(data)).where(*condicoes)
+    ).one()
+    if inicio is None:
+        return None
+    particoes = particoes_por_periodo(inicio, fim, agregacao.THREADS_AGREGACAO)
+    return [[data.is_(None)], *particoes] if len(particoes) > 1 else None
+
+
+# Relatório de receitas e despesas por subcategoria, com subtotais por
+# categoria, por classe de categoria e por período, vindos prontos do banco.
+# Operações sem subcategoria ficam com id None. Com agregação em paralelo
+# (agregacao.py), as consultas rodam por partição, ao mesmo tempo, e os totais
+# parciais são somados; senão, numa única consulta.
+def relatorio_categorias(
+    condicoes,
+    agrupamento: str,
+    conta: Union[int, None] = None,
+    seletivo: bool = False,
+) -> List[dict]:
+    dialeto = db.engine.dialect.name
+    particoes = (
+        _particoes_relatorio(condicoes, conta, seletivo)
+        if paralelo_disponivel()
+        else None
+    )
+    if particoes is None:
+        consultas = consultas_relatorio(condicoes, agrupamento, dialeto)
+        consulta = (
+            consultas[0].union_all(*consultas[1:]) if consultas[1:] else consultas[0]
+        )
+        return montar_relatorio(db.session.execute(consulta), agrupamento)
+
+    consultas = [
+        consulta
+        for particao in particoes
+        for consulta in consultas_relatorio(
+            [*condicoes, *particao], agrupamento, dialeto
+        )
+    ]
+    linhas = combinar(
+        executar_consultas(consultas), ("receitas", "despesas", "quantidade")
+    )
+    return montar_relatorio(linhas, agrupamento)
+
+
+# Monta o relatório a partir das linhas das consultas_relatorio
+def montar_relatorio(linhas, agrupamento: str) -> List[dict]:
+    partes = AGRUPAMENTOS[agrupamento]
+    periodos: Dict[str, dict] = {}
+    for linha in linhas:
+        rotulo = _rotulo_periodo(linha, partes)
+        item = periodos.setdefault(rotulo, {"periodo": rotulo, "classes": {}})
+        if linha.nivel == NIVEL_PERIODO:
+            item["total"] = _valores(linha)
+            continue
+        classe = item["classes"].setdefault(
+            linha.categorias_classe,
+            {"classe": linha.categorias_classe, "categorias": {}},
+        )
+        if linha.nivel == NIVEL_CLASSE:
+            classe["total"] = _valores(linha)
+            continue
+        categoria = classe["categorias"].setdefault(
+            linha.categorias_id,
+            {
+                "id": linha.categorias_id,
+                "nome": linha.categorias_nome,
+                "subcategorias": [],
+            },
+        )
+        if linha.nivel == NIVEL_CATEGORIA:
+            categoria["total"] = _valores(linha)
+        else:
+            categoria["subcategorias"].append(
+                {
+                    "id": linha.subcategorias_id,
+                    "nome": linha.subcategorias_nome,
+                    **_valores(linha),
+                }
+            )
+
+    # Ordena e troca os mapas auxiliares por listas na resposta
+    def chave(valor):
+        return (valor is None, valor or 0)
+
+    resultado = []
+    for rotulo in sorted(periodos, key=lambda r: (r is None, r or "")):
+        item = periodos[rotulo]
+        classes = []
+        for _, classe in sorted(item["classes"].items(), key=lambda c: chave(c[0])):
+            categorias = sorted(
+                classe["categorias"].values(), key=lambda c: chave(c["id"])
+            )
+            for categoria in categorias:
+                categoria["subcategorias"].sort(key=lambda s: chave(s["id"]))
+            classe["categorias"] = categorias
+            classes.append(classe)
+        item["classes"] = classes
+        resultado.append(item)
+    return resultado
@@ -0,0 +1,400 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from itertools import chain
+from typing import Dict, Iterable, List, Tuple, Union
+
+from sqlalchemy import case, delete, event, func, insert, select, update
+
+from agregacao import executar_consultas, paralelo_disponivel, particoes_por_conta
+from conexoes import insert_ignorando_conflito
+from models import db, ContasBancarias, Operacoes, SaldosDiarios
+
+# Sinal de cada tipo de operação (tipos_operacoes) no saldo da conta:
+# Receita soma, Despesa subtrai. Tipos fora do mapa não alteram o saldo.
+TIPO_RECEITA = 1
+TIPO_DESPESA = 2
+SINAIS_TIPOS_OPERACOES = {TIPO_RECEITA: 1, TIPO_DESPESA: -1}
+
+# Tamanho dos lotes de INSERT na reconstrução dos saldos diários
+LOTE_SALDOS = 10_000
+
+# Movimento de uma operação: (conta, data, valor com sinal, valor efetivado)
+Movimento = Tuple[Union[int, None], Union[date, None], Decimal, Decimal]
+
+
+# Valor da operação com o sinal do seu tipo, para ser somado no banco
+def valor_com_sinal():
+    sinal = case(SINAIS_TIPOS_OPERACOES, value=Operacoes.operacoes_tipo, else_=0)
+    return sinal * Operacoes.operacoes_valor
+
+
+# Mesmo cálculo de valor_com_sinal(), feito em Python
+def movimento_valores(conta, dia, tipo, valor, efetivado) -> Movimento:
+    try:
+        sinal = SINAIS_TIPOS_OPERACOES.get(int(tipo), 0)
+    except (TypeError, ValueError):
+        sinal = 0
+    valor = sinal * Decimal(str(valor or 0))
+    return (conta, dia, valor, valor if efetivado else Decimal(0))
+
+
+def movimento_operacao(operacao: Operacoes) -> Movimento:
+    return movimento_valores(
+        operacao.operacoes_conta,
+        operacao.operacoes_data_lancamento,
+        operacao.operacoes_tipo,
+        operacao.operacoes_valor,
+        operacao.operacoes_efetivado,
+    )
+
+
+# --- Manutenção incremental de saldos_diarios ---
+
+# Chave de session.info com as contas já travadas na transação atual
+_CONTAS_TRAVADAS = "saldos_contas_travadas"
+
+
+# Trava as contas (SELECT ... FOR UPDATE em contas_bancarias) cujos saldos
+# diários a transação vai alterar. Duas gravações na mesma conta passam a
+# correr uma depois da outra, em vez de criarem o mesmo dia ao mesmo tempo ou
+# somarem sobre um fechamento desatualizado. As contas são travadas em ordem
+# crescente e uma vez só por transação; a trava vale até o commit ou rollback.
+def travar_contas(contas: Iterable[Union[int, None]]) -> None:
+    travadas = db.session.info.setdefault(_CONTAS_TRAVADAS, set())
+    novas = sorted({conta for conta in contas if conta is not None} - travadas)
+    if not novas:
+        return
+    db.session.execute(
+        select(ContasBancarias.idcontas_bancarias)
+        .where(ContasBancarias.idcontas_bancarias.in_(novas))
+        .order_by(ContasBancarias.idcontas_bancarias)
+        .with_for_update()
+    )
+    travadas.update(novas)
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def _esquecer_travas(sessao, transacao) -> None:
+    if transacao.parent is None:
+        sessao.info.pop(_CONTAS_TRAVADAS, None)
+
+
+# Aplica o movimento de uma operação (fator=-1 desfaz) aos saldos diários da
+# conta: garante um registro no dia do lançamento e soma o valor a ele e a
+# todos os dias seguintes. Deve rodar na mesma transação do lançamento.
+def aplicar_movimento(movimento: Movimento, fator: int = 1) -> None:
+    conta, dia, valor, valor_efetivado = movimento
+    if conta is None or dia is None or (not valor and not valor_efetivado):
+        return
+
+    travar_contas([conta])
+    # Último fechamento até o dia, lido com trava: no MySQL (REPEATABLE READ)
+    # a leitura com trava vê o último valor gravado, e não o do início da
+    # transação
+    ultimo = db.session.execute(
+        select(
+            SaldosDiarios.saldos_diarios_data,
+            SaldosDiarios.saldos_diarios_saldo,
+            SaldosDiarios.saldos_diarios_efetivado,
+        )
+        .where(
+            SaldosDiarios.saldos_diarios_conta == conta,
+            SaldosDiarios.saldos_diarios_data <= dia,
+        )
+        .order_by(SaldosDiarios.saldos_diarios_data.desc())
+        .limit(1)
+        .with_for_update()
+    ).first()
+    if ultimo is None or ultimo[0] != dia:
+        # Novo dia com movimento: começa com o fechamento do dia anterior. Se
+        # a conta não existir (sem trava), outra transação pode criar o mesmo
+        # dia; o registro dela vale e o UPDATE abaixo soma sobre ele.
+        dialeto = db.session.get_bind().dialect.name
+        db.session.execute(
+            insert_ignorando_conflito(SaldosDiarios.__table__, dialeto).values(
+                saldos_diarios_conta=conta,
+                saldos_diarios_data=dia,
+                saldos_diarios_saldo=ultimo[1] if ultimo else 0,
+                saldos_diarios_efetivado=ultimo[2] if ultimo else 0,
+            )
+        )
+
+    db.session.execute(
+        update(SaldosDiarios)
+        .where(
+            SaldosDiarios.saldos_diarios_conta == conta,
+            SaldosDiarios.saldos_diarios_data >= dia,
+        )
+        .values(
+            saldos_diarios_saldo=SaldosDiarios.saldos_diarios_saldo + fator * valor,
+            saldos_diarios_efetivado=SaldosDiarios.saldos_diarios_efetivado
+            + fator * valor_efetivado,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Soma um movimento ao acumulado por (conta, dia) de um lote de operações
+def acumular_movimento(agregados: dict, movimento: Movimento) -> None:
+    conta, dia, valor, valor_efetivado = movimento
+    if conta is None or dia is None:
+        return
+    anterior = agregados.get((conta, dia), (Decimal(0), Decimal(0)))
+    agregados[(conta, dia)] = (anterior[0] + valor, anterior[1] + valor_efetivado)
+
+
+# Aplica um lote já acumulado: uma atualização por conta e dia, e não uma
+# por operação
+def aplicar_movimentos(agregados: dict, fator: int = 1) -> None:
+    travar_contas(conta for conta, _ in agregados)
+    for (conta, dia), (valor, valor_efetivado) in sorted(agregados.items()):
+        aplicar_movimento((conta, dia, valor, valor_efetivado), fator)
+
+
+# Atualiza os saldos diários após a alteração de uma operação
+def substituir_movimento(antes: Movimento, depois: Movimento) -> None:
+    if antes == depois:
+        return
+    travar_contas([antes[0], depois[0]])
+    aplicar_movimento(antes, fator=-1)
+    aplicar_movimento(depois)
+
+
+# Apaga os saldos diários de uma conta que vai ser excluída (os lançamentos
+# dela ficam sem conta e saem dos saldos). Deve rodar na mesma transação da
+# exclusão, antes dela, por causa da chave estrangeira.
+def apagar_saldos_conta(conta: int) -> None:
+    travar_contas([conta])
+    db.session.execute(
+        delete(SaldosDiarios).where(SaldosDiarios.saldos_diarios_conta == conta)
+    )
+
+
+# --- Consultas de saldo ---
+
+
+# Condições comuns ao recálculo completo
+def _condicoes_movimento(ate: Union[date, None], somente_efetivados: bool):
+    condicoes = []
+    if ate is not None:
+        condicoes.append(Operacoes.operacoes_data_lancamento <= ate)
+    if somente_efetivados:
+        condicoes.append(Operacoes.operacoes_efetivado == True)  # noqa: E712
+    return condicoes
+
+
+# Monta a resposta comum às duas formas de cálculo
+def saldos_das_linhas(linhas) -> List[dict]:
+    saldos = []
+    for linha in linhas:
+        saldo_inicial = Decimal(linha.conta_saldo_inicial or 0)
+        saldos.append(
+            {
+                "conta": linha.idcontas_bancarias,
+                "nome": linha.nome_conta,
+                "saldo_inicial": saldo_inicial,
+                "saldo": saldo_inicial + Decimal(linha.total or 0),
+                "desconsiderar_saldo": bool(linha.contas_desconsiderar_saldo),
+            }
+        )
+    return saldos
+
+
+def _consulta_contas(total, contas):
+    consulta = select(
+        ContasBancarias.idcontas_bancarias,
+        ContasBancarias.nome_conta,
+        ContasBancarias.conta_saldo_inicial,
+        ContasBancarias.contas_desconsiderar_saldo,
+        total.label("total"),
+    ).order_by(ContasBancarias.idcontas_bancarias)
+    if contas is not None:
+        consulta = consulta.where(ContasBancarias.idcontas_bancarias.in_(contas))
+    return consulta
+
+
+# Consulta do saldo de várias contas (ou de todas) a partir de
+# saldos_diarios: para cada conta, uma busca no índice pelo último dia com
+# movimento até a data pedida.
+def consulta_saldos(
+    ate: Union[date, None] = None,
+    somente_efetivados: bool = False,
+    contas: Union[Iterable[int], None] = None,
+):
+    coluna = (
+        SaldosDiarios.saldos_diarios_efetivado
+        if somente_efetivados
+        else SaldosDiarios.saldos_diarios_saldo
+    )
+    ultimo = select(coluna).where(
+        SaldosDiarios.saldos_diarios_conta == ContasBancarias.idcontas_bancarias
+    )
+    if ate is not None:
+        ultimo = ultimo.where(SaldosDiarios.saldos_diarios_data <= ate)
+    ultimo = (
+        ultimo.order_by(SaldosDiarios.saldos_diarios_data.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    if contas is not None:
+        contas = list(contas)
+    return _consulta_contas(ultimo, contas)
+
+
+def consultar_saldos(
+    ate: Union[date, None] = None,
+    somente_efetivados: bool = False,
+    contas: Union[Iterable[int], None] = None,
+) -> List[dict]:
+    return saldos_das_linhas(
+        db.session.execute(consulta_saldos(ate, somente_efetivados, contas))
+    )
+
+
+# Recalcula o saldo a partir de todas as operações, numa única consulta
+# agregada por conta. Usado para conferir os saldos diários.
+def recalcular_saldos(
+    ate: Union[date, None] = None,
+    somente_efetivados: bool = False,
+    contas: Union[Iterable[int], None] = None,
+) -> List[dict]:
+    condicoes = _condicoes_movimento(ate, somente_efetivados)
+    if contas is not None:
+        contas = list(contas)
+        condicoes.append(Operacoes.operacoes_conta.in_(contas))
+
+    movimento = (
+        select(
+            Operacoes.operacoes_conta.label("conta"),
+            func.sum(valor_com_sinal()).label("total"),
+        )
+        .where(*condicoes)
+        .group_by(Operacoes.operacoes_conta)
+        .subquery()
+    )
+    consulta = _consulta_contas(movimento.c.total, contas).outerjoin(
+        movimento, movimento.c.conta == ContasBancarias.idcontas_bancarias
+    )
+    return saldos_das_linhas(db.session.execute(consulta))
+
+
+# Soma os saldos respeitando contas_desconsiderar_saldo
+def saldo_consolidado(saldos: List[dict]) -> Decimal:
+    return sum((s["saldo"] for s in saldos if not s["desconsiderar_saldo"]), Decimal(0))
+
+
+# --- Reconstrução e verificação ---
+
+# Série de fechamentos por conta: {conta: ([datas], [(saldo, efetivado)])}
+Serie = Dict[int, Tuple[List[date], List[Tuple[Decimal, Decimal]]]]
+
+
+# Calcula do zero os fechamentos diários a partir das operações, com uma
+# consulta agrupada por conta e dia e a soma acumulada feita em memória. Com
+# agregação em paralelo (agregacao.py), a consulta roda por faixas de conta ao
+# mesmo tempo; as faixas não se sobrepõem, então cada conta vem inteira e em
+# ordem de uma delas.
+def calcular_serie_diaria() -> Serie:
+    efetivado = case(
+        (Operacoes.operacoes_efetivado == True, valor_com_sinal()),  # noqa: E712
+        else_=0,
+    )
+    consulta = (
+        select(
+            Operacoes.operacoes_conta,
+            Operacoes.operacoes_data_lancamento,
+            func.sum(valor_com_sinal()),
+            func.sum(efetivado),
+        )
+        .where(
+            Operacoes.operacoes_conta.isnot(None),
+            Operacoes.operacoes_data_lancamento.isnot(None),
+        )
+        .group_by(Operacoes.operacoes_conta, Operacoes.operacoes_data_lancamento)
+        .order_by(Operacoes.operacoes_conta, Operacoes.operacoes_data_lancamento)
+    )
+    if paralelo_disponivel():
+        contas = db.session.scalars(select(ContasBancarias.idcontas_bancarias))
+        partes = executar_consultas(
+            [consulta.where(*particao) for particao in particoes_por_conta(contas)]
+        )
+    else:
+        partes = [db.session.execute(consulta)]
+    serie: Serie = {}
+    for conta, dia, valor, valor_efetivado in chain.from_iterable(partes):
+        datas, fechamentos = serie.setdefault(conta, ([], []))
+        saldo, saldo_efetivado = fechamentos[-1] if fechamentos else (0, 0)
+        datas.append(dia)
+        fechamentos.append(
+            (
+                saldo + Decimal(valor or 0),
+                saldo_efetivado + Decimal(valor_efetivado or 0),
+            )
+        )
+    return serie
+
+
+# Apaga e regrava saldos_diarios a partir das operações
+def reconstruir_saldos_diarios() -> int:
+    serie = calcular_serie_diaria()
+    db.session.execute(delete(SaldosDiarios))
+    lote = []
+    total = 0
+    for conta, (datas, fechamentos) in serie.items():
+        for dia, (saldo, saldo_efetivado) in zip(datas, fechamentos):
+            lote.append(
+                {
+                    "saldos_diarios_conta": conta,
+                    "saldos_diarios_data": dia,
+                    "saldos_diarios_saldo": saldo,
+                    "saldos_diarios_efetivado": saldo_efetivado,
+                }
+            )
+            if len(lote) == LOTE_SALDOS:
+                db.session.execute(insert(SaldosDiarios), lote)
+                total += len(lote)
+                lote = []
+    if lote:
+        db.session.execute(insert(SaldosDiarios), lote)
+        total += len(lote)
+    db.session.commit()
+    return total
+
+
+# Fechamento vigente numa data (último dia com movimento até ela)
+def _fechamento_em(datas, fechamentos, dia):
+    posicao = bisect_right(datas, dia)
+    return fechamentos[posicao - 1] if posicao else (Decimal(0), Decimal(0))
+
+
+# Compara saldos_diarios com o recálculo completo. Devolve a lista de
+# divergências (conta, data, gravado, esperado); vazia se estiver consistente.
+def verificar_saldos_diarios() -> List[tuple]:
+    esperado = calcular_serie_diaria()
+    gravado: Serie = defaultdict(lambda: ([], []))
+    consulta = select(
+        SaldosDiarios.saldos_diarios_conta,
+        SaldosDiarios.saldos_diarios_data,
+        SaldosDiarios.saldos_diarios_saldo,
+        SaldosDiarios.saldos_diarios_efetivado,
+    ).order_by(SaldosDiarios.saldos_diarios_conta, SaldosDiarios.saldos_diarios_data)
+    for conta, dia, saldo, saldo_efetivado in db.session.execute(consulta):
+        datas, fechamentos = gravado[conta]
+        datas.append(dia)
+        fechamentos.append((Decimal(saldo), Decimal(saldo_efetivado)))
+
+    divergencias = []
+    vazio = ([], [])
+    for conta in set(esperado) | set(gravado):
+        datas_esperadas, fechamentos_esperados = esperado.get(conta, vazio)
+        datas_gravadas, fechamentos_gravados = gravado.get(conta, vazio)
+        # Dias sem registro valem o fechamento anterior, então basta comparar
+        # os dois lados em todas as datas que aparecem em qualquer um deles
+        for dia in sorted(set(datas_esperadas) | set(datas_gravadas)):
+            valor_esperado = _fechamento_em(datas_esperadas, fechamentos_esperados, dia)
+            valor_gravado = _fechamento_em(datas_gravadas, fechamentos_gravados, dia)
+            if valor_esperado != valor_gravado:
+                divergencias.append((conta, dia, valor_gravado, valor_esperado))
+    return divergencias
@@ -0,0 +1,129 @@
+import time
+from datetime import date
+from decimal import Decimal
+from operator import itemgetter
+from typing import Iterable, List, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+from perfil import registrar_serializacao
+
+# orjson é opcional: sem ele as respostas saem pelo json da biblioteca padrão
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Chaves ordenadas, como no provedor padrão do Flask (sort_keys), para que o
+# JSON saia igual com e sem o orjson
+if orjson is not None:
+    OPCOES_ORJSON = (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS
+    )
+
+
+# Tipos que o JSON não conhece: Decimal sai como texto (sem perder casas) e
+# datas no formato ISO, como as respostas já faziam com str()
+def _padrao(valor):
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return DefaultJSONProvider.default(valor)
+
+
+# Provedor JSON da aplicação (jsonify, request.json): usa o orjson, que
+# codifica datas nativamente e em C, quando ele está instalado
+class ProvedorJSON(DefaultJSONProvider):
+    default = staticmethod(_padrao)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=_padrao, option=OPCOES_ORJSON).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        if orjson is None:
+            resposta = super().response(*args, **kwargs)
+        else:
+            obj = self._prepare_response_obj(args, kwargs)
+            resposta = self._app.response_class(
+                orjson.dumps(obj, default=_padrao, option=OPCOES_ORJSON),
+                mimetype=self.mimetype,
+            )
+        registrar_serializacao(time.perf_counter() - inicio)
+        return resposta
+
+
+# --- Serializadores declarativos ---
+# Descrevem o JSON de uma consulta de colunas (select/query de colunas, não
+# de instâncias ORM): as colunas da consulta saem do próprio serializador e
+# cada linha vira um dicionário pela posição, sem passar pelo identity map.
+# Decimal e datas ficam como estão e são convertidos pelo codificador.
+
+
+class Campo:
+    def __init__(self, nome: str, coluna):
+        self.nome = nome
+        self.colunas = [coluna]
+
+
+# Objeto aninhado; vira null quando o primeiro campo (o id) é nulo
+class Objeto:
+    def __init__(self, nome: str, *campos: Campo):
+        self.nome = nome
+        self.campos = campos
+        self.colunas = [c.colunas[0] for c in campos]
+
+
+# Função que monta o dicionário de um nível a partir da linha: os valores de
+# todos os campos saem de uma vez por um itemgetter e o dicionário de um
+# zip com os nomes. O campo de um objeto aninhado recebe primeiro o id dele,
+# trocado em seguida pelo objeto (ou fica null), mantendo a ordem dos campos.
+def _conversor(campos, posicao: int):
+    nomes, posicoes, objetos = [], [], []
+    for campo in campos:
+        nomes.append(campo.nome)
+        posicoes.append(posicao)
+        if isinstance(campo, Objeto):
+            interno, posicao = _conversor(campo.campos, posicao)
+            objetos.append((campo.nome, interno))
+        else:
+            posicao += 1
+    nomes = tuple(nomes)
+    valores = itemgetter(*posicoes)
+    if len(posicoes) == 1:
+        valores = lambda linha, valor=valores: (valor(linha),)  # noqa: E731
+
+    if not objetos:
+        return lambda linha: dict(zip(nomes, valores(linha))), posicao
+
+    def converter(linha) -> dict:
+        dicionario = dict(zip(nomes, valores(linha)))
+        for nome, interno in objetos:
+            if dicionario[nome] is not None:
+                dicionario[nome] = interno(linha)
+        return dicionario
+
+    return converter, posicao
+
+
+class Serializador:
+    def __init__(self, *campos: Union[Campo, Objeto]):
+        self.colunas = [coluna for campo in campos for coluna in campo.colunas]
+        # A função de conversão é montada uma vez, com as posições fixas:
+        # bem mais rápida que percorrer os campos a cada linha
+        self._converter, _ = _conversor(campos, 0)
+
+    def __call__(self, linha) -> dict:
+        return self._converter(linha)
+
+    def lista(self, linhas: Iterable) -> List[dict]:
+        converter = self._converter
+        return [converter(linha) for linha in linhas]
@@ -0,0 +1,209 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Union
+
+from sqlalchemy import event, func, insert, literal, select
+
+from models import (
+    db,
+    Alteracoes,
+    Cartoes,
+    Categorias,
+    ContasBancarias,
+    FaturasCartoes,
+    Operacoes,
+)
+
+# Tabelas entregues por GET /sync, pelo nome usado na resposta
+TABELAS_SINCRONIZADAS = {
+    "lancamentos": Operacoes,
+    "contas_bancarias": ContasBancarias,
+    "cartoes": Cartoes,
+    "faturas": FaturasCartoes,
+    "categorias": Categorias,
+}
+_NOMES = {modelo.__tablename__: nome for nome, modelo in TABELAS_SINCRONIZADAS.items()}
+
+# Alterações entregues por chamada (cada uma vira no máximo um registro)
+LIMITE_SINCRONIZACAO_PADRAO = 1_000
+LIMITE_SINCRONIZACAO_MAXIMO = 10_000
+
+# O registro é gravado como último comando da transação, logo antes do
+# commit (_gravar_alteracoes). Alterações mais novas que isso ainda não são
+# entregues: o id é reservado nesse INSERT, e outra transação pode fazer
+# commit de um id maior antes do COMMIT desta, que aparece depois do token já
+# entregue ao cliente. A margem só precisa cobrir o tempo entre o INSERT e o
+# COMMIT (e a diferença de relógio entre os servidores).
+MARGEM_SINCRONIZACAO = timedelta(seconds=float(os.getenv("SYNC_MARGEM_SEGUNDOS", "5")))
+
+# Ids consultados por vez na montagem da resposta
+LOTE_SINCRONIZACAO = 1_000
+
+# Chave, em session.info, das alterações que a transação vai gravar no commit
+_PENDENTES = "alteracoes_pendentes"
+
+
+def _chave_primaria(modelo):
+    return modelo.__mapper__.primary_key[0]
+
+
+# --- Registro das alterações (no commit da transação da alteração) ---
+
+
+# Alterações da transação atual, ainda não gravadas: ids por modelo e, das
+# inserções em lote, o último id anterior a elas
+def _pendentes() -> dict:
+    return db.session.info.setdefault(_PENDENTES, {"ids": {}, "acima": {}})
+
+
+# Registra alterações de registros conhecidos pelo id
+def registrar_alteracoes(modelo, ids: Iterable[Union[int, None]]) -> None:
+    ids = {registro for registro in ids if registro is not None}
+    if ids:
+        _pendentes()["ids"].setdefault(modelo, set()).update(ids)
+
+
+# Registra alterações de todos os registros que atendem às condições agora
+# (antes de uma atualização ou exclusão que as deixa de atender)
+def registrar_alteracoes_onde(modelo, *condicoes) -> None:
+    registrar_alteracoes(
+        modelo, db.session.scalars(select(_chave_primaria(modelo)).where(*condicoes))
+    )
+
+
+# Registra as linhas inseridas em lote depois do id 'anterior' (ultimo_id),
+# sem ler os ids: o INSERT ... SELECT vai no commit
+def registrar_inseridos(modelo, anterior: int) -> None:
+    acima = _pendentes()["acima"]
+    acima[modelo] = min(anterior, acima.get(modelo, anterior))
+
+
+# Maior id atual da tabela, para registrar_inseridos
+def ultimo_id(modelo) -> int:
+    return db.session.execute(select(func.max(_chave_primaria(modelo)))).scalar() or 0
+
+
+# Grava as alterações pendentes como último comando antes do commit, para que
+# o id e o momento de cada uma fiquem o mais perto possível do COMMIT
+@event.listens_for(db.session, "before_commit")
+def _gravar_alteracoes(sessao) -> None:
+    pendentes = sessao.info.pop(_PENDENTES, None)
+    if not pendentes:
+        return
+    sessao.flush()
+    agora = datetime.now()
+    tabela = Alteracoes.__table__
+    for modelo, ids in pendentes["ids"].items():
+        sessao.execute(
+            insert(tabela),
+            [
+                {
+                    "alteracoes_tabela": modelo.__tablename__,
+                    "alteracoes_registro": registro,
+                    "alteracoes_momento": agora,
+                }
+                for registro in sorted(ids)
+            ],
+        )
+    for modelo, anterior in pendentes["acima"].items():
+        chave = _chave_primaria(modelo)
+        sessao.execute(
+            insert(tabela).from_select(
+                ["alteracoes_tabela", "alteracoes_registro", "alteracoes_momento"],
+                select(
+                    literal(modelo.__tablename__),
+                    chave,
+                    literal(agora, Alteracoes.alteracoes_momento.type),
+                ).where(chave > anterior),
+            )
+        )
+
+
+# Transação desfeita: as alterações pendentes dela não valem mais
+@event.listens_for(db.session, "after_transaction_end")
+def _descartar_alteracoes(sessao, transacao) -> None:
+    if transacao.parent is None:
+        sessao.info.pop(_PENDENTES, None)
+
+
+# --- Leitura (GET /sync) ---
+
+
+# Linhas atuais dos registros pedidos, com as colunas da tabela (Decimal e
+# datas são convertidos pelo codificador JSON da aplicação)
+def _registros(modelo, ids: List[int]) -> Dict[int, dict]:
+    tabela = modelo.__table__
+    chave = _chave_primaria(modelo)
+    registros = {}
+    for inicio in range(0, len(ids), LOTE_SINCRONIZACAO):
+        for linha in db.session.execute(
+            select(tabela)
+            .where(chave.in_(ids[inicio : inicio + LOTE_SINCRONIZACAO]))
+            .order_by(chave)
+        ).mappings():
+            registros[linha[chave.key]] = dict(linha)
+    return registros
+
+
+# Alterações posteriores ao token 'desde': o estado atual de cada registro
+# alterado e, dos que não existem mais, só o id (removidos). Percorre o
+# registro pelo id e para na primeira alteração ainda dentro da margem, para
+# que o token devolvido nunca passe por cima de uma transação em andamento.
+def alteracoes_desde(desde: int, limite: int) -> dict:
+    corte = datetime.now() - MARGEM_SINCRONIZACAO
+    entradas = db.session.execute(
+        select(
+            Alteracoes.alteracoes_id,
+            Alteracoes.alteracoes_tabela,
+            Alteracoes.alteracoes_registro,
+            Alteracoes.alteracoes_momento,
+        )
+        .where(Alteracoes.alteracoes_id > desde)
+        .order_by(Alteracoes.alteracoes_id)
+        .limit(limite + 1)
+    ).all()
+
+    token = desde
+    mais = False
+    alterados: Dict[str, set] = {nome: set() for nome in TABELAS_SINCRONIZADAS}
+    for numero, (alteracao_id, tabela, registro, momento) in enumerate(entradas):
+        if numero == limite or momento > corte:
+            mais = True
+            break
+        if tabela in _NOMES:
+            alterados[_NOMES[tabela]].add(registro)
+        token = alteracao_id
+
+    alteracoes, removidos = {}, {}
+    for nome, ids in alterados.items():
+        registros = _registros(TABELAS_SINCRONIZADAS[nome], sorted(ids))
+        alteracoes[nome] = list(registros.values())
+        removidos[nome] = sorted(ids - registros.keys())
+    return {
+        "token": token,
+        "mais": mais,
+        "alteracoes": alteracoes,
+        "removidos": removidos,
+    }
+
+
+# Registra todas as linhas atuais das tabelas sincronizadas que ainda não têm
+# nenhuma alteração registrada: base para a primeira sincronização (since=0)
+# num banco que já tinha dados antes do registro de alterações.
+def iniciar_sincronizacao() -> Dict[str, int]:
+    totais = {}
+    for nome, modelo in TABELAS_SINCRONIZADAS.items():
+        registrado = db.session.execute(
+            select(Alteracoes.alteracoes_id)
+            .where(Alteracoes.alteracoes_tabela == modelo.__tablename__)
+            .limit(1)
+        ).first()
+        if registrado is not None:
+            totais[nome] = 0
+            continue
+        totais[nome] = db.session.execute(
+            select(func.count()).select_from(modelo)
+        ).scalar()
+        registrar_inseridos(modelo, 0)
+    db.session.commit()
+    return totais
@@ -0,0 +1,433 @@
+import io
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Union
+
+from flask import current_app
+from sqlalchemy import exc, select, update
+
+from faturas import fechar_faturas
+from importacao import importar_lancamentos, ler_csv, ler_ofx
+from models import db, Tarefas
+from recorrencias import materializar_recorrencias
+
+# Tarefas em segundo plano, numa fila gravada no próprio banco (tabela
+# tarefas), sem broker externo. Cada processo da aplicação sobe
+# TAREFAS_THREADS threads que reservam a próxima tarefa pendente com um UPDATE
+# condicional (só um worker consegue) e a executam. O worker renova
+# tarefas_atualizada enquanto executa; se o processo cair, a tarefa parada há
+# mais de TAREFAS_EXPIRACAO segundos volta para a fila e é retomada do último
+# ponto gravado. Desligue as threads com TAREFAS_THREADS=0 e rode
+# `flask --app app executar-tarefas` num processo à parte.
+THREADS_TAREFAS = int(os.getenv("TAREFAS_THREADS", "2"))
+# Espera entre consultas à fila quando não há tarefa
+INTERVALO_TAREFAS = float(os.getenv("TAREFAS_INTERVALO", "2"))
+EXPIRACAO_TAREFAS = timedelta(seconds=float(os.getenv("TAREFAS_EXPIRACAO", "300")))
+# Execuções interrompidas (queda do processo) antes de desistir da tarefa
+MAXIMO_TENTATIVAS = int(os.getenv("TAREFAS_TENTATIVAS", "3"))
+
+STATUS_PENDENTE = "pendente"
+STATUS_EXECUTANDO = "executando"
+STATUS_CONCLUIDA = "concluida"
+STATUS_ERRO = "erro"
+
+# Candidatas lidas por consulta à fila
+LOTE_RESERVA = 10
+# Bytes copiados por vez ao gravar o arquivo enviado
+TAMANHO_BLOCO_ARQUIVO = 1024 * 1024
+
+
+# A tarefa foi reservada por outro worker (a execução expirou): o trabalho
+# desta execução é desfeito
+class TarefaPerdida(Exception):
+    pass
+
+
+# Execução de uma tarefa, passada à função do tipo
+class ExecucaoTarefa:
+    def __init__(self, tarefa_id: int, dono: str, estado: Union[dict, None]):
+        self.tarefa_id = tarefa_id
+        self.dono = dono
+        # Ponto de retomada gravado pela execução anterior, se houver
+        self.estado = estado
+
+    # Grava progresso e ponto de retomada na sessão; vão para o banco no mesmo
+    # commit do trabalho feito até aqui
+    def registrar(self, progresso: int, mensagem: str, estado=None) -> None:
+        valores = {
+            "tarefas_progresso": progresso,
+            "tarefas_mensagem": mensagem[:255],
+            "tarefas_atualizada": datetime.now(),
+        }
+        if estado is not None:
+            valores["tarefas_estado"] = current_app.json.dumps(estado)
+            self.estado = estado
+        alteradas = db.session.execute(
+            update(Tarefas)
+            .where(
+                Tarefas.tarefas_id == self.tarefa_id,
+                Tarefas.tarefas_dono == self.dono,
+            )
+            .values(**valores)
+        ).rowcount
+        if not alteradas:
+            raise TarefaPerdida(self.tarefa_id)
+
+
+# --- Tipos de tarefa ---
+
+
+def _data(parametros: dict) -> date:
+    return date.fromisoformat(parametros["ate"])
+
+
+# Importação de extrato em lotes com commit, retomada depois da última linha
+# confirmada. O arquivo foi gravado no envio (ver salvar_arquivo).
+def _importar_lancamentos(parametros: dict, execucao: ExecucaoTarefa) -> dict:
+    estado = execucao.estado or {}
+    retomar_apos = estado.get("linha") or 0
+    caminho = parametros["arquivo"]
+    tamanho = max(os.path.getsize(caminho), 1)
+    with open(caminho, "rb") as binario:
+        texto = io.TextIOWrapper(
+            binario, encoding=parametros["encoding"], errors="replace", newline=""
+        )
+        formato = parametros["formato"]
+        leitor = ler_ofx(texto) if formato == "ofx" else ler_csv(texto)
+
+        def confirmar(linha, resultado):
+            execucao.registrar(
+                min(binario.tell() * 100 // tamanho, 99),
+                f"{resultado['importados']} lançamentos importados",
+                {
+                    "linha": retomar_apos if linha is None else linha,
+                    "resultado": resultado,
+                },
+            )
+
+        resultado = importar_lancamentos(
+            ((numero, campos) for numero, campos in leitor if numero > retomar_apos),
+            formato,
+            parametros["conta"],
+            parametros["subcategoria"],
+            parametros["duplicados"],
+            resultado=estado.get("resultado"),
+            confirmar=confirmar,
+        )
+    resultado["mensagem"] = f"{resultado['importados']} lançamentos importados"
+    return resultado
+
+
+# Geração e fechamento rodam numa transação e são idempotentes: executar de
+# novo depois de uma queda só faz o que ainda falta
+def _gerar_recorrencias(parametros: dict, execucao: ExecucaoTarefa) -> dict:
+    resultado = materializar_recorrencias(_data(parametros))
+    resultado["mensagem"] = f"{resultado['lancamentos']} lançamentos gerados"
+    return resultado
+
+
+def _fechar_faturas(parametros: dict, execucao: ExecucaoTarefa) -> dict:
+    resultado = fechar_faturas(_data(parametros))
+    resultado["mensagem"] = f"{resultado['faturas_fechadas']} faturas fechadas"
+    return resultado
+
+
+# Tipos aceitos em POST /tarefas/<tipo>: função(parâmetros, execução) que
+# devolve o resultado
+TIPOS_TAREFAS: Dict[str, Callable[[dict, ExecucaoTarefa], dict]] = {
+    "importar-lancamentos": _importar_lancamentos,
+    "gerar-recorrencias": _gerar_recorrencias,
+    "fechar-faturas": _fechar_faturas,
+}
+
+
+# --- Envio ---
+
+
+# Diretório dos arquivos enviados para importação, apagados ao fim da tarefa
+def _diretorio_arquivos() -> str:
+    diretorio = os.getenv("TAREFAS_DIRETORIO") or os.path.join(
+        current_app.instance_path, "tarefas"
+    )
+    os.makedirs(diretorio, exist_ok=True)
+    return diretorio
+
+
+# Grava o arquivo enviado (em streaming) para a tarefa ler depois, inclusive
+# numa retomada; devolve o caminho
+def salvar_arquivo(origem) -> str:
+    caminho = os.path.join(_diretorio_arquivos(), uuid.uuid4().hex)
+    with open(caminho, "wb") as destino:
+        shutil.copyfileobj(origem, destino, TAMANHO_BLOCO_ARQUIVO)
+    return caminho
+
+
+def tarefa_por_chave(chave: str) -> Union[Tarefas, None]:
+    return db.session.execute(
+        select(Tarefas).where(Tarefas.tarefas_chave == chave)
+    ).scalar_one_or_none()
+
+
+# Coloca uma tarefa na fila: (tarefa, criada). Com a chave de idempotência de
+# um envio anterior, devolve a tarefa já existente.
+def enviar_tarefa(tipo: str, parametros: dict, chave: Union[str, None] = None):
+    if chave:
+        existente = tarefa_por_chave(chave)
+        if existente is not None:
+            return existente, False
+    tarefa = Tarefas(
+        tarefas_tipo=tipo,
+        tarefas_chave=chave or None,
+        tarefas_status=STATUS_PENDENTE,
+        tarefas_progresso=0,
+        tarefas_parametros=current_app.json.dumps(parametros),
+        tarefas_tentativas=0,
+        tarefas_criada=datetime.now(),
+    )
+    db.session.add(tarefa)
+    try:
+        db.session.commit()
+    except exc.IntegrityError:
+        # Envio simultâneo com a mesma chave
+        db.session.rollback()
+        return tarefa_por_chave(chave), False
+    _nova_tarefa.set()
+    return tarefa, True
+
+
+# Apaga o arquivo de uma tarefa que terminou (ou que não chegou a ser criada)
+def apagar_arquivo(parametros: dict) -> None:
+    if parametros.get("arquivo"):
+        try:
+            os.remove(parametros["arquivo"])
+        except FileNotFoundError:
+            pass
+
+
+# --- Execução ---
+
+
+# Reserva a próxima tarefa pendente, ou uma executando cujo worker parou de
+# dar sinal. O UPDATE só acerta se status e tentativas ainda são os lidos,
+# então dois workers nunca reservam a mesma tarefa (sem SKIP LOCKED, que nem
+# todo banco tem).
+def _reservar(dono: str) -> Union[Tarefas, None]:
+    agora = datetime.now()
+    candidatas = db.session.execute(
+        select(Tarefas.tarefas_id, Tarefas.tarefas_status, Tarefas.tarefas_tentativas)
+        .where(
+            db.or_(
+                Tarefas.tarefas_status == STATUS_PENDENTE,
+                db.and_(
+                    Tarefas.tarefas_status == STATUS_EXECUTANDO,
+                    Tarefas.tarefas_atualizada < agora - EXPIRACAO_TAREFAS,
+                ),
+            )
+        )
+        .order_by(Tarefas.tarefas_id)
+        .limit(LOTE_RESERVA)
+    ).all()
+    for tarefa_id, status, tentativas in candidatas:
+        lida = (
+            Tarefas.tarefas_id == tarefa_id,
+            Tarefas.tarefas_status == status,
+            Tarefas.tarefas_tentativas == tentativas,
+        )
+        if tentativas >= MAXIMO_TENTATIVAS:
+            db.session.execute(
+                update(Tarefas)
+                .where(*lida)
+                .values(
+                    tarefas_status=STATUS_ERRO,
+                    tarefas_erro=f"Interrompida {tentativas} vezes",
+                    tarefas_concluida=agora,
+                    tarefas_atualizada=agora,
+                )
+            )
+            db.session.commit()
+            continue
+        reservada = db.session.execute(
+            update(Tarefas)
+            .where(*lida)
+            .values(
+                tarefas_status=STATUS_EXECUTANDO,
+                tarefas_dono=dono,
+                tarefas_tentativas=tentativas + 1,
+                tarefas_iniciada=db.func.coalesce(Tarefas.tarefas_iniciada, agora),
+                tarefas_atualizada=agora,
+            )
+        ).rowcount
+        db.session.commit()
+        if reservada:
+            return db.session.get(Tarefas, tarefa_id)
+    return None
+
+
+def _finalizar(tarefa_id: int, dono: str, **valores) -> None:
+    agora = datetime.now()
+    db.session.execute(
+        update(Tarefas)
+        .where(Tarefas.tarefas_id == tarefa_id, Tarefas.tarefas_dono == dono)
+        .values(tarefas_concluida=agora, tarefas_atualizada=agora, **valores)
+    )
+    db.session.commit()
+
+
+# Tarefas em execução neste processo: {id: dono}, renovadas por _manter_vivas
+_em_execucao: Dict[int, str] = {}
+_trava = threading.Lock()
+# Avisa os workers deste processo de que há tarefa nova
+_nova_tarefa = threading.Event()
+
+
+def _executar(tarefa: Tarefas, dono: str) -> None:
+    tarefa_id = tarefa.tarefas_id
+    parametros = current_app.json.loads(tarefa.tarefas_parametros)
+    estado = tarefa.tarefas_estado
+    execucao = ExecucaoTarefa(
+        tarefa_id, dono, current_app.json.loads(estado) if estado else None
+    )
+    funcao = TIPOS_TAREFAS.get(tarefa.tarefas_tipo)
+    with _trava:
+        _em_execucao[tarefa_id] = dono
+    try:
+        if funcao is None:
+            raise ValueError(f"Tipo de tarefa desconhecido: {tarefa.tarefas_tipo}")
+        resultado = funcao(parametros, execucao)
+    except TarefaPerdida:
+        db.session.rollback()
+        current_app.logger.warning("Tarefa %d reservada por outro worker", tarefa_id)
+        return
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception("Erro na tarefa %d", tarefa_id)
+        _finalizar(
+            tarefa_id,
+            dono,
+            tarefas_status=STATUS_ERRO,
+            tarefas_erro=f"{e.__class__.__name__}: {e}",
+        )
+        apagar_arquivo(parametros)
+    else:
+        _finalizar(
+            tarefa_id,
+            dono,
+            tarefas_status=STATUS_CONCLUIDA,
+            tarefas_progresso=100,
+            tarefas_mensagem=str(resultado.get("mensagem", ""))[:255],
+            tarefas_resultado=current_app.json.dumps(resultado),
+        )
+        apagar_arquivo(parametros)
+    finally:
+        with _trava:
+            _em_execucao.pop(tarefa_id, None)
+
+
+# Reserva e executa uma tarefa; devolve False se a fila está vazia
+def executar_proxima(dono: str) -> bool:
+    tarefa = _reservar(dono)
+    if tarefa is None:
+        return False
+    _executar(tarefa, dono)
+    return True
+
+
+def _dono() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+# Laço de um worker: executa tarefas enquanto houver e espera o aviso de
+# tarefa nova (ou o intervalo) quando a fila esvazia. Com 'esvaziar', sai
+# quando não houver mais tarefa.
+def trabalhar(app, esvaziar: bool = False) -> None:
+    dono = _dono()
+    while True:
+        with app.app_context():
+            try:
+                executou = executar_proxima(dono)
+            except exc.SQLAlchemyError:
+                app.logger.exception("Erro ao consultar a fila de tarefas")
+                executou = False
+        if executou:
+            continue
+        if esvaziar:
+            return
+        _nova_tarefa.wait(INTERVALO_TAREFAS)
+        _nova_tarefa.clear()
+
+
+# Renova o sinal de vida das tarefas em execução neste processo, para que não
+# sejam tomadas como abandonadas
+def _manter_vivas(app) -> None:
+    while True:
+        time.sleep(EXPIRACAO_TAREFAS.total_seconds() / 4)
+        with _trava:
+            donos = dict(_em_execucao)
+        if not donos:
+            continue
+        with app.app_context():
+            try:
+                with db.engine.begin() as conexao:
+                    conexao.execute(
+                        update(Tarefas)
+                        .where(
+                            Tarefas.tarefas_id.in_(list(donos)),
+                            Tarefas.tarefas_dono.in_(set(donos.values())),
+                            Tarefas.tarefas_status == STATUS_EXECUTANDO,
+                        )
+                        .values(tarefas_atualizada=datetime.now())
+                    )
+            except exc.SQLAlchemyError:
+                app.logger.warning("Sinal de vida das tarefas falhou", exc_info=True)
+
+
+# Sobe 'threads' workers e a thread que renova o sinal de vida; devolve os
+# workers
+def subir_workers(app, threads: int, esvaziar: bool = False):
+    workers = [
+        threading.Thread(
+            target=trabalhar, args=(app, esvaziar), name=f"tarefas-{i}", daemon=True
+        )
+        for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    threading.Thread(
+        target=_manter_vivas, args=(app,), name="tarefas-sinal", daemon=True
+    ).start()
+    return workers
+
+
+_workers_pid = None
+
+
+# Sobe as threads de tarefas no processo atual, uma vez por processo (depois
+# do fork dos workers do gunicorn, na primeira requisição de cada um)
+def _garantir_workers() -> None:
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _trava:
+        if _workers_pid == os.getpid():
+            return
+        _workers_pid = os.getpid()
+        # SQLite em memória (testes): uma única conexão, compartilhada com as
+        # requisições; as tarefas ficam na fila (executar_proxima as roda)
+        url = db.engine.url
+        if url.get_backend_name() == "sqlite" and url.database in (
+            None,
+            "",
+            ":memory:",
+        ):
+            return
+        subir_workers(current_app._get_current_object(), THREADS_TAREFAS)
+
+
+def iniciar_tarefas(app) -> None:
+    if THREADS_TAREFAS > 0:
+        app.before_request(_garantir_workers)
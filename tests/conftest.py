@@ -0,0 +1,143 @@
+import os
+import sys
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+from sqlalchemy import event, insert
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+# SQLite em memória (uma conexão, sem as threads de tarefas) e sem a margem
+# do registro de alterações, para que as alterações apareçam na hora
+os.environ["DATABASE_URI"] = "sqlite://"
+os.environ["SYNC_MARGEM_SEGUNDOS"] = "0"
+
+import referencias  # noqa: E402
+from app import app as aplicacao  # noqa: E402
+from models import (  # noqa: E402
+    db,
+    Categorias,
+    ContasBancarias,
+    Operacoes,
+    Subcategorias,
+    TiposContas,
+    TiposOperacoes,
+)
+
+
+# Aplicação com o banco criado do zero a cada teste. As versões
+# compartilhadas do cache recomeçam junto com o banco.
+@pytest.fixture
+def app():
+    referencias.versoes_compartilhadas = referencias.VersoesCompartilhadas(
+        referencias.VERIFICACAO_REFERENCIAS
+    )
+    with aplicacao.app_context():
+        db.create_all()
+        yield aplicacao
+        db.session.remove()
+        db.drop_all()
+    referencias.cache_referencias.invalidar(
+        *(tabela.name for tabela in db.metadata.sorted_tables)
+    )
+
+
+@pytest.fixture
+def cliente(app):
+    return app.test_client()
+
+
+# Liga a checagem de chaves estrangeiras do SQLite (desligada por padrão),
+# como o PostgreSQL e o MySQL fazem sempre
+@pytest.fixture
+def chaves_estrangeiras(app):
+    db.session.commit()
+    db.session.connection().exec_driver_sql("PRAGMA foreign_keys=ON")
+    yield
+    db.session.rollback()
+    db.session.connection().exec_driver_sql("PRAGMA foreign_keys=OFF")
+
+
+# Dados de referência mínimos: tipos de operação, duas contas e duas
+# subcategorias de uma categoria. Devolve os ids.
+@pytest.fixture
+def referencias_basicas(app):
+    return criar_referencias_basicas()
+
+
+def criar_referencias_basicas() -> dict:
+    db.session.execute(
+        insert(TiposOperacoes),
+        [
+            {"tipo_operacao_id": 1, "tipo_operacao_nome": "Receita"},
+            {"tipo_operacao_id": 2, "tipo_operacao_nome": "Despesa"},
+        ],
+    )
+    db.session.execute(insert(TiposContas), [{"tipos_contas": "Corrente"}])
+    db.session.execute(
+        insert(ContasBancarias),
+        [
+            {
+                "idcontas_bancarias": conta,
+                "nome_conta": f"Conta {conta}",
+                "tipo_conta": 1,
+                "conta_saldo_inicial": 100 * conta,
+            }
+            for conta in (1, 2)
+        ],
+    )
+    db.session.execute(
+        insert(Categorias),
+        [{"categorias_id": 1, "categorias_nome": "Casa", "categorias_classe": 1}],
+    )
+    db.session.execute(
+        insert(Subcategorias),
+        [
+            {
+                "subcategorias_id": sub,
+                "subcategorias_nome": f"Sub {sub}",
+                "subcategorias_classe": 1,
+                "categorias_id": 1,
+            }
+            for sub in (1, 2)
+        ],
+    )
+    db.session.commit()
+    return {"contas": [1, 2], "subcategorias": [1, 2]}
+
+
+# Insere 'quantidade' lançamentos variados direto no banco, sem passar pelas
+# rotas (os saldos diários e o registro de alterações não são atualizados)
+def inserir_operacoes(quantidade: int, inicio: int = 0) -> None:
+    db.session.execute(
+        insert(Operacoes),
+        [
+            {
+                "operacoes_data_lancamento": date(2024, 1 + i % 12, 1 + i % 28),
+                "operacoes_descricao": f"Lançamento {i}",
+                "operacoes_conta": 1 + i % 2,
+                "operacoes_valor": f"{1 + i % 97}.{i % 100:02d}",
+                "operacoes_tipo": 1 + i % 3 % 2,
+                "operacoes_categoria": 1 + i % 2 if i % 5 else None,
+                "operacoes_efetivado": i % 4 != 0,
+            }
+            for i in range(inicio, inicio + quantidade)
+        ],
+    )
+    db.session.commit()
+
+
+# Conta os comandos SQL enviados ao banco dentro do bloco
+@contextmanager
+def contar_consultas():
+    consultas = []
+
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        consultas.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", registrar)
+    try:
+        yield consultas
+    finally:
+        event.remove(db.engine, "before_cursor_execute", registrar)
@@ -0,0 +1,92 @@
+import pytest
+from flask import Flask
+from sqlalchemy import insert
+
+import agregacao
+import referencias
+from conexoes import opcoes_engine
+from conftest import criar_referencias_basicas, inserir_operacoes
+from models import db, Operacoes
+from relatorios import relatorio_categorias
+from saldos import calcular_serie_diaria
+
+RELATORIOS = [
+    lambda: relatorio_categorias([], "mes"),
+    lambda: relatorio_categorias([], "ano"),
+    lambda: relatorio_categorias([], "total"),
+    lambda: relatorio_categorias([Operacoes.operacoes_conta == 1], "mes", 1),
+    calcular_serie_diaria,
+]
+
+
+# Aplicação à parte, com o banco num arquivo SQLite e um pool de verdade (o
+# SQLite em memória dos demais testes tem uma conexão só)
+@pytest.fixture
+def banco_em_arquivo(tmp_path):
+    outra = Flask("agregacao")
+    uri = f"sqlite:///{tmp_path / 'financas.db'}"
+    outra.config["SQLALCHEMY_DATABASE_URI"] = uri
+    outra.config["SQLALCHEMY_ENGINE_OPTIONS"] = opcoes_engine(uri)
+    db.init_app(outra)
+    with outra.app_context():
+        db.create_all()
+        criar_referencias_basicas()
+        inserir_operacoes(2_000)
+        # Um lançamento sem data, que vai numa partição própria
+        db.session.execute(
+            insert(Operacoes).values(
+                operacoes_descricao="Sem data",
+                operacoes_conta=1,
+                operacoes_valor="9.99",
+                operacoes_tipo=2,
+            )
+        )
+        db.session.commit()
+        yield outra
+        db.session.remove()
+        db.engine.dispose()
+    referencias.cache_referencias.invalidar(
+        *(tabela.name for tabela in db.metadata.sorted_tables)
+    )
+
+
+def relatorios(monkeypatch, threads: int) -> list:
+    monkeypatch.setattr(agregacao, "THREADS_AGREGACAO", threads)
+    return [relatorio() for relatorio in RELATORIOS]
+
+
+def test_relatorios_iguais_em_serie_e_em_paralelo(banco_em_arquivo, monkeypatch):
+    serie = relatorios(monkeypatch, 1)
+    assert not agregacao.paralelo_disponivel()
+
+    executores = []
+
+    class Executor(agregacao.ThreadPoolExecutor):
+        def __init__(self, threads):
+            executores.append(threads)
+            super().__init__(threads)
+
+    monkeypatch.setattr(agregacao, "ThreadPoolExecutor", Executor)
+    assert relatorios(monkeypatch, 4) == serie
+    # Cada relatório rodou em paralelo
+    assert len(executores) == len(RELATORIOS) and min(executores) > 1
+
+    # Todas as conexões extras foram devolvidas
+    reservadas = agregacao._reservar_conexoes(agregacao.CONEXOES_AGREGACAO)
+    assert reservadas == agregacao.CONEXOES_AGREGACAO
+    for _ in range(reservadas):
+        agregacao._conexoes_livres.release()
+
+
+def test_sem_conexoes_livres_roda_em_serie(banco_em_arquivo, monkeypatch):
+    serie = relatorios(monkeypatch, 1)
+
+    # Outra agregação ocupa todas as conexões extras menos uma
+    monkeypatch.setattr(agregacao, "_conexoes_livres", agregacao.threading.Semaphore(1))
+
+    def sem_threads(*args, **kwargs):
+        raise AssertionError("Sem conexões livres, não abre threads")
+
+    monkeypatch.setattr(agregacao, "ThreadPoolExecutor", sem_threads)
+    assert relatorios(monkeypatch, 4) == serie
+    assert agregacao._conexoes_livres.acquire(blocking=False)
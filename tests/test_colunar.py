@@ -0,0 +1,143 @@
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import case, func, select
+
+import colunar
+from conftest import inserir_operacoes
+from models import db, Operacoes
+from saldos import TIPO_DESPESA, TIPO_RECEITA
+
+
+# Cópia colunar nova a cada teste: a do processo guardaria o banco anterior
+@pytest.fixture(autouse=True)
+def copia_colunar(monkeypatch):
+    copia = colunar.OperacoesColunares()
+    monkeypatch.setattr(colunar, "operacoes_colunares", copia)
+    return copia
+
+
+# Colunas do GROUP BY para cada agrupamento de resumir()
+AGRUPAMENTOS_SQL = {
+    "mes": func.strftime("%Y-%m", Operacoes.operacoes_data_lancamento),
+    "conta": Operacoes.operacoes_conta,
+    "subcategoria": Operacoes.operacoes_categoria,
+    "tipo": Operacoes.operacoes_tipo,
+}
+
+
+def _centavos_do_tipo(tipo: int):
+    return func.sum(
+        case(
+            (
+                Operacoes.operacoes_tipo == tipo,
+                func.round(Operacoes.operacoes_valor * 100),
+            ),
+            else_=0,
+        )
+    )
+
+
+# {chave: (receitas, despesas, quantidade)}, em centavos, pelo banco
+def agrupado_no_banco(agrupar) -> dict:
+    colunas = [AGRUPAMENTOS_SQL[nome] for nome in agrupar]
+    return {
+        tuple(linha[: len(colunas)]): (int(linha[-3]), int(linha[-2]), linha[-1])
+        for linha in db.session.execute(
+            select(
+                *colunas,
+                _centavos_do_tipo(TIPO_RECEITA),
+                _centavos_do_tipo(TIPO_DESPESA),
+                func.count(),
+            ).group_by(*colunas)
+        )
+    }
+
+
+# O mesmo, pela cópia colunar
+def agrupado_na_copia(agrupar) -> dict:
+    return {
+        tuple(grupo[nome] for nome in agrupar): (
+            int(Decimal(grupo["receitas"]) * 100),
+            int(Decimal(grupo["despesas"]) * 100),
+            grupo["quantidade"],
+        )
+        for grupo in colunar.resumir(agrupar)
+    }
+
+
+def conferir() -> None:
+    for agrupar in (["conta"], ["mes", "conta"], ["subcategoria", "tipo"], []):
+        assert agrupado_na_copia(agrupar) == agrupado_no_banco(agrupar), agrupar
+
+
+def lancamento(dia: str, valor: str, conta: int = 1, tipo: int = 2) -> dict:
+    return {
+        "operacoes_tipo": tipo,
+        "operacoes_descricao": "Mercado",
+        "operacoes_data": dia,
+        "operacoes_valor": valor,
+        "contas_bancarias_id": conta,
+        "subcategorias_id": 1,
+    }
+
+
+def test_copia_acompanha_o_banco(cliente, referencias_basicas, copia_colunar):
+    inserir_operacoes(500)
+    conferir()
+
+    ids = []
+    for dia, valor, tipo in (
+        ("2024-03-05", "12.34", 2),
+        ("2024-03-06", "99.99", 1),
+        ("2025-01-01", "0.01", 2),
+    ):
+        resposta = cliente.post("/lancamentos", json=lancamento(dia, valor, tipo=tipo))
+        assert resposta.status_code == 201
+        ids.append(resposta.get_json()["id"])
+    conferir()
+
+    resposta = cliente.put(
+        f"/lancamentos/{ids[0]}",
+        json={"operacoes_valor": "50.00", "contas_bancarias_id": 2},
+    )
+    assert resposta.status_code == 200
+    assert cliente.delete(f"/lancamentos/{ids[1]}").status_code == 200
+    resposta = cliente.post(
+        "/lancamentos/batch",
+        json={
+            "operacoes": [
+                {"acao": "atualizar", "id": ids[2], "operacoes_data": "2024-12-31"},
+                {"acao": "criar", **lancamento("2024-07-01", "7.00", conta=2)},
+            ]
+        },
+    )
+    assert resposta.status_code == 200
+    conferir()
+
+    # Tudo depois da carga veio pelo registro de alterações
+    estatisticas = copia_colunar.estatisticas()
+    assert estatisticas["cargas"] == 1
+    assert estatisticas["atualizacoes"] == 2
+    assert estatisticas["linhas"] == 500 + 3
+
+
+def test_alteracao_dentro_da_margem_e_relida(
+    cliente, referencias_basicas, copia_colunar, monkeypatch
+):
+    inserir_operacoes(50)
+    conferir()
+    token = copia_colunar.estatisticas()["token"]
+
+    # Ainda dentro da margem: aplicada, mas o token não passa dela
+    monkeypatch.setattr(colunar, "MARGEM_SINCRONIZACAO", timedelta(hours=1))
+    resposta = cliente.post("/lancamentos", json=lancamento("2024-02-02", "3.00"))
+    assert resposta.status_code == 201
+    conferir()
+    assert copia_colunar.estatisticas()["token"] == token
+
+    # Fora da margem: relida (sem contar em dobro) e o token avança
+    monkeypatch.setattr(colunar, "MARGEM_SINCRONIZACAO", timedelta(0))
+    conferir()
+    assert copia_colunar.estatisticas()["token"] > token
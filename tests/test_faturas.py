@@ -0,0 +1,155 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from faturas import _fatura_aberta, valor_na_fatura
+from models import db, Cartoes, ContasBancarias, FaturasCartoes, Operacoes
+from saldos import verificar_saldos_diarios
+
+
+# Cartão 1, atrelado à conta 1, que fecha no dia 10 e vence no dia 20
+@pytest.fixture
+def cartao(referencias_basicas):
+    db.session.execute(
+        update(ContasBancarias)
+        .where(ContasBancarias.idcontas_bancarias == 1)
+        .values(contas_cartao_fechamento=10, contas_prev_debito=20)
+    )
+    db.session.add(Cartoes(cartoes_id=1, cartoes_nome="Cartão", cartoes_atrelado=1))
+    db.session.commit()
+    return 1
+
+
+def comprar(cliente, dia: str, valor: str) -> int:
+    resposta = cliente.post(
+        "/lancamentos",
+        json={
+            "operacoes_tipo": 2,
+            "operacoes_descricao": f"Compra de {dia}",
+            "operacoes_data": dia,
+            "operacoes_valor": valor,
+            "contas_bancarias_id": 1,
+            "subcategorias_id": 1,
+            "operacoes_cartao_atrelado": 1,
+        },
+    )
+    assert resposta.status_code == 201, resposta.get_json()
+    return resposta.get_json()["id"]
+
+
+# {fatura: (fechamento, fechada, valor gravado)}
+def faturas_gravadas() -> dict:
+    return {
+        fatura_id: (fechamento, bool(fechada), valor)
+        for fatura_id, fechamento, fechada, valor in db.session.execute(
+            select(
+                FaturasCartoes.faturasCartoesId,
+                FaturasCartoes.faturasCartoesFechamento,
+                FaturasCartoes.faturasCartoesFechado,
+                FaturasCartoes.faturasCartoesValor,
+            )
+        )
+    }
+
+
+# Valor de cada fatura somando as compras dela
+def totais_das_compras() -> dict:
+    totais = {}
+    for fatura_id, tipo, valor in db.session.execute(
+        select(
+            Operacoes.operacoes_fatura,
+            Operacoes.operacoes_tipo,
+            Operacoes.operacoes_valor,
+        ).where(Operacoes.operacoes_fatura.isnot(None))
+    ):
+        totais[fatura_id] = totais.get(fatura_id, Decimal(0)) + valor_na_fatura(
+            tipo, valor
+        )
+    return totais
+
+
+def test_fatura_do_periodo_nao_se_repete(cliente, cartao):
+    primeira = _fatura_aberta(cartao, date(2024, 1, 5), (10, 20), {})
+    # Outra requisição que não viu a fatura criada usa a mesma
+    assert _fatura_aberta(cartao, date(2024, 1, 9), (10, 20), {}) == primeira
+    assert db.session.scalar(select(func.count()).select_from(FaturasCartoes)) == 1
+    db.session.commit()
+
+    resposta = cliente.post(
+        f"/cartoes/{cartao}/faturas",
+        json={
+            "faturasCartoesFechamento": "2024-01-10",
+            "faturasCartoesDtVencimento": "2024-01-20",
+        },
+    )
+    assert resposta.status_code == 409
+    db.session.add(
+        FaturasCartoes(
+            faturasCartoesVinculado=cartao,
+            faturasCartoesFechamento=date(2024, 1, 10),
+        )
+    )
+    with pytest.raises(IntegrityError):
+        db.session.flush()
+    db.session.rollback()
+
+
+def test_fatura_fechada_nao_muda(cliente, cartao):
+    compra = comprar(cliente, "2024-01-05", "100.00")
+    comprar(cliente, "2024-01-08", "50.00")
+    resposta = cliente.post("/cartoes/faturas/fechar?ate=2024-01-10")
+    assert resposta.get_json()["faturas_fechadas"] == 1
+    antes = faturas_gravadas()
+    assert [v for _, fechada, v in antes.values() if fechada] == [Decimal("150.00")]
+
+    # Valor, data e exclusão mudariam a fatura fechada
+    for metodo, corpo in (
+        ("put", {"operacoes_valor": "120.00"}),
+        ("put", {"operacoes_data": "2024-01-15"}),
+        ("delete", None),
+    ):
+        resposta = getattr(cliente, metodo)(f"/lancamentos/{compra}", json=corpo)
+        assert resposta.status_code == 409
+        assert faturas_gravadas() == antes
+    assert db.session.get(Operacoes, compra).operacoes_valor == Decimal("100.00")
+
+    resposta = cliente.post(
+        "/lancamentos/batch",
+        json={
+            "operacoes": [
+                {"acao": "atualizar", "id": compra, "operacoes_efetivado": True},
+                {"acao": "atualizar", "id": compra + 1, "operacoes_valor": "1"},
+            ]
+        },
+    )
+    assert resposta.status_code == 400
+    assert [e["indice"] for e in resposta.get_json()["erros"]] == [1]
+
+    # Alterações que não mudam o valor passam
+    resposta = cliente.put(
+        f"/lancamentos/{compra}", json={"operacoes_descricao": "Mercado"}
+    )
+    assert resposta.status_code == 200
+    resposta = cliente.post(
+        "/lancamentos/batch",
+        json={
+            "operacoes": [
+                {"acao": "atualizar", "id": compra, "operacoes_efetivado": True}
+            ]
+        },
+    )
+    assert resposta.status_code == 200
+
+    # Compra nova do período fechado vai para a próxima fatura
+    comprar(cliente, "2024-01-06", "30.00")
+    depois = faturas_gravadas()
+    assert {k: v for k, v in depois.items() if k in antes} == antes
+    assert sorted((f, v) for f, _, v in depois.values()) == [
+        (date(2024, 1, 10), Decimal("150.00")),
+        (date(2024, 2, 10), Decimal("30.00")),
+    ]
+    assert {k: v for k, (_, _, v) in depois.items()} == totais_das_compras()
+    assert verificar_saldos_diarios() == []
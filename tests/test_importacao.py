@@ -0,0 +1,165 @@
+import io
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func, select
+
+from importacao import ErroLinha, _decimal, ler_csv
+from models import db, Operacoes
+
+
+@pytest.mark.parametrize(
+    "texto, esperado",
+    [
+        ("1234.56", "1234.56"),
+        ("1234,56", "1234.56"),
+        ("1.234,56", "1234.56"),
+        ("1,234.56", "1234.56"),
+        ("1.234.567", "1234567"),
+        ("1,234,567", "1234567"),
+        ("1.234.567,89", "1234567.89"),
+        ("-1.234,5", "-1234.5"),
+        (" 12,3 ", "12.3"),
+        ("0,123", "0.123"),
+        ("1234.567", "1234.567"),
+        ("42", "42"),
+    ],
+)
+def test_decimal_usa_o_ultimo_separador(texto, esperado):
+    assert _decimal(texto) == Decimal(esperado)
+
+
+@pytest.mark.parametrize(
+    "texto",
+    ["1.234", "1,234", "-12.345", "1.23.4", "12.345.67", "1.234,567.8", "abc", "nan"],
+)
+def test_decimal_recusa_valores_ambiguos_ou_invalidos(texto):
+    with pytest.raises(ErroLinha):
+        _decimal(texto)
+
+
+def test_ler_csv_descarta_bom():
+    arquivo = io.StringIO("\ufeffdata;descricao;valor\n2024-01-05;Mercado;1.234,56\n")
+    assert list(ler_csv(arquivo)) == [
+        (2, {"data": "2024-01-05", "descricao": "Mercado", "valor": "1.234,56"})
+    ]
+
+
+def test_importa_csv_com_bom(cliente, referencias_basicas):
+    conteudo = (
+        "\ufeffdata,descricao,valor,tipo\n"
+        '2024-01-05,Salário,"1,500.00",1\n'
+        '2024-01-06,Aluguel,"1,234",2\n'
+        "2024-01-07,Padaria,12.5,2\n"
+    )
+    resposta = cliente.post(
+        "/lancamentos/importar?conta=1&subcategoria=1",
+        data=conteudo.encode("utf-8"),
+        content_type="text/csv",
+    )
+    corpo = resposta.get_json()
+    assert resposta.status_code == 201, corpo
+    assert corpo["importados"] == 2
+    assert [erro["linha"] for erro in corpo["erros"]] == [3]
+
+    gravados = db.session.execute(
+        select(Operacoes.operacoes_descricao, Operacoes.operacoes_valor).order_by(
+            Operacoes.operacoes_data_lancamento
+        )
+    ).all()
+    assert gravados == [("Salário", Decimal("1500.00")), ("Padaria", Decimal("12.50"))]
+
+
+EXTRATO = (
+    "data;descricao;valor;tipo\n"
+    "2024-02-01;PAG*Padaria  São João;12,50;2\n"
+    "2024-02-02;Salário;1.500,00;1\n"
+    "2024-02-03;Mercado;230,10;2\n"
+)
+# O mesmo extrato em outro formato: datas, valores e descrições escritos de
+# outro jeito geram as mesmas impressões digitais
+EXTRATO_REESCRITO = (
+    "data,descricao,valor,tipo\n"
+    "01/02/2024,pag padaria sao joao,12.5,2\n"
+    '02/02/2024,SALARIO,"1,500.00",1\n'
+    "03/02/2024,mercado!,230.1,2\n"
+)
+
+
+def _importar(cliente, conteudo, duplicados="pular"):
+    return cliente.post(
+        f"/lancamentos/importar?conta=1&subcategoria=1&duplicados={duplicados}",
+        data=conteudo.encode("utf-8"),
+        content_type="text/csv",
+    )
+
+
+def _contar_operacoes():
+    return db.session.scalar(select(func.count()).select_from(Operacoes))
+
+
+def test_reimportacao_pula_duplicados(cliente, referencias_basicas):
+    assert _importar(cliente, EXTRATO).get_json()["importados"] == 3
+    assert _contar_operacoes() == 3
+
+    for conteudo in (EXTRATO, EXTRATO_REESCRITO):
+        resposta = _importar(cliente, conteudo)
+        corpo = resposta.get_json()
+        # Nada novo e nada errado: não é erro do cliente
+        assert resposta.status_code == 200
+        assert corpo["importados"] == 0
+        assert corpo["total_erros"] == 0
+        assert corpo["total_duplicados"] == 3
+        assert corpo["duplicados"] == [2, 3, 4]
+        assert _contar_operacoes() == 3
+
+    # Um lançamento criado pela API também conta como já existente
+    resposta = cliente.post(
+        "/lancamentos",
+        json={
+            "operacoes_tipo": 2,
+            "operacoes_descricao": "Farmácia",
+            "operacoes_data": "2024-02-04",
+            "operacoes_valor": "45.00",
+            "contas_bancarias_id": 1,
+            "subcategorias_id": 1,
+        },
+    )
+    assert resposta.status_code == 201
+    corpo = _importar(cliente, "data;descricao;valor;tipo\n04/02/2024;FARMACIA;45;2\n")
+    assert corpo.get_json()["total_duplicados"] == 1
+    assert _contar_operacoes() == 4
+
+
+def test_reimportacao_com_duplicados_importar(cliente, referencias_basicas):
+    _importar(cliente, EXTRATO)
+    corpo = _importar(cliente, EXTRATO_REESCRITO, "importar").get_json()
+    assert corpo["importados"] == 3
+    assert corpo["total_duplicados"] == 3
+
+    # Cada impressão digital aparece duas vezes, e só elas existem
+    repeticoes = db.session.execute(
+        select(Operacoes.operacoes_fingerprint, func.count()).group_by(
+            Operacoes.operacoes_fingerprint
+        )
+    ).all()
+    assert len(repeticoes) == 3
+    assert {quantidade for _, quantidade in repeticoes} == {2}
+
+
+def test_encoding_invalido(cliente, referencias_basicas):
+    for rota in ("/lancamentos/importar", "/tarefas/importar-lancamentos"):
+        resposta = cliente.post(
+            f"{rota}?conta=1&subcategoria=1&encoding=nope",
+            data=EXTRATO.encode(),
+            content_type="text/csv",
+        )
+        assert resposta.status_code == 400
+        assert resposta.get_json() == {"erro": "Encoding inválido"}
+    assert _contar_operacoes() == 0
+
+
+def test_importacao_so_com_erros_e_400(cliente, referencias_basicas):
+    resposta = _importar(cliente, "data;descricao;valor\nontem;Mercado;10\n")
+    assert resposta.status_code == 400
+    assert resposta.get_json()["total_erros"] == 1
@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+from conftest import contar_consultas, inserir_operacoes
+from models import db, Operacoes
+from saldos import verificar_saldos_diarios
+
+
+def _consultas_da_listagem(cliente):
+    with contar_consultas() as consultas:
+        resposta = cliente.get("/lancamentos?limit=1000")
+    assert resposta.status_code == 200
+    return len(consultas), resposta.get_json()["itens"]
+
+
+# A listagem faz o mesmo número de consultas com 10 e com 1000 lançamentos
+# (uma consulta com os joins, e não três por lançamento)
+def test_listagem_nao_cresce_com_as_linhas(cliente, referencias_basicas):
+    inserir_operacoes(10)
+    com_10, itens = _consultas_da_listagem(cliente)
+    assert len(itens) == 10
+
+    inserir_operacoes(990, inicio=10)
+    com_1000, itens = _consultas_da_listagem(cliente)
+    assert len(itens) == 1000
+    assert com_1000 == com_10
+
+
+def test_listagem_traz_conta_e_categoria(cliente, referencias_basicas):
+    inserir_operacoes(10)
+    itens = cliente.get("/lancamentos").get_json()["itens"]
+    com_subcategoria = next(i for i in itens if i["subcategoria"] is not None)
+    assert com_subcategoria["conta"]["nome"].startswith("Conta ")
+    assert com_subcategoria["subcategoria"]["categoria"] == "Casa"
+    sem_subcategoria = next(i for i in itens if i["subcategoria"] is None)
+    assert sem_subcategoria["id"] % 5 == 1
+
+
+def test_valor_invalido_e_recusado(cliente, referencias_basicas):
+    novo = {
+        "operacoes_tipo": 2,
+        "operacoes_descricao": "Mercado",
+        "operacoes_data": "2024-01-05",
+        "operacoes_valor": "10.00",
+        "contas_bancarias_id": 1,
+        "subcategorias_id": 1,
+    }
+    for valor in ("abc", "NaN", [10], True):
+        resposta = cliente.post("/lancamentos", json={**novo, "operacoes_valor": valor})
+        assert resposta.status_code == 400
+        assert resposta.get_json() == {"erro": "Valor inválido"}
+
+    lancamento_id = cliente.post("/lancamentos", json=novo).get_json()["id"]
+    for valor in ("abc", "Infinity", {"v": 1}):
+        resposta = cliente.put(
+            f"/lancamentos/{lancamento_id}", json={"operacoes_valor": valor}
+        )
+        assert resposta.status_code == 400
+    resposta = cliente.put(
+        f"/lancamentos/{lancamento_id}", json={"operacoes_valor": 12.5}
+    )
+    assert resposta.status_code == 200
+    assert db.session.get(Operacoes, lancamento_id).operacoes_valor == Decimal("12.50")
+    assert verificar_saldos_diarios() == []
@@ -0,0 +1,60 @@
+import pytest
+from sqlalchemy import select
+
+from models import db, Operacoes
+
+NOVO = {
+    "acao": "criar",
+    "operacoes_tipo": 2,
+    "operacoes_descricao": "Mercado",
+    "operacoes_data": "2024-01-05",
+    "operacoes_valor": "10.00",
+    "contas_bancarias_id": 1,
+    "subcategorias_id": 1,
+}
+
+
+def enviar(cliente, *itens):
+    return cliente.post("/lancamentos/batch", json={"operacoes": list(itens)})
+
+
+def test_efetivado_aceita_so_booleano(cliente, referencias_basicas):
+    resposta = enviar(
+        cliente,
+        {**NOVO, "operacoes_efetivado": True},
+        {**NOVO, "operacoes_efetivado": False},
+    )
+    assert resposta.status_code == 200, resposta.get_json()
+    assert db.session.scalars(
+        select(Operacoes.operacoes_efetivado).order_by(Operacoes.operacoes_id)
+    ).all() == [True, False]
+
+    for valor in ("false", "0", "não", 0, 1, None):
+        resposta = enviar(cliente, {**NOVO, "operacoes_efetivado": valor})
+        assert resposta.status_code == 400
+        assert [e["indice"] for e in resposta.get_json()["erros"]] == [0]
+
+
+@pytest.mark.parametrize(
+    "campos",
+    [
+        {"acao": "atualizar", "id": [1]},
+        {"acao": "atualizar", "id": {"a": 1}},
+        {"acao": "atualizar", "id": True},
+        {"operacoes_tipo": [2]},
+        {"operacoes_tipo": {"a": 2}},
+        {"operacoes_tipo": True},
+        {"contas_bancarias_id": [1]},
+        {"subcategorias_id": {"a": 1}},
+        {"operacoes_cartao_atrelado": [1]},
+        {"operacoes_valor": [10]},
+        {"operacoes_valor": "NaN"},
+        {"operacoes_data": ["2024-01-05"]},
+        {"operacoes_descricao": ["Mercado"]},
+    ],
+)
+def test_tipos_invalidos_viram_erro_do_item(cliente, referencias_basicas, campos):
+    resposta = enviar(cliente, NOVO, {**NOVO, "operacoes_valor": "1", **campos})
+    assert resposta.status_code == 400
+    assert [e["indice"] for e in resposta.get_json()["erros"]] == [1]
+    assert db.session.scalars(select(Operacoes.operacoes_id)).all() == []
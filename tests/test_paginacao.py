@@ -0,0 +1,73 @@
+from sqlalchemy import select
+
+from conftest import inserir_operacoes
+from models import db, Operacoes, TiposContas
+
+
+# Percorre a listagem pelo cursor até o fim e devolve os ids, em ordem
+def _percorrer(cliente, rota: str, limite: int, filtros: str = "", cursor=None):
+    ids = []
+    while True:
+        url = f"{rota}?limit={limite}{filtros}"
+        if cursor is not None:
+            url += f"&after={cursor}"
+        corpo = cliente.get(url).get_json()
+        assert len(corpo["itens"]) <= limite
+        ids += [item["id"] for item in corpo["itens"]]
+        cursor = corpo["next_cursor"]
+        if cursor is None:
+            return ids
+
+
+def test_cursor_percorre_todos_os_lancamentos(cliente, referencias_basicas):
+    inserir_operacoes(50)
+    esperados = db.session.scalars(
+        select(Operacoes.operacoes_id).order_by(Operacoes.operacoes_id)
+    ).all()
+    assert _percorrer(cliente, "/lancamentos", 7) == esperados
+    # Página exata: a última não deixa cursor para uma página vazia
+    assert _percorrer(cliente, "/lancamentos", 10) == esperados
+
+
+def test_cursor_com_filtros(cliente, referencias_basicas):
+    inserir_operacoes(50)
+    esperados = db.session.scalars(
+        select(Operacoes.operacoes_id)
+        .where(
+            Operacoes.operacoes_conta == 1,
+            Operacoes.operacoes_efetivado.is_(True),
+        )
+        .order_by(Operacoes.operacoes_id)
+    ).all()
+    filtros = "&operacoes_conta=1&operacoes_efetivado=true"
+    assert _percorrer(cliente, "/lancamentos", 4, filtros) == esperados
+
+
+# Lançamentos incluídos durante a paginação aparecem no fim, sem repetir nem
+# pular os já vistos
+def test_cursor_estavel_com_insercoes(cliente, referencias_basicas):
+    inserir_operacoes(20)
+    primeira = cliente.get("/lancamentos?limit=5").get_json()
+    inserir_operacoes(3, inicio=20)
+    restantes = _percorrer(cliente, "/lancamentos", 5, cursor=primeira["next_cursor"])
+    ids = [item["id"] for item in primeira["itens"]] + restantes
+    assert ids == list(range(1, 24))
+
+
+# Listagens servidas do cache de referências seguem o mesmo cursor
+def test_cursor_das_referencias(cliente, referencias_basicas):
+    for nome in ("Poupança", "Investimento", "Cartão", "Carteira"):
+        resposta = cliente.post("/tipos-contas", json={"tipos_contas": nome})
+        assert resposta.status_code == 201
+    esperados = db.session.scalars(
+        select(TiposContas.idtipos_contas).order_by(TiposContas.idtipos_contas)
+    ).all()
+    assert len(esperados) == 5
+    assert _percorrer(cliente, "/tipos-contas", 2) == esperados
+
+
+def test_parametros_invalidos(cliente, referencias_basicas):
+    assert cliente.get("/lancamentos?limit=0").status_code == 400
+    assert cliente.get("/lancamentos?after=abc").status_code == 400
+    corpo = cliente.get("/lancamentos?limit=5000").get_json()
+    assert corpo["next_cursor"] is None
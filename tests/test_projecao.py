@@ -0,0 +1,114 @@
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import update
+
+from models import db, Cartoes, ContasBancarias
+from projecao import projetar_saldos, projetar_saldos_async
+from test_recorrencias import criar_regra, gerar
+
+HOJE = date(2024, 3, 15)
+MESES = 3
+
+
+# Conta 1 com cartão: fecha no dia 25 e vence no dia 10 do mês seguinte.
+# A conta 2 fica fora do consolidado.
+@pytest.fixture
+def contas(referencias_basicas):
+    db.session.execute(
+        update(ContasBancarias)
+        .where(ContasBancarias.idcontas_bancarias == 1)
+        .values(contas_cartao_fechamento=25, contas_prev_debito=10)
+    )
+    db.session.execute(
+        update(ContasBancarias)
+        .where(ContasBancarias.idcontas_bancarias == 2)
+        .values(contas_desconsiderar_saldo=True)
+    )
+    db.session.add(Cartoes(cartoes_id=1, cartoes_nome="Cartão", cartoes_atrelado=1))
+    db.session.commit()
+
+
+def lancar(cliente, dia, valor, tipo=2, conta=1, efetivado=None, cartao=None):
+    dados = {
+        "operacoes_tipo": tipo,
+        "operacoes_descricao": f"Lançamento de {dia}",
+        "operacoes_data": dia,
+        "operacoes_valor": valor,
+        "contas_bancarias_id": conta,
+        "subcategorias_id": 1,
+    }
+    if efetivado is not None:
+        dados["operacoes_efetivado"] = efetivado
+    if cartao is not None:
+        dados["operacoes_cartao_atrelado"] = cartao
+    resposta = cliente.post("/lancamentos", json=dados)
+    assert resposta.status_code == 201, resposta.get_json()
+
+
+# {conta: [(movimento, saldo) por mês]}
+def por_conta(projecao) -> dict:
+    return {
+        conta["conta"]: [(m["movimento"], m["saldo"]) for m in conta["meses"]]
+        for conta in projecao["contas"]
+    }
+
+
+def test_projecao_soma_cada_fonte_no_mes_certo(cliente, contas):
+    # Saldo de abertura: só o efetivado até 29/02
+    lancar(cliente, "2024-02-01", "1000.00", tipo=1, efetivado=True)
+    lancar(cliente, "2024-02-15", "20.00", conta=2, efetivado=True)
+    # Pendente de antes do período: entra em março
+    lancar(cliente, "2024-02-10", "50.00")
+    # Fatura atrasada (venceu em 10/02 e segue aberta): fica em março
+    lancar(cliente, "2024-01-05", "30.00", cartao=1)
+    # Compra de fevereiro na fatura que vence em 10/04: sai de março
+    lancar(cliente, "2024-02-27", "40.00", cartao=1)
+    # Lançamentos do período
+    lancar(cliente, "2024-03-20", "100.00")
+    lancar(cliente, "2024-04-05", "500.00", tipo=1)
+    lancar(cliente, "2024-05-02", "300.00", tipo=1, conta=2)
+    # Compras do período contam no vencimento; a de 28/05 vence depois do fim
+    lancar(cliente, "2024-03-28", "60.00", cartao=1)
+    lancar(cliente, "2024-05-28", "70.00", cartao=1)
+    # Regra mensal de 80,00 a partir de 31/01: a operação modelo é pendente
+    # de antes do período; nenhuma ocorrência foi gerada ainda e elas caem
+    # em 29/02 (pendente, entra em março), 31/03, 30/04 e 31/05
+    criar_regra(cliente, "2024-01-31")
+
+    projecao = projetar_saldos(HOJE, MESES)
+    assert (projecao["inicio"], projecao["fim"]) == ("2024-03-01", "2024-05-31")
+    assert [c["saldo_abertura"] for c in projecao["contas"]] == ["1100.00", "180.00"]
+    assert por_conta(projecao) == {
+        # Março: -50 - 30 - 80 (modelo) - 80 (29/02) - 100 - 80 (31/03)
+        # Abril: -40 (fatura atrasada) + 500 - 80 (30/04)
+        # Maio: -60 (compra de 28/03) - 80 (31/05)
+        1: [("-420.00", "680.00"), ("380.00", "1060.00"), ("-140.00", "920.00")],
+        2: [("0.00", "180.00"), ("0.00", "180.00"), ("300.00", "480.00")],
+    }
+    assert projecao["consolidado"] == [
+        {"mes": "2024-03", "saldo": "680.00"},
+        {"mes": "2024-04", "saldo": "1060.00"},
+        {"mes": "2024-05", "saldo": "920.00"},
+    ]
+
+    # Gerar as ocorrências até março não muda a projeção
+    assert gerar(cliente, "2024-03-31")["lancamentos"] == 2
+    assert projetar_saldos(HOJE, MESES) == projecao
+
+
+def test_projecao_async_igual_a_sincrona(cliente, contas):
+    lancar(cliente, "2024-02-01", "1000.00", tipo=1, efetivado=True)
+    lancar(cliente, "2024-02-10", "50.00")
+    lancar(cliente, "2024-02-27", "40.00", cartao=1)
+    lancar(cliente, "2024-04-05", "500.00", tipo=1, conta=2)
+    criar_regra(cliente, "2024-01-31")
+
+    # Executor síncrono: roda cada consulta na sessão do teste
+    async def executar(consulta):
+        return db.session.execute(consulta).all()
+
+    esperado = projetar_saldos(HOJE, MESES)
+    assert asyncio.run(projetar_saldos_async(executar, HOJE, MESES)) == esperado
+    assert por_conta(esperado)[1][1] == ("-120.00", "690.00")
@@ -0,0 +1,95 @@
+from datetime import date
+
+from sqlalchemy import select
+
+from models import db, Operacoes, Recorrencias
+from saldos import verificar_saldos_diarios
+
+
+# Cria a operação modelo e a regra pela API; devolve o id da regra
+def criar_regra(cliente, inicio: str, frequencia="mensal", dias_uteis=None) -> int:
+    resposta = cliente.post(
+        "/lancamentos",
+        json={
+            "operacoes_tipo": 2,
+            "operacoes_descricao": f"Conta de {inicio}",
+            "operacoes_data": inicio,
+            "operacoes_valor": "80.00",
+            "contas_bancarias_id": 1,
+            "subcategorias_id": 1,
+        },
+    )
+    assert resposta.status_code == 201
+    resposta = cliente.post(
+        "/regras-recorrencia",
+        json={
+            "operacao_id": resposta.get_json()["id"],
+            "frequencia": frequencia,
+            "data_inicio": inicio,
+            "dias_uteis": dias_uteis,
+        },
+    )
+    assert resposta.status_code == 201
+    return resposta.get_json()["id"]
+
+
+def gerar(cliente, ate: str) -> dict:
+    resposta = cliente.post(f"/regras-recorrencia/gerar?ate={ate}")
+    assert resposta.status_code == 200
+    return resposta.get_json()
+
+
+def datas_geradas(regra: int) -> list:
+    return db.session.scalars(
+        select(Operacoes.operacoes_data_lancamento)
+        .where(Operacoes.operacoes_recorrencia == regra)
+        .order_by(Operacoes.operacoes_data_lancamento)
+    ).all()
+
+
+def test_mensal_limita_ao_ultimo_dia_do_mes(cliente, referencias_basicas):
+    regra = criar_regra(cliente, "2024-01-31")
+    assert gerar(cliente, "2024-05-31")["lancamentos"] == 4
+    # Fevereiro fica no dia 29 e março volta ao dia 31
+    esperadas = [
+        date(2024, 2, 29),
+        date(2024, 3, 31),
+        date(2024, 4, 30),
+        date(2024, 5, 31),
+    ]
+    assert datas_geradas(regra) == esperadas
+
+    # Rodar de novo com a mesma data não gera nada
+    assert gerar(cliente, "2024-05-31")["lancamentos"] == 0
+    assert datas_geradas(regra) == esperadas
+    assert db.session.get(Recorrencias, regra).ultimo_lancamento == date(2024, 5, 31)
+
+    assert gerar(cliente, "2024-06-30")["lancamentos"] == 1
+    assert datas_geradas(regra)[-1] == date(2024, 6, 30)
+    assert verificar_saldos_diarios() == []
+
+
+def test_dias_uteis_avanca_fins_de_semana_e_feriados(cliente, referencias_basicas):
+    # 12/02 e 13/02/2024 são Carnaval; 12/05 é domingo
+    carnaval = criar_regra(cliente, "2024-01-12", dias_uteis=1)
+    # 01/05 é feriado, 01/06/2024 é sábado
+    feriado = criar_regra(cliente, "2024-04-01", dias_uteis=1)
+    sem_ajuste = criar_regra(cliente, "2024-04-01")
+
+    # A ocorrência nominal de 01/06 cai na segunda, 03/06
+    assert gerar(cliente, "2024-06-01")["lancamentos"] == 8
+    assert datas_geradas(carnaval) == [
+        date(2024, 2, 14),
+        date(2024, 3, 12),
+        date(2024, 4, 12),
+        date(2024, 5, 13),
+    ]
+    assert datas_geradas(feriado) == [date(2024, 5, 2), date(2024, 6, 3)]
+    assert datas_geradas(sem_ajuste) == [date(2024, 5, 1), date(2024, 6, 1)]
+
+    # ultimo_lancamento guarda a data nominal: junho não é gerado de novo
+    assert db.session.get(Recorrencias, feriado).ultimo_lancamento == date(2024, 6, 1)
+    assert gerar(cliente, "2024-06-12")["lancamentos"] == 1
+    assert datas_geradas(feriado) == [date(2024, 5, 2), date(2024, 6, 3)]
+    assert datas_geradas(carnaval)[-1] == date(2024, 6, 12)
+    assert verificar_saldos_diarios() == []
@@ -0,0 +1,123 @@
+from sqlalchemy import insert, select, update
+
+import referencias
+from conftest import contar_consultas
+from models import db, Categorias, ContasBancarias, VersoesReferencias
+
+
+# Grava direto no banco, como outro worker faria: o cache deste processo não
+# é invalidado
+def criar_conta_em_outro_worker(conta: int) -> None:
+    db.session.execute(
+        insert(ContasBancarias).values(
+            idcontas_bancarias=conta, nome_conta=f"Conta {conta}", tipo_conta=1
+        )
+    )
+    db.session.commit()
+
+
+def lancamento(conta: int) -> dict:
+    return {
+        "operacoes_tipo": 2,
+        "operacoes_descricao": "Mercado",
+        "operacoes_data": "2024-01-05",
+        "operacoes_valor": "10.00",
+        "contas_bancarias_id": conta,
+        "subcategorias_id": 1,
+    }
+
+
+def test_conta_criada_em_outro_worker_e_aceita(cliente, referencias_basicas):
+    # Cache quente, sem a conta 3
+    assert cliente.get("/contas-bancarias/3").status_code == 404
+    assert len(cliente.get("/contas-bancarias").get_json()["itens"]) == 2
+    criar_conta_em_outro_worker(3)
+
+    assert cliente.post("/lancamentos", json=lancamento(3)).status_code == 201
+    assert cliente.get("/contas-bancarias/3").get_json()["nome"] == "Conta 3"
+    assert len(cliente.get("/contas-bancarias").get_json()["itens"]) == 3
+
+    criar_conta_em_outro_worker(4)
+    resposta = cliente.post(
+        "/lancamentos/batch",
+        json={"operacoes": [{"acao": "criar", **lancamento(4)}]},
+    )
+    assert resposta.status_code == 200, resposta.get_json()
+
+    criar_conta_em_outro_worker(5)
+    resposta = cliente.post(
+        "/lancamentos/importar?conta=5&subcategoria=1",
+        data="data;descricao;valor\n2024-01-05;Mercado;-10,00\n".encode(),
+        content_type="text/csv",
+    )
+    assert resposta.status_code == 201, resposta.get_json()
+
+
+def test_categoria_criada_em_outro_worker(cliente, referencias_basicas):
+    assert cliente.get("/categorias/2").status_code == 404
+    db.session.execute(
+        insert(Categorias).values(
+            categorias_id=2, categorias_nome="Lazer", categorias_classe=1
+        )
+    )
+    db.session.commit()
+    assert cliente.get("/categorias/2").get_json()["nome"] == "Lazer"
+    assert cliente.get("/categorias/2/subcategorias").get_json() == []
+
+
+def test_id_inexistente_continua_recusado(cliente, referencias_basicas):
+    assert cliente.post("/lancamentos", json=lancamento(99)).status_code == 404
+    assert cliente.post("/lancamentos", json=lancamento("1")).status_code == 404
+    assert cliente.post("/lancamentos", json=lancamento(True)).status_code == 404
+
+    # Na importação, a conta que falta é conferida no banco uma vez só
+    linhas = "".join(f"2024-01-0{dia};Mercado;-10,00;99\n" for dia in range(1, 6))
+    with contar_consultas() as consultas:
+        resposta = cliente.post(
+            "/lancamentos/importar?subcategoria=1",
+            data=("data;descricao;valor;conta\n" + linhas).encode(),
+            content_type="text/csv",
+        )
+    corpo = resposta.get_json()
+    assert resposta.status_code == 400
+    assert corpo["total_erros"] == 5
+    assert sum("FROM contas_bancarias" in c for c in consultas) == 1
+
+
+def test_etag_muda_com_alteracao_de_outro_worker(
+    cliente, referencias_basicas, monkeypatch
+):
+    monkeypatch.setattr(referencias.versoes_compartilhadas, "intervalo", 0)
+    etag = cliente.get("/contas-bancarias").headers["ETag"]
+    resposta = cliente.get("/contas-bancarias", headers={"If-None-Match": etag})
+    assert resposta.status_code == 304
+
+    # Outro worker renomeia a conta e sobe a versão compartilhada
+    db.session.execute(
+        update(ContasBancarias)
+        .where(ContasBancarias.idcontas_bancarias == 1)
+        .values(nome_conta="Carteira")
+    )
+    db.session.commit()
+    referencias.VersoesCompartilhadas(0).publicar(["contas_bancarias"])
+
+    resposta = cliente.get("/contas-bancarias", headers={"If-None-Match": etag})
+    assert resposta.status_code == 200
+    assert resposta.headers["ETag"] != etag
+    assert resposta.get_json()["itens"][0]["nome"] == "Carteira"
+    assert cliente.get("/contas-bancarias/1").get_json()["nome"] == "Carteira"
+
+
+def test_alteracao_pela_api_sobe_a_versao(cliente, referencias_basicas):
+    for nome in ("Poupança", "Investimento"):
+        resposta = cliente.post("/tipos-contas", json={"tipos_contas": nome})
+        assert resposta.status_code == 201
+    versoes = dict(
+        db.session.execute(
+            select(
+                VersoesReferencias.versoes_referencias_tabela,
+                VersoesReferencias.versoes_referencias_versao,
+            )
+        ).all()
+    )
+    assert versoes == {"tipos_contas": 2}
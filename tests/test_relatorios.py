@@ -0,0 +1,61 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import insert
+
+from models import db, Operacoes
+
+
+@pytest.fixture
+def lancamentos(referencias_basicas):
+    db.session.execute(
+        insert(Operacoes),
+        [
+            {
+                "operacoes_data_lancamento": dia,
+                "operacoes_descricao": "Lançamento",
+                "operacoes_conta": 1,
+                "operacoes_valor": valor,
+                "operacoes_tipo": tipo,
+                "operacoes_categoria": 1,
+            }
+            for dia, valor, tipo in (
+                (date(2024, 1, 10), "100.00", 1),
+                (date(2024, 2, 10), "30.00", 2),
+                (None, "7.50", 2),
+                (None, "2.00", 1),
+            )
+        ],
+    )
+    db.session.commit()
+
+
+def periodos(cliente, agrupamento: str) -> list:
+    resposta = cliente.get(f"/relatorios/categorias?agrupamento={agrupamento}")
+    assert resposta.status_code == 200, resposta.get_json()
+    return [(p["periodo"], p["total"]) for p in resposta.get_json()["periodos"]]
+
+
+def totais(receitas: str, despesas: str, saldo: str, quantidade: int) -> dict:
+    return {
+        "receitas": receitas,
+        "despesas": despesas,
+        "saldo": saldo,
+        "quantidade": quantidade,
+    }
+
+
+def test_lancamentos_sem_data_ficam_num_periodo_a_parte(cliente, lancamentos):
+    sem_data = (None, totais("2.00", "7.50", "-5.50", 2))
+    assert periodos(cliente, "mes") == [
+        ("2024-01", totais("100.00", "0.00", "100.00", 1)),
+        ("2024-02", totais("0.00", "30.00", "-30.00", 1)),
+        sem_data,
+    ]
+    assert periodos(cliente, "ano") == [
+        ("2024", totais("100.00", "30.00", "70.00", 2)),
+        sem_data,
+    ]
+    assert periodos(cliente, "total") == [
+        ("total", totais("102.00", "37.50", "64.50", 4))
+    ]
@@ -0,0 +1,146 @@
+from decimal import Decimal
+
+from sqlalchemy import func, select, update
+
+from models import db, ContasBancarias, Operacoes, SaldosDiarios
+from saldos import SINAIS_TIPOS_OPERACOES, verificar_saldos_diarios
+
+# (conta, data, tipo, valor, efetivado)
+LANCAMENTOS = [
+    (1, "2024-01-05", 1, "1000.00", True),
+    (1, "2024-01-10", 2, "250.50", True),
+    (1, "2024-02-01", 2, "99.90", False),
+    (2, "2024-01-15", 1, "10.00", False),
+    (2, "2024-03-01", 2, "5.25", True),
+    (1, "2023-12-31", 1, "0.10", True),
+]
+
+
+def criar_lancamentos(cliente, lancamentos=LANCAMENTOS) -> list:
+    ids = []
+    for conta, dia, tipo, valor, efetivado in lancamentos:
+        resposta = cliente.post(
+            "/lancamentos",
+            json={
+                "operacoes_tipo": tipo,
+                "operacoes_descricao": f"Lançamento de {dia}",
+                "operacoes_data": dia,
+                "operacoes_valor": valor,
+                "contas_bancarias_id": conta,
+                "subcategorias_id": 1,
+                "operacoes_efetivado": efetivado,
+            },
+        )
+        assert resposta.status_code == 201, resposta.get_json()
+        ids.append(resposta.get_json()["id"])
+    return ids
+
+
+# Saldo de cada conta somando os lançamentos do banco em Python
+def saldos_esperados(ate=None, somente_efetivados=False) -> dict:
+    saldos = {
+        conta: Decimal(inicial or 0)
+        for conta, inicial in db.session.execute(
+            select(
+                ContasBancarias.idcontas_bancarias,
+                ContasBancarias.conta_saldo_inicial,
+            )
+        )
+    }
+    for conta, dia, tipo, valor, efetivado in db.session.execute(
+        select(
+            Operacoes.operacoes_conta,
+            Operacoes.operacoes_data_lancamento,
+            Operacoes.operacoes_tipo,
+            Operacoes.operacoes_valor,
+            Operacoes.operacoes_efetivado,
+        )
+    ):
+        if ate is not None and dia.isoformat() > ate:
+            continue
+        if somente_efetivados and not efetivado:
+            continue
+        saldos[conta] += SINAIS_TIPOS_OPERACOES.get(tipo, 0) * Decimal(valor)
+    return saldos
+
+
+def test_saldos_de_todas_as_contas(cliente, referencias_basicas):
+    criar_lancamentos(cliente)
+    for parametros, ate, efetivados in (
+        ("", None, False),
+        ("?ate=2024-01-31", "2024-01-31", False),
+        ("?efetivados=true", None, True),
+        ("?ate=2024-01-12&efetivados=true", "2024-01-12", True),
+        ("?ate=2023-01-01", "2023-01-01", False),
+    ):
+        corpo = cliente.get(f"/contas-bancarias/saldos{parametros}").get_json()
+        esperados = saldos_esperados(ate, efetivados)
+        assert {c["id"]: Decimal(c["saldo"]) for c in corpo["contas"]} == esperados
+        assert Decimal(corpo["saldo_total"]) == sum(esperados.values())
+
+
+def test_saldo_de_uma_conta(cliente, referencias_basicas):
+    criar_lancamentos(cliente)
+    corpo = cliente.get("/contas-bancarias/1/saldo?ate=2024-01-10").get_json()
+    assert Decimal(corpo["saldo"]) == saldos_esperados("2024-01-10")[1]
+    assert corpo["ate"] == "2024-01-10"
+    assert cliente.get("/contas-bancarias/99/saldo").status_code == 404
+
+
+def test_saldo_total_ignora_contas_desconsideradas(cliente, referencias_basicas):
+    criar_lancamentos(cliente)
+    db.session.execute(
+        update(ContasBancarias)
+        .where(ContasBancarias.idcontas_bancarias == 2)
+        .values(contas_desconsiderar_saldo=1)
+    )
+    db.session.commit()
+    corpo = cliente.get("/contas-bancarias/saldos").get_json()
+    assert Decimal(corpo["saldo_total"]) == saldos_esperados()[1]
+    assert [c["desconsiderar_saldo"] for c in corpo["contas"]] == [False, True]
+
+
+def test_saldos_diarios_acompanham_post_put_delete(cliente, referencias_basicas):
+    ids = criar_lancamentos(cliente)
+    assert verificar_saldos_diarios() == []
+
+    # Muda valor, data (para antes de um dia já existente), conta e efetivado
+    for lancamento_id, alteracao in (
+        (ids[0], {"operacoes_valor": "1200.00"}),
+        (ids[1], {"operacoes_data": "2023-12-30"}),
+        (ids[2], {"contas_bancarias_id": 2, "operacoes_efetivado": True}),
+        (ids[3], {"operacoes_data": "2024-04-01", "operacoes_tipo": 2}),
+    ):
+        resposta = cliente.put(f"/lancamentos/{lancamento_id}", json=alteracao)
+        assert resposta.status_code == 200, resposta.get_json()
+        assert verificar_saldos_diarios() == []
+
+    for lancamento_id in (ids[4], ids[0]):
+        assert cliente.delete(f"/lancamentos/{lancamento_id}").status_code == 200
+        assert verificar_saldos_diarios() == []
+
+    corpo = cliente.get("/contas-bancarias/saldos").get_json()
+    assert {c["id"]: Decimal(c["saldo"]) for c in corpo["contas"]} == (
+        saldos_esperados()
+    )
+
+
+def test_conta_com_lancamentos_pode_ser_excluida(
+    cliente, referencias_basicas, chaves_estrangeiras
+):
+    criar_lancamentos(cliente)
+    assert db.session.scalar(
+        select(func.count()).select_from(SaldosDiarios)
+    ), "a conta precisa ter saldos diários"
+
+    assert cliente.delete("/contas-bancarias/1").status_code == 200
+    assert db.session.get(ContasBancarias, 1) is None
+    assert (
+        db.session.scalar(
+            select(func.count())
+            .select_from(SaldosDiarios)
+            .where(SaldosDiarios.saldos_diarios_conta == 1)
+        )
+        == 0
+    )
+    assert verificar_saldos_diarios() == []
@@ -0,0 +1,41 @@
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+from app import LANCAMENTO_JSON
+from serializacao import Campo, Objeto, Serializador
+
+
+def test_serializador_monta_objetos_aninhados():
+    serializador = Serializador(
+        Campo("id", None),
+        Objeto("conta", Campo("id", None), Campo("nome", None)),
+        Objeto("cartao", Campo("id", None)),
+        Campo("valor", None),
+    )
+    assert serializador((1, 2, "Corrente", 3, "9.90")) == {
+        "id": 1,
+        "conta": {"id": 2, "nome": "Corrente"},
+        "cartao": {"id": 3},
+        "valor": "9.90",
+    }
+    assert serializador.lista([(1, None, None, None, "9.90")]) == [
+        {"id": 1, "conta": None, "cartao": None, "valor": "9.90"}
+    ]
+    assert list(serializador((1, None, None, None, 0))) == [
+        "id",
+        "conta",
+        "cartao",
+        "valor",
+    ]
+
+
+def test_json_igual_ao_do_provedor_padrao(app):
+    linha = (7, 2, "Mercado", None, None, 1, "Conta 1", None, None, None)
+    dados = {"itens": [LANCAMENTO_JSON(linha)], "proximo_cursor": None}
+    assert app.json.dumps(dados) == json.dumps(
+        dados, sort_keys=True, separators=(",", ":")
+    )
+    assert json.loads(app.json.dumps(dados)) == json.loads(
+        DefaultJSONProvider(app).dumps(dados)
+    )
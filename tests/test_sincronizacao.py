@@ -0,0 +1,73 @@
+from sqlalchemy import func, select
+
+from conftest import contar_consultas
+from models import db, Alteracoes, Operacoes
+from sincronizacao import registrar_alteracoes
+from test_recorrencias import criar_regra, gerar
+
+
+def registradas() -> list:
+    return db.session.execute(
+        select(Alteracoes.alteracoes_tabela, Alteracoes.alteracoes_registro).order_by(
+            Alteracoes.alteracoes_id
+        )
+    ).all()
+
+
+def test_registro_gravado_so_no_commit(app):
+    registrar_alteracoes(Operacoes, [1, 2, None])
+    assert registradas() == []
+    db.session.commit()
+    assert registradas() == [("operacoes", 1), ("operacoes", 2)]
+
+    # Transação desfeita não deixa nada pendente para a próxima
+    registrar_alteracoes(Operacoes, [3])
+    db.session.rollback()
+    db.session.commit()
+    assert len(registradas()) == 2
+
+
+def test_registro_e_o_ultimo_comando_da_transacao(cliente, referencias_basicas):
+    regra = criar_regra(cliente, "2024-01-10")
+    with contar_consultas() as consultas:
+        assert gerar(cliente, "2024-06-30")["lancamentos"] == 5
+    escritas = [
+        c for c in consultas if c.lstrip().split()[0] in ("INSERT", "UPDATE", "DELETE")
+    ]
+    assert escritas[-1].startswith("INSERT INTO alteracoes")
+
+    resposta = cliente.get("/sync?since=0").get_json()
+    gerados = db.session.scalars(
+        select(Operacoes.operacoes_id).where(Operacoes.operacoes_recorrencia == regra)
+    ).all()
+    assert len(gerados) == 5
+    sincronizados = {r["operacoes_id"] for r in resposta["alteracoes"]["lancamentos"]}
+    assert set(gerados) <= sincronizados
+    assert resposta["token"] == db.session.scalar(
+        select(func.max(Alteracoes.alteracoes_id))
+    )
+
+
+def test_exclusao_da_conta_registra_os_lancamentos_dela(cliente, referencias_basicas):
+    ids = []
+    for dia in (5, 6):
+        resposta = cliente.post(
+            "/lancamentos",
+            json={
+                "operacoes_tipo": 2,
+                "operacoes_descricao": "Mercado",
+                "operacoes_data": f"2024-01-0{dia}",
+                "operacoes_valor": "10.00",
+                "contas_bancarias_id": 2,
+                "subcategorias_id": 1,
+            },
+        )
+        ids.append(resposta.get_json()["id"])
+    token = cliente.get("/sync").get_json()["token"]
+
+    assert cliente.delete("/contas-bancarias/2").status_code == 200
+    resposta = cliente.get(f"/sync?since={token}").get_json()
+    assert (
+        sorted(r["operacoes_id"] for r in resposta["alteracoes"]["lancamentos"]) == ids
+    )
+    assert resposta["removidos"]["contas_bancarias"] == [2]
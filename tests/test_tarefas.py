@@ -0,0 +1,151 @@
+import io
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event, func, select, update
+
+import importacao
+import tarefas
+from models import db, Operacoes, Tarefas
+from tarefas import (
+    EXPIRACAO_TAREFAS,
+    MAXIMO_TENTATIVAS,
+    ExecucaoTarefa,
+    TarefaPerdida,
+    _reservar,
+    executar_proxima,
+)
+
+
+def enviar(cliente, tipo="fechar-faturas", **kwargs) -> int:
+    resposta = cliente.post(f"/tarefas/{tipo}", **kwargs)
+    assert resposta.status_code == 202, resposta.get_json()
+    return resposta.get_json()["id"]
+
+
+# (status, dono, tentativas) gravados no banco
+def gravada(tarefa_id: int) -> tuple:
+    db.session.expire_all()
+    return tuple(
+        db.session.execute(
+            select(
+                Tarefas.tarefas_status,
+                Tarefas.tarefas_dono,
+                Tarefas.tarefas_tentativas,
+            ).where(Tarefas.tarefas_id == tarefa_id)
+        ).one()
+    )
+
+
+# O worker parou de dar sinal há mais que a expiração
+def expirar(tarefa_id: int) -> None:
+    db.session.execute(
+        update(Tarefas)
+        .where(Tarefas.tarefas_id == tarefa_id)
+        .values(tarefas_atualizada=datetime.now() - EXPIRACAO_TAREFAS * 2)
+    )
+    db.session.commit()
+
+
+def test_tarefa_reservada_uma_vez_so(cliente):
+    tarefa_id = enviar(cliente)
+    assert _reservar("a").tarefas_id == tarefa_id
+    assert _reservar("b") is None
+    assert gravada(tarefa_id) == ("executando", "a", 1)
+
+
+def test_reserva_concorrente_perde_para_a_primeira(cliente):
+    tarefa_id = enviar(cliente)
+
+    # Outro worker reserva a tarefa entre a leitura e o UPDATE deste
+    reservas = []
+
+    def outro_worker(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE tarefas") and not reservas:
+            reservas.append(statement)
+            cursor.connection.execute(
+                "UPDATE tarefas SET tarefas_status = 'executando', "
+                "tarefas_dono = 'a', tarefas_tentativas = 1"
+            )
+
+    event.listen(db.engine, "before_cursor_execute", outro_worker)
+    try:
+        assert _reservar("b") is None
+    finally:
+        event.remove(db.engine, "before_cursor_execute", outro_worker)
+    assert len(reservas) == 1
+    assert gravada(tarefa_id) == ("executando", "a", 1)
+
+
+def test_tarefa_expirada_volta_para_a_fila(cliente):
+    tarefa_id = enviar(cliente)
+    assert _reservar("a") is not None
+    expirar(tarefa_id)
+
+    assert _reservar("b").tarefas_id == tarefa_id
+    assert gravada(tarefa_id) == ("executando", "b", 2)
+    # O worker antigo não grava mais nada da tarefa
+    with pytest.raises(TarefaPerdida):
+        ExecucaoTarefa(tarefa_id, "a", None).registrar(50, "metade")
+    db.session.rollback()
+
+
+def test_tarefa_interrompida_demais_vira_erro(cliente):
+    tarefa_id = enviar(cliente)
+    for tentativa in range(1, MAXIMO_TENTATIVAS + 1):
+        assert _reservar(f"w{tentativa}") is not None
+        expirar(tarefa_id)
+    assert _reservar("outro") is None
+    assert gravada(tarefa_id) == ("erro", f"w{MAXIMO_TENTATIVAS}", MAXIMO_TENTATIVAS)
+    tarefa = db.session.get(Tarefas, tarefa_id)
+    assert tarefa.tarefas_erro == f"Interrompida {MAXIMO_TENTATIVAS} vezes"
+
+
+# Queda do processo: escapa do tratamento de erros da tarefa
+class Queda(BaseException):
+    pass
+
+
+def test_importacao_retomada_do_ultimo_lote(
+    cliente, referencias_basicas, monkeypatch, tmp_path
+):
+    monkeypatch.setenv("TAREFAS_DIRETORIO", str(tmp_path))
+    monkeypatch.setattr(importacao, "LOTE_IMPORTACAO", 2)
+    linhas = "".join(
+        f"2024-01-{dia:02d};Compra {dia};-{dia},00\n" for dia in range(1, 8)
+    )
+    tarefa_id = enviar(
+        cliente,
+        "importar-lancamentos",
+        query_string={"conta": 1, "subcategoria": 1},
+        data={
+            "arquivo": (io.BytesIO(f"data;descricao;valor\n{linhas}".encode()), "x.csv")
+        },
+    )
+
+    # O processo cai depois do commit do segundo lote
+    registrar = ExecucaoTarefa.registrar
+
+    def registrar_e_cair(self, progresso, mensagem, estado=None):
+        if self.estado and self.estado["linha"] >= 5:
+            raise Queda()
+        registrar(self, progresso, mensagem, estado)
+
+    monkeypatch.setattr(ExecucaoTarefa, "registrar", registrar_e_cair)
+    with pytest.raises(Queda):
+        executar_proxima("a")
+    db.session.rollback()
+    assert db.session.scalar(select(func.count(Operacoes.operacoes_id))) == 4
+
+    monkeypatch.setattr(ExecucaoTarefa, "registrar", registrar)
+    expirar(tarefa_id)
+    assert executar_proxima("b")
+    assert gravada(tarefa_id) == ("concluida", "b", 2)
+    descricoes = db.session.scalars(
+        select(Operacoes.operacoes_descricao).order_by(Operacoes.operacoes_id)
+    ).all()
+    assert descricoes == [f"Compra {dia}" for dia in range(1, 8)]
+    resultado = cliente.get(f"/tarefas/{tarefa_id}/resultado").get_json()
+    assert resultado["importados"] == 7
+    assert not list(tmp_path.iterdir())
+    assert tarefas._em_execucao == {}